@@ -0,0 +1,23 @@
+import fs from 'fs';
+import path from 'path';
+
+const ROOT = path.resolve(__dirname, '../../..');
+
+// File JSON-lines chỉ ghi nối thêm; service Python (models/change_feed.py) đọc đuôi file để
+// xoá cache của user, cập nhật độ phổ biến và học online ngay khi có tương tác mới
+const FEED_PATH = process.env.RECO_FEED_PATH || path.join(ROOT, 'models', 'serving', 'interaction_feed.jsonl');
+
+let dirReady = null;
+
+export async function appendInteractionEvent(event) {
+  try {
+    dirReady = dirReady || fs.promises.mkdir(path.dirname(FEED_PATH), { recursive: true });
+    await dirReady;
+    // Mỗi sự kiện là một dòng, ghi bằng một lần append để không bị xen giữa các request
+    await fs.promises.appendFile(FEED_PATH, JSON.stringify({ ...event, ts: Date.now() }) + '\n');
+  } catch (e) {
+    // Feed chỉ để làm mới cache; lỗi ghi không được làm hỏng việc lưu tương tác
+    dirReady = null;
+    console.log(`[FEED] Không ghi được sự kiện tương tác: ${e?.message || e}`);
+  }
+}
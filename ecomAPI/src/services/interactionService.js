@@ -1,4 +1,5 @@
 import { Interaction, Allcode, Product, User } from '../models/index.js';
+import { appendInteractionEvent } from './interactionFeed.js';
 
 export async function logInteraction(userId, productId, actionCode, device) {
     // Kiểm tra actionCode có tồn tại trong Allcode
@@ -25,6 +26,16 @@ export async function logInteraction(userId, productId, actionCode, device) {
         timestamp: new Date()
     },{raw: true }); // Đảm bảo trả plain object
 
+    // Báo cho service gợi ý (không chờ, không chặn request)
+    appendInteractionEvent({
+        type: 'interaction',
+        interId: record.interId,
+        userId: Number(userId),
+        productId: Number(productId),
+        actionCode: action.code,
+        device_type: device || null
+    });
+
     return record;
 }
 
@@ -66,5 +77,7 @@ export async function getAllInteractions(filterActionCode = null) {
 }
 
 export async function deleteInteraction(userId, productId) {
-    return await Interaction.destroy({ where: { userId, productId } });
+    const deleted = await Interaction.destroy({ where: { userId, productId } });
+    appendInteractionEvent({ type: 'delete', userId: Number(userId), productId: Number(productId) });
+    return deleted;
 }
@@ -12,8 +12,40 @@ const DEFAULT_PYTHON =
 
 const PYTHON = process.env.PYTHON_BIN || DEFAULT_PYTHON;
 const SCRIPT = path.join(ROOT, 'models', 'recommend_api.py');
+// Khi có RECO_SERVICE_URL (vd: http://127.0.0.1:8010), gọi service Python chạy sẵn (models/recommend_server.py)
+const SERVICE_URL = process.env.RECO_SERVICE_URL || '';
+// Ngân sách thời gian gửi cho Python (budget_ms) = timeout trừ đi phần dự phòng để kịp trả kết quả
+const BUDGET_MARGIN_MS = 2000;
+
+function withBudget(payload, timeoutMs) {
+  const p = payload || {};
+  if (p.budget_ms != null) return p;
+  return { ...p, budget_ms: Math.max(0, timeoutMs - BUDGET_MARGIN_MS) };
+}
+
+async function runServiceInference(payload, { timeoutMs = 120000 } = {}) {
+  const controller = new AbortController();
+  const timer = setTimeout(() => controller.abort(), timeoutMs);
+  try {
+    const res = await fetch(`${SERVICE_URL.replace(/\/$/, '')}/recommend`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(withBudget(payload, timeoutMs)),
+      signal: controller.signal
+    });
+    if (!res.ok) return { ok: false, error: `http_${res.status}` };
+    return await res.json();
+  } catch (e) {
+    return { ok: false, error: e?.name === 'AbortError' ? 'timeout' : (e?.message || String(e)) };
+  } finally {
+    clearTimeout(timer);
+  }
+}
 
 function runPythonInference(payload, { timeoutMs = 120000 } = {}) {
+  if (SERVICE_URL) {
+    return runServiceInference(payload, { timeoutMs });
+  }
   return new Promise((resolve) => {
     try {
       // Môi trường cho tiến trình Python
@@ -84,7 +116,7 @@ function runPythonInference(payload, { timeoutMs = 120000 } = {}) {
       });
 
       // Gửi input cho Python
-      const inputData = JSON.stringify(payload || {});
+      const inputData = JSON.stringify(withBudget(payload, timeoutMs));
       console.log(`[PYTHON] Sending input data: ${inputData}`);
       ps.stdin.write(inputData + os.EOL);
       ps.stdin.end();
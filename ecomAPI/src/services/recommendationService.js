@@ -235,43 +235,27 @@ async function computeRecommendationsForUser(userId, limit=10) {
       category: null  // kept for backward compatibility
     };
 
-    // Run all models for evaluation and selection
-    const modelNames = ['ENCM','LNCM','NeuMF','BMF'];
+    // One Python call: the service picks the model per user segment (Thompson sampling over
+    // clicks/carts on earlier lists) instead of running every model and comparing them here
     const k = Math.max(1, Math.min(10, limit));
-
-    // Run the 4 model inferences sequentially
-    const parallel = [];
-    for (const name of modelNames) {
-      try {
-        // [DISABLED CLIENT-SIDE SEND]
-        // Re-enable by removing this conditional block.
-        if (['BMF','NeuMF','LNCM'].includes(name)) {
-          console.log(`[RECO] Skipping Python call for disabled model ${name}`);
-          parallel.push({ name, resp: { ok: false, error: 'disabled_client_side' } });
-          continue;
-        }
-        console.log(`[RECO] Calling model ${name}...`);
-        const resp = await pythonInvoker.runPythonInference({ user_id: userId, limit: k, model: name, context: ctxPayload });
-        console.log(`[RECO] Model ${name} response:`, {
-          ok: resp.ok,
-          hasItems: resp.items && Array.isArray(resp.items),
-          itemsLength: resp.items ? resp.items.length : 0,
-          error: resp.error
-        });
-        parallel.push({ name, resp });
-      } catch (e) {
-        console.log(`[RECO] Model ${name} exception:`, e);
-        parallel.push({ name, resp: { ok: false, error: e?.message || String(e) } });
-      }
+    let resp;
+    try {
+      console.log(`[RECO] Calling model auto...`);
+      resp = await pythonInvoker.runPythonInference({ user_id: userId, limit: k, model: 'auto', context: ctxPayload });
+      console.log(`[RECO] Model auto response:`, {
+        ok: resp.ok,
+        model: resp.model,
+        itemsLength: resp.items ? resp.items.length : 0,
+        error: resp.error
+      });
+    } catch (e) {
+      console.log(`[RECO] Model auto exception:`, e);
+      resp = { ok: false, error: e?.message || String(e) };
     }
 
-    console.log(`[RECO] All responses:`, parallel.map(p => ({ name: p.name, ok: p.resp.ok, error: p.resp.error })));
-    const modelRuns = [];
-    for (const { name, resp } of parallel) {
-      let recs = [];
-      if (resp && resp.ok && Array.isArray(resp.items)) {
-        recs = resp.items.map(it => ({ productId: it.productId, score: it.score || 0 }));
-      }
+    if (resp && resp.ok && Array.isArray(resp.items)) {
+      const recs = resp.items.map(it => ({ productId: it.productId, score: it.score || 0 }));
+      // MAP@10 / Precision@10 against cart+purchase history are kept for the modelruns log only
       let hits = 0; let sumPrec = 0;
       const denom = Math.max(1, Math.min(k, gtSet.size || 0));
       for (let i = 0; i < Math.min(k, recs.length); i++) {
@@ -280,12 +264,9 @@ async function computeRecommendationsForUser(userId, limit=10) {
       }
       const precision10 = recs.length ? (hits / k) : 0;
       const map10 = denom ? (sumPrec / denom) : 0;
-      modelRuns.push({ modelName: name, recommendations: recs.slice(0, k), metrics: { mode: 'python_infer', precision10, map10 } });
-    }
-    modelRuns.sort((a,b)=> (b.metrics.map10 - a.metrics.map10) || (b.metrics.precision10 - a.metrics.precision10));
-    if (modelRuns.length) {
-      const best = modelRuns[0];
-      return { bestModel: best.modelName, top: best.recommendations, modelRuns };
+      const modelName = resp.model || 'auto';
+      const modelRuns = [{ modelName, recommendations: recs.slice(0, k), metrics: { mode: 'python_infer', policy: 'thompson', precision10, map10 } }];
+      return { bestModel: modelName, top: modelRuns[0].recommendations, modelRuns };
     }
     // fall through to heuristic if Python failed
   } else {
@@ -0,0 +1,70 @@
+"""
+Admission control for recommendation computations
+Bounds how many computations run at once and how many wait; requests that would
+queue too long (or past their deadline) are shed and answered from precomputed popularity
+"""
+
+import os
+import threading
+import time
+
+MAX_CONCURRENT = int(os.environ.get('RECO_MAX_CONCURRENT', os.cpu_count() or 4))
+MAX_QUEUE_DEPTH = int(os.environ.get('RECO_MAX_QUEUE', 64))
+MAX_QUEUE_WAIT_SECONDS = float(os.environ.get('RECO_MAX_QUEUE_WAIT_MS', 500)) / 1000.0
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent=MAX_CONCURRENT, max_queue=MAX_QUEUE_DEPTH, max_wait=MAX_QUEUE_WAIT_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self.running = 0
+        self.waiting = 0
+        self.stats = {'admitted': 0, 'shed_queue_full': 0, 'shed_wait': 0, 'queue_seconds_total': 0.0}
+
+    def acquire(self, deadline=None):
+        """Take a computation slot; False means the request should be shed"""
+        with self._cond:
+            if self.running < self.max_concurrent and self.waiting == 0:
+                self.running += 1
+                self.stats['admitted'] += 1
+                return True
+            if self.waiting >= self.max_queue:
+                self.stats['shed_queue_full'] += 1
+                return False
+
+            enqueued = time.monotonic()
+            give_up = enqueued + self.max_wait
+            if deadline is not None:
+                give_up = min(give_up, deadline.expires)
+            self.waiting += 1
+            try:
+                while self.running >= self.max_concurrent:
+                    remaining = give_up - time.monotonic()
+                    if remaining <= 0:
+                        self.stats['shed_wait'] += 1
+                        return False
+                    self._cond.wait(remaining)
+                self.running += 1
+                self.stats['admitted'] += 1
+                self.stats['queue_seconds_total'] += time.monotonic() - enqueued
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.running -= 1
+            self._cond.notify()
+
+    def metrics(self):
+        with self._cond:
+            shed = self.stats['shed_queue_full'] + self.stats['shed_wait']
+            total = shed + self.stats['admitted']
+            return dict(
+                self.stats,
+                running=self.running,
+                queue_depth=self.waiting,
+                shed_rate=(shed / total) if total else 0.0,
+            )
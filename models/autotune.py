@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Per-host tuning of threads, prediction batch size and scoring chunk sizes
+A short benchmark on this machine and model set times model.predict at several
+batch sizes, the NumPy ENCM grid at several chunk sizes and the neighbour
+matrix products at several block sizes, once per (intra-op, inter-op) thread
+pair. TensorFlow fixes its thread pools at first use, so every pair runs in a
+fresh process. The fastest setting is stored under a key for the hardware in
+TUNE_PATH; every module reads TUNING, and RECO_* variables override it.
+
+Run from the repository root (recommend_server.py runs it at startup when
+RECO_AUTOTUNE=1 and this host has no entry yet):
+    python models/autotune.py
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+TUNE_PATH = os.environ.get('RECO_TUNE_PATH', 'models/serving/autotune.json')
+# Values in use before tuning; 0 threads lets TensorFlow size its own pools
+DEFAULTS = {
+    'intra_op_threads': 0,
+    'inter_op_threads': 0,
+    'predict_batch_size': 32,
+    'chunk_elements': 1 << 22,
+    'neighbour_block_elements': 1 << 24,
+}
+_OVERRIDES = {
+    'intra_op_threads': 'RECO_INTRA_OP_THREADS',
+    'inter_op_threads': 'RECO_INTER_OP_THREADS',
+    'predict_batch_size': 'RECO_PREDICT_BATCH_SIZE',
+    'chunk_elements': 'RECO_CHUNK_ELEMENTS',
+    'neighbour_block_elements': 'RECO_NEIGHBOUR_BLOCK_ELEMENTS',
+}
+BATCH_SIZES = (32, 128, 512, 2048, 8192)
+CHUNK_ELEMENTS = (1 << 18, 1 << 20, 1 << 22, 1 << 24)
+NEIGHBOUR_BLOCK_ELEMENTS = (1 << 20, 1 << 22, 1 << 24, 1 << 26)
+# Users per timed ENCM grid call, items per timed neighbour build
+GRID_USERS = 64
+NEIGHBOUR_ITEMS = 20000
+REPEATS = 3
+
+
+def host_key():
+    """Machine, CPU model and core count: what the best setting depends on"""
+    cpu = platform.processor() or ''
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            cpu = next((line.split(':', 1)[1].strip() for line in f if line.startswith('model name')), cpu)
+    except OSError:
+        pass
+    return f"{platform.machine()}|{cpu}|{os.cpu_count()}"
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Warning: ignoring unreadable tuning file {path}: {e}", file=sys.stderr)
+        return {}
+
+
+def load_tuning(path=TUNE_PATH):
+    """Defaults, then this host's stored entry, then RECO_* overrides"""
+    stored = _read(path).get(host_key(), {})
+    config = {key: int(stored.get(key, value)) for key, value in DEFAULTS.items()}
+    for key, env in _OVERRIDES.items():
+        if os.environ.get(env):
+            config[key] = int(os.environ[env])
+    return config
+
+
+# Read by recommend_api, embedding_tables, bulk_topn and item_neighbours at call time
+TUNING = load_tuning()
+
+
+def apply_threads(tf, config=TUNING):
+    """Size TensorFlow's pools; only possible before its first op runs"""
+    try:
+        if config['intra_op_threads']:
+            tf.config.threading.set_intra_op_parallelism_threads(config['intra_op_threads'])
+        if config['inter_op_threads']:
+            tf.config.threading.set_inter_op_parallelism_threads(config['inter_op_threads'])
+    except RuntimeError as e:
+        print(f"Warning: thread counts apply on the next start: {e}", file=sys.stderr)
+
+
+def _timed(fn):
+    """Best of REPEATS runs after one warm-up"""
+    fn()
+    best = float('inf')
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def measure():
+    """Timings of the loaded system under this process's thread settings (see run_autotune)"""
+    import numpy as np
+    from recommend_api import TrainedRecommendationSystem
+    from item_neighbours import build_neighbours, record_dtype, _unit_rows
+
+    reco_system = TrainedRecommendationSystem()
+    n_items = max(len(reco_system.catalog), reco_system.data_stats.get('n_items', 0), 1)
+    result = {'predict': {}, 'grid': {}, 'neighbours': {}}
+
+    for model_name, model in reco_system.models.items():
+        if not hasattr(model, 'predict'):
+            continue
+        n_model_items = reco_system.data_stats.get('n_items', n_items)
+        item_indices = np.arange(n_items) % max(1, n_model_items)
+        user_indices = np.zeros(n_items, dtype=np.int64)
+        inputs = [user_indices, item_indices]
+        if model_name == 'ENCM':
+            inputs.append(np.zeros((n_items, 10), dtype=np.int32))
+        result['predict'][model_name] = {
+            batch_size: _timed(lambda: model.predict(inputs, batch_size=batch_size, verbose=0))
+            for batch_size in BATCH_SIZES
+        }
+
+    tables = reco_system.tables.get('ENCM')
+    if tables is not None:
+        n_users = min(GRID_USERS, len(tables.user_vectors))
+        item_rows = np.arange(n_items) % tables.n_trained_items
+        item_context = np.zeros((n_items, 2), dtype=np.int32)
+        request_contexts = np.zeros((n_users, 8), dtype=np.int32)
+        result['grid'] = {
+            elements: _timed(lambda: tables.score_users(tables.user_vectors[:n_users], np.zeros(n_users), item_rows,
+                                                        item_context, request_contexts, max_elements=elements))
+            for elements in CHUNK_ELEMENTS
+        }
+
+    vectors = next((_unit_rows(t.item_vectors[:NEIGHBOUR_ITEMS]) for t in reco_system.tables.values()), None)
+    if vectors is not None:
+        out = np.zeros(len(vectors), dtype=record_dtype(50))
+        product_ids = np.arange(len(vectors))
+        result['neighbours'] = {
+            elements: _timed(lambda: build_neighbours(vectors, product_ids, out, block_elements=elements))
+            for elements in NEIGHBOUR_BLOCK_ELEMENTS
+        }
+    return result
+
+
+def _thread_pairs():
+    cpus = os.cpu_count() or 1
+    intra = sorted({1, 2, max(1, cpus // 2), cpus})
+    # (0, 0): TensorFlow's own sizing, so tuning never picks worse than the default
+    return [(0, 0)] + [(i, j) for i in intra for j in (1, 2)]
+
+
+def run_autotune(path=TUNE_PATH):
+    """Benchmark every thread pair in a child process and store the fastest setting for this host"""
+    runs = []
+    for intra, inter in _thread_pairs():
+        env = dict(os.environ, RECO_INTRA_OP_THREADS=str(intra), RECO_INTER_OP_THREADS=str(inter))
+        try:
+            child = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure'], env=env,
+                                   capture_output=True, text=True, timeout=900)
+            runs.append(((intra, inter), json.loads(child.stdout.strip().splitlines()[-1])))
+        except Exception as e:
+            print(f"Warning: benchmark with {intra}/{inter} threads failed: {e}", file=sys.stderr)
+    if not runs:
+        return None
+
+    def predict_seconds(run, batch_size):
+        return sum(timings[str(batch_size)] for timings in run['predict'].values())
+
+    # Threads and batch size together by total predict time over the loaded models
+    (intra, inter), run, batch_size = min(
+        ((pair, run, b) for pair, run in runs for b in BATCH_SIZES),
+        key=lambda x: predict_seconds(x[1], x[2]))
+    config = dict(DEFAULTS, intra_op_threads=intra, inter_op_threads=inter)
+    if run['predict']:
+        config['predict_batch_size'] = batch_size
+    # NumPy chunking does not depend on TensorFlow's pools; take it from the chosen run
+    if run['grid']:
+        config['chunk_elements'] = int(min(run['grid'], key=run['grid'].get))
+    if run['neighbours']:
+        config['neighbour_block_elements'] = int(min(run['neighbours'], key=run['neighbours'].get))
+
+    state = _read(path)
+    state[host_key()] = dict(config, tuned_at=time.strftime('%Y-%m-%d %H:%M:%S'), models=sorted(run['predict']))
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+    return config
+
+
+def ensure_tuned(tf, path=TUNE_PATH):
+    """Tune this host if it has no stored entry, then apply the result in place"""
+    if host_key() not in _read(path):
+        print(f"Autotuning {host_key()} ...", file=sys.stderr)
+        run_autotune(path)
+    TUNING.update(load_tuning(path))
+    apply_threads(tf, TUNING)
+    return TUNING
+
+
+def main():
+    if '--measure' in sys.argv[1:]:
+        sys.stdout.write(json.dumps(measure()) + '\n')
+        return
+    started = time.time()
+    config = run_autotune()
+    if config is None:
+        print("Autotune failed: no benchmark completed")
+        sys.exit(1)
+    print(f"{host_key()}: {json.dumps(config)} ({time.time() - started:.0f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Cross-request batching of per-user lookups (DataLoader pattern)
+Requests that need the same kind of per-user row within a short window are
+answered together by one `WHERE ... IN (...)` query per kind
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+
+BATCH_WINDOW_SECONDS = 0.002
+BATCH_MAX_KEYS = 256
+
+# Each query returns a `user_id` column used to hand rows back to the requesting user
+LOOKUP_QUERIES = {
+    'gender': """
+        SELECT id AS user_id, genderId
+        FROM users
+        WHERE id IN ({ids})
+    """,
+    'role': """
+        SELECT u.id AS user_id,
+               u.roleId,
+               a.value AS role_value,
+               a.code AS role_code
+        FROM users u
+        LEFT JOIN allcodes a
+          ON a.type = 'ROLE' AND a.code = u.roleId
+        WHERE u.id IN ({ids})
+    """,
+    'last_device': """
+        SELECT i.userId AS user_id, i.device_type
+        FROM interactions i
+        JOIN (
+            SELECT userId, MAX(timestamp) AS last_ts
+            FROM interactions
+            WHERE userId IN ({ids})
+            GROUP BY userId
+        ) latest ON latest.userId = i.userId AND latest.last_ts = i.timestamp
+    """,
+    'history_count': """
+        SELECT userId AS user_id, COUNT(*) AS cnt
+        FROM interactions
+        WHERE userId IN ({ids})
+          AND actionCode IN ('cart','purchase','view')
+        GROUP BY userId
+    """,
+}
+
+
+class BatchLookup:
+    """Collects per-user lookups from concurrent requests and resolves them in batches"""
+
+    def __init__(self, connect, window=BATCH_WINDOW_SECONDS, max_keys=BATCH_MAX_KEYS):
+        self._connect = connect       # factory for the dispatcher's own connection
+        self._conn = None
+        self.window = window
+        self.max_keys = max_keys
+        self._pending = {kind: {} for kind in LOOKUP_QUERIES}
+        self._cond = threading.Condition()
+        self._thread = None
+        self.stats = {'lookups': 0, 'queries': 0}
+
+    def load(self, kind, user_id, timeout=10.0):
+        """Rows of `kind` for one user; blocks until the batch containing it has run"""
+        return self.load_async(kind, user_id).result(timeout=timeout)
+
+    def load_async(self, kind, user_id):
+        future = Future()
+        with self._cond:
+            self._pending[kind].setdefault(int(user_id), []).append(future)
+            self.stats['lookups'] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='batch-lookup', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not any(self._pending.values()):
+                    self._cond.wait()
+            # Let concurrent requests join the batch before it is sent
+            time.sleep(self.window)
+            with self._cond:
+                batches = {}
+                for kind, waiting in self._pending.items():
+                    if not waiting:
+                        continue
+                    keys = list(waiting)[:self.max_keys]
+                    batches[kind] = {k: waiting.pop(k) for k in keys}
+            for kind, waiting in batches.items():
+                self._dispatch(kind, waiting)
+
+    def _dispatch(self, kind, waiting):
+        try:
+            rows_by_user = self._query(kind, list(waiting))
+        except Exception as e:
+            # Drop the connection so the next batch reconnects
+            self._conn = None
+            for futures in waiting.values():
+                for f in futures:
+                    f.set_exception(e)
+            return
+        for user_id, futures in waiting.items():
+            rows = rows_by_user.get(user_id, [])
+            for f in futures:
+                f.set_result(rows)
+
+    def _query(self, kind, user_ids):
+        if self._conn is None:
+            self._conn = self._connect()
+        # Ids are ints (cast in load_async), so inlining them is safe
+        sql = LOOKUP_QUERIES[kind].format(ids=', '.join(str(u) for u in user_ids))
+        cur = self._conn.cursor()
+        try:
+            cur.execute(sql)
+            columns = [d[0] for d in cur.description]
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+        self.stats['queries'] += 1
+
+        rows_by_user = {}
+        for row in rows:
+            record = dict(zip(columns, row))
+            rows_by_user.setdefault(int(record.pop('user_id')), []).append(record)
+        return rows_by_user
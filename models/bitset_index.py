@@ -0,0 +1,104 @@
+"""
+Packed-bitset inverted indexes over catalog positions
+One bitset per category, brand, price range and the active flag, plus per-user
+seen / purchased bitsets; request filters are combined with bitwise ops so only
+the surviving positions are scored
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Same bands as priceRange() in ecomAPI/src/services/recommendationService.js
+PRICE_RANGES = [('low', 0, 200000), ('mid', 200000, 1000000), ('high', 1000000, 3000000), ('premium', 3000000, np.inf)]
+
+USER_BITSETS_TTL_SECONDS = 10 * 60
+USER_BITSETS_MAX_USERS = 20000
+
+
+def pack(mask):
+    return np.packbits(np.asarray(mask, dtype=bool), bitorder='little')
+
+
+def unpack(bits, n):
+    return np.unpackbits(bits, count=n, bitorder='little').view(bool)
+
+
+class CatalogBitsets:
+    """Bitsets for one catalog version; rebuild when the catalog version changes"""
+
+    def __init__(self):
+        self.version = None
+        self.n = 0
+
+    def build(self, catalog, prices):
+        """prices: first product detail's discountPrice per catalog position (NaN when unknown)"""
+        self.n = len(catalog)
+        self.active = pack(catalog.active)
+        self.category = {c: pack(catalog.category_codes == code) for code, c in enumerate(catalog.categories) if c}
+        self.brand = {b: pack(catalog.brand_codes == code) for code, b in enumerate(catalog.brands) if b}
+        self.prices = prices
+        self.price_range = {name: pack((prices >= lo) & (prices < hi)) for name, lo, hi in PRICE_RANGES}
+        self.version = catalog.version
+
+    def _any_of(self, index, values):
+        bits = np.zeros_like(self.active)
+        for value in values:
+            if value in index:
+                bits |= index[value]
+        return bits
+
+    def filter_bits(self, filters=None, exclude=None):
+        """Active positions matching all filters, minus the `exclude` bitset"""
+        filters = filters or {}
+        bits = self.active.copy()
+        if filters.get('categories'):
+            bits &= self._any_of(self.category, filters['categories'])
+        if filters.get('brands'):
+            bits &= self._any_of(self.brand, filters['brands'])
+        if filters.get('price_ranges'):
+            bits &= self._any_of(self.price_range, filters['price_ranges'])
+        if exclude is not None:
+            bits &= ~exclude
+        return bits
+
+    def positions(self, filters=None, exclude=None):
+        """Catalog positions surviving the filters; price_min/price_max refine on exact prices"""
+        positions = np.flatnonzero(unpack(self.filter_bits(filters, exclude), self.n))
+        filters = filters or {}
+        if filters.get('price_min') is not None:
+            positions = positions[self.prices[positions] >= float(filters['price_min'])]
+        if filters.get('price_max') is not None:
+            positions = positions[self.prices[positions] <= float(filters['price_max'])]
+        return positions
+
+
+class UserBitsets:
+    """(seen, purchased) bitsets per user for one catalog version, LRU with a TTL"""
+
+    def __init__(self, ttl=USER_BITSETS_TTL_SECONDS, max_users=USER_BITSETS_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # user -> (catalog version, stored at, seen, purchased)
+
+    def get(self, user_id, version):
+        with self._lock:
+            entry = self._entries.get(str(user_id))
+            if entry is None or entry[0] != version or time.monotonic() - entry[1] > self.ttl:
+                return None
+            self._entries.move_to_end(str(user_id))
+            return entry[2], entry[3]
+
+    def put(self, user_id, version, seen, purchased):
+        with self._lock:
+            self._entries[str(user_id)] = (version, time.monotonic(), seen, purchased)
+            self._entries.move_to_end(str(user_id))
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Bulk top-N for every trained user, served as a lookup
+A batch job loads the models once, scores users against all active items in
+(users_block x items) blocks on a process pool and writes a versioned,
+memory-mapped store of int32 product ids and float16 scores per user. The
+service answers from the store while the current version is younger than
+TOPN_MAX_AGE_SECONDS and scores live otherwise.
+
+ENCM depends on the request context, so its lists are scored for the context
+bucket the job runs in (models/context_buckets.py), with the warm-user prior and
+preference calibration of the live path, and are only served to requests in
+that bucket.
+
+Run daily from the repository root:
+    python models/bulk_topn.py [N]
+"""
+
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from autotune import TUNING
+from context_buckets import bucket_of, bucket_start, bucket_time_context
+
+TOPN_DIR = 'models/serving/topn'
+TOPN_N = 100
+TOPN_MAX_AGE_SECONDS = int(os.environ.get('RECO_TOPN_MAX_AGE', 26 * 3600))
+TOPN_KEEP_VERSIONS = 2
+TOPN_RELOAD_SECONDS = 30
+# Users below this many interactions get the prior-blended cold-start path live
+TOPN_MIN_HISTORY = 10
+
+
+def topn_dtype(n):
+    # bucket: ENCM context bucket the list was scored for, -1 for context-free models
+    return np.dtype([('userId', '<i4'), ('items', '<i4', (n,)), ('scores', '<f2', (n,)), ('bucket', '<i2', (5,))])
+
+
+def _current_path(model_name, directory=TOPN_DIR):
+    return os.path.join(directory, model_name.lower(), 'CURRENT')
+
+
+class TopNStore:
+    """Read side: maps the current version of each model's store; O(1) row lookup by user id"""
+
+    def __init__(self, directory=TOPN_DIR, max_age=TOPN_MAX_AGE_SECONDS):
+        self.directory = directory
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._tables = {}   # model -> (pointer mtime, checked at, built_at, records, row of user id)
+        self.stats = {'hits': 0, 'stale': 0, 'misses': 0, 'other_bucket': 0}
+
+    def _table(self, model_name):
+        now = time.monotonic()
+        entry = self._tables.get(model_name)
+        if entry is not None and now - entry[1] < TOPN_RELOAD_SECONDS:
+            return entry
+        with self._lock:
+            pointer = _current_path(model_name, self.directory)
+            try:
+                mtime = os.path.getmtime(pointer)
+            except OSError:
+                entry = self._tables[model_name] = (None, now, 0.0, None, None)
+                return entry
+            if entry is None or entry[0] != mtime:
+                try:
+                    with open(pointer, 'r') as f:
+                        meta = json.load(f)
+                    records = np.load(os.path.join(os.path.dirname(pointer), meta['file']), mmap_mode='r')
+                    user_ids = np.asarray(records['userId'])
+                    row_of = np.full(int(user_ids.max()) + 1 if len(user_ids) else 0, -1, dtype=np.int32)
+                    row_of[user_ids] = np.arange(len(user_ids), dtype=np.int32)
+                    entry = (mtime, now, float(meta['built_at']), records, row_of)
+                except Exception as e:
+                    print(f"Warning: unreadable top-N store for {model_name}: {e}", file=sys.stderr)
+                    entry = (mtime, now, 0.0, None, None)
+            else:
+                entry = (mtime, now) + entry[2:]
+            self._tables[model_name] = entry
+            return entry
+
+    def lookup(self, model_name, user_id, bucket=None):
+        """(product ids, scores) precomputed for the user; None when absent, the store is stale or, given
+        the request's context `bucket`, the list was scored for another one"""
+        _, _, built_at, records, row_of = self._table(model_name)
+        if records is None:
+            return None
+        if time.time() - built_at > self.max_age:
+            self.stats['stale'] += 1
+            return None
+        user_id = int(user_id)
+        row = row_of[user_id] if 0 <= user_id < len(row_of) else -1
+        if row < 0:
+            self.stats['misses'] += 1
+            return None
+        record = records[row]
+        if bucket is not None:
+            built_for = tuple(int(b) for b in record['bucket']) if 'bucket' in records.dtype.names else None
+            if built_for != tuple(bucket):
+                self.stats['other_bucket'] += 1
+                return None
+        keep = record['items'] >= 0
+        self.stats['hits'] += 1
+        return record['items'][keep], record['scores'][keep].astype(np.float32)
+
+
+def top_n(scores, n):
+    """Column indices and scores of each row's n best, best first"""
+    width = min(n, scores.shape[1])
+    top = np.argpartition(-scores, width - 1, axis=1)[:, :width]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def encm_calibrated(scores, priors, preferred):
+    """Warm-user ENCM calibration: + 0.15 x the context prior, + 0.07 for preferred items whose
+    prior is at least 0.25"""
+    return scores + 0.15 * priors + 0.07 * (preferred & (priors >= 0.25))
+
+
+def user_preferences(reco_system, user_ids):
+    """(preferred categories, preferred brands) of each user from their latest 50 cart/purchase
+    interactions, as get_user_context reads them; one query per 1000 users"""
+    conn = reco_system.db_connection
+    parts = []
+    for start in range(0, len(user_ids), 1000):
+        ids = ','.join(str(int(u)) for u in user_ids[start:start + 1000])
+        parts.append(pd.read_sql(f"""
+            SELECT i.userId, i.timestamp, p.categoryId, p.brandId
+            FROM interactions i
+            JOIN products p ON i.productId = p.id
+            WHERE i.userId IN ({ids}) AND i.actionCode IN ('cart', 'purchase')
+        """, conn))
+    preferences = {}
+    if parts:
+        rows = pd.concat(parts, ignore_index=True)
+        rows = rows.sort_values('timestamp', ascending=False, kind='stable').groupby('userId').head(50)
+        for user_id, group in rows.groupby('userId'):
+            preferences[int(user_id)] = (set(group['categoryId'].dropna()), set(group['brandId'].dropna()))
+    return [preferences.get(int(u), (set(), set())) for u in user_ids]
+
+
+class WarmCalibration:
+    """The live warm-user ENCM calibration for fixed users and candidates in one time context:
+    priors per gender and each user's preferences, read once when built"""
+
+    def __init__(self, reco_system, catalog, positions, product_ids, users, time_context):
+        genders = [g if g in ('M', 'FE', 'O') else 'unknown' for g in users['genderId']]
+        groups = sorted(set(genders))
+        self.priors = [reco_system._context_priors(dict(time_context, gender=g), product_ids) for g in groups]
+        self.prior_row = [groups.index(g) for g in genders]
+        self.preferences = user_preferences(reco_system, users['user_id'].values)
+        self.catalog = catalog
+        self.positions = positions
+        self._masks = reco_system._preference_masks
+
+    def apply(self, scores, start):
+        """Calibrated scores of a block of users starting at row `start`"""
+        out = np.empty(scores.shape, dtype=np.float64)
+        for i in range(len(scores)):
+            categories, brands = self.preferences[start + i]
+            brand_hit, category_hit = self._masks(self.catalog, self.positions, brands, categories)
+            out[i] = encm_calibrated(scores[i], self.priors[self.prior_row[start + i]], brand_hit | category_hit)
+        return out
+
+
+# ---- batch job ----------------------------------------------------------
+
+# Set in the parent before the pool forks, so workers share the tables without pickling
+_JOB = {}
+
+
+def _score_block(bounds):
+    start, stop = bounds
+    job = _JOB
+    tables, n = job['tables'], job['n']
+    user_contexts = job['user_contexts'][start:stop] if job['user_contexts'] is not None else None
+    scores = tables.score_users(job['user_vecs'][start:stop], job['user_biases'][start:stop], job['item_rows'],
+                                job['item_context'], user_contexts)
+    if job['calibration'] is not None:
+        scores = job['calibration'].apply(scores, start)
+    top, top_scores = top_n(scores, n)
+    width = top.shape[1]
+    out = np.load(job['path'], mmap_mode='r+')
+    out['items'][start:stop, :width] = job['product_ids'][top]
+    out['scores'][start:stop, :width] = top_scores
+    out.flush()
+    return stop - start
+
+
+def build_store(model_name, tables, user_ids, user_vecs, user_biases, product_ids, item_rows, item_context=None,
+                user_contexts=None, n=TOPN_N, directory=TOPN_DIR, workers=None, calibration=None):
+    """Write a new version of the model's store and point CURRENT at it (ENCM: each list tagged with
+    the context bucket of its user's context row)"""
+    model_dir = os.path.join(directory, model_name.lower())
+    os.makedirs(model_dir, exist_ok=True)
+    version = time.strftime('%Y%m%d%H%M%S')
+    file_name = f'topn_{version}.npy'
+    path = os.path.join(model_dir, file_name)
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=topn_dtype(n), shape=(len(user_ids),))
+    out['userId'] = user_ids
+    out['items'] = -1
+    out['scores'] = 0
+    out['bucket'] = -1
+    if user_contexts is not None:
+        out['bucket'] = [bucket_of(row) for row in user_contexts]
+    out.flush()
+    del out
+
+    hidden = tables.dense[0][0].shape[1] if tables.kind == 'ENCM' else 1
+    # Scores held per worker block: users x items (x ENCM hidden width)
+    block = max(1, TUNING['chunk_elements'] // max(1, len(item_rows) * hidden))
+    _JOB.update(tables=tables, n=n, path=path, user_vecs=user_vecs, user_biases=user_biases,
+                product_ids=np.asarray(product_ids, dtype=np.int32), item_rows=item_rows,
+                item_context=item_context, user_contexts=user_contexts, calibration=calibration)
+    bounds = [(s, min(s + block, len(user_ids))) for s in range(0, len(user_ids), block)]
+    with multiprocessing.get_context('fork').Pool(workers or os.cpu_count()) as pool:
+        scored = sum(pool.imap_unordered(_score_block, bounds))
+    _JOB.clear()
+
+    tmp_pointer = f"{_current_path(model_name, directory)}.{os.getpid()}.tmp"
+    with open(tmp_pointer, 'w') as f:
+        json.dump({'file': file_name, 'version': version, 'built_at': time.time(), 'users': int(scored), 'n': n}, f)
+    os.replace(tmp_pointer, _current_path(model_name, directory))
+    # Readers may still map the previous version; keep it, drop the older ones
+    versions = sorted(f for f in os.listdir(model_dir) if f.startswith('topn_') and f.endswith('.npy'))
+    for old in versions[:-TOPN_KEEP_VERSIONS]:
+        os.remove(os.path.join(model_dir, old))
+    return path
+
+
+def user_frame(reco_system, user_ids):
+    """Gender, last device and history count of every user, one query per kind and 1000 users"""
+    from batch_lookup import LOOKUP_QUERIES
+
+    conn = reco_system.db_connection
+    frame = pd.DataFrame({'user_id': user_ids})
+    for kind in ('gender', 'last_device', 'history_count'):
+        parts = []
+        for start in range(0, len(user_ids), 1000):
+            ids = ','.join(str(int(u)) for u in user_ids[start:start + 1000])
+            parts.append(pd.read_sql(LOOKUP_QUERIES[kind].format(ids=ids), conn))
+        rows = pd.concat(parts, ignore_index=True).drop_duplicates('user_id') if parts else pd.DataFrame({'user_id': []})
+        frame = frame.merge(rows, on='user_id', how='left')
+    frame['cnt'] = frame['cnt'].fillna(0).astype(int)
+    return frame
+
+
+def encm_user_contexts(reco_system, users, time_context=None):
+    """ENCM context rows for user_frame rows: each user's own gender and device; time columns
+    from `time_context` (get_user_context keys) or as of now"""
+    rows = [
+        reco_system._encm_context_row(reco_system.get_user_context(int(row.user_id), dict(
+            time_context or {},
+            gender=row.genderId if row.genderId in ['M', 'FE', 'O'] else 'unknown',
+            device_type=row.device_type if isinstance(row.device_type, str) else 'unknown',
+            preferred_categories=[], preferred_brands=[],
+        )))
+        for row in users.itertuples()
+    ]
+    return np.stack(rows) if rows else np.zeros((0, 8), dtype=np.int32)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else TOPN_N
+    from recommend_api import TrainedRecommendationSystem
+
+    reco_system = TrainedRecommendationSystem()
+    reco_system.catalog_cache.refresh(reco_system.db_connection)
+    catalog = reco_system.catalog
+    reco_system._refresh_cold_items(catalog)
+    cand_pos = catalog.active_positions()
+
+    for model_name, tables in reco_system.tables.items():
+        started = time.time()
+        product_ids = catalog.ids[cand_pos]
+        item_rows = reco_system._item_rows(tables, product_ids)
+        scorable = item_rows >= 0
+        positions, product_ids, item_rows = cand_pos[scorable], product_ids[scorable], item_rows[scorable]
+        if not len(item_rows):
+            print(f"Skipping {model_name}: no scorable active products")
+            continue
+
+        user_classes = reco_system._user_encoder(tables).classes_
+        n_users = min(len(tables.user_vectors), len(user_classes))
+        user_ids = user_classes[:n_users].astype(np.int64)
+        users = user_frame(reco_system, user_ids)
+        warm = (users['cnt'] >= TOPN_MIN_HISTORY).values
+        user_rows = np.flatnonzero(warm)
+        user_vecs = tables.user_vectors[user_rows]
+        user_biases = tables.user_bias[user_rows] if tables.user_bias is not None else np.zeros(len(user_rows))
+
+        item_context = user_contexts = calibration = None
+        if tables.kind == 'ENCM':
+            category_codes, brand_codes = reco_system._encm_item_codes(catalog)
+            item_context = np.stack([category_codes[positions], brand_codes[positions]], axis=1)
+            # Scored for the bucket the job runs in; requests in other buckets use context_buckets or live
+            time_context = bucket_time_context(bucket_start(datetime.now()))
+            user_contexts = encm_user_contexts(reco_system, users[warm], time_context)
+            calibration = WarmCalibration(reco_system, catalog, positions, product_ids, users[warm], time_context)
+
+        path = build_store(model_name, tables, user_ids[user_rows], user_vecs, user_biases, product_ids, item_rows,
+                           item_context, user_contexts, n, calibration=calibration)
+        print(f"{model_name}: {len(user_rows)} users x {len(item_rows)} items -> {path} ({time.time() - started:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+"""
+In-memory product catalog for real-time inference
+Holds products as column arrays, refreshes incrementally from the database and keeps
+an on-disk snapshot so a restarted process serves from it without waiting for the
+database; stale snapshots are refreshed on a background thread. Each refresh publishes
+a new immutable CatalogSnapshot by swapping one reference, so a request that took the
+current snapshot keeps consistent positions until it is done.
+"""
+
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+CATALOG_SNAPSHOT_PATH = 'models/serving/catalog_snapshot.npz'
+CATALOG_REFRESH_SECONDS = 30
+CATALOG_FULL_RELOAD_SECONDS = 24 * 3600
+
+_PRODUCT_COLUMNS = "id, name, categoryId, brandId, statusId, updatedAt"
+_ARRAYS = ('ids', 'name_offsets', 'name_blob', 'category_codes', 'brand_codes', 'active')
+
+
+def _frozen(array):
+    array.setflags(write=False)
+    return array
+
+
+def _patched(column, updates, added):
+    """Copy of a column with {position: value} updates applied and `added` values appended"""
+    if not updates and not added:
+        return column
+    out = np.concatenate([column, np.array(added, dtype=column.dtype)])
+    if updates:
+        out[list(updates)] = list(updates.values())
+    return out
+
+
+class CatalogSnapshot:
+    """One version of the product table as column arrays (id, name offsets, category code, brand code,
+    active flag); never modified after it is built"""
+
+    def __init__(self, ids=None, name_offsets=None, name_blob=None, category_codes=None, brand_codes=None,
+                 active=None, categories=('',), brands=('',), version=0, synced_at=None, full_loaded_at=0.0):
+        self.ids = _frozen(np.zeros(0, dtype=np.int64) if ids is None else ids)
+        self.name_offsets = _frozen(np.zeros(1, dtype=np.int64) if name_offsets is None else name_offsets)
+        self.name_blob = _frozen(np.zeros(0, dtype=np.uint8) if name_blob is None else name_blob)
+        self.category_codes = _frozen(np.zeros(0, dtype=np.int32) if category_codes is None else category_codes)
+        self.brand_codes = _frozen(np.zeros(0, dtype=np.int32) if brand_codes is None else brand_codes)
+        self.active = _frozen(np.zeros(0, dtype=bool) if active is None else active)
+        self.categories = tuple(categories)
+        self.brands = tuple(brands)
+        self.version = version
+        self.synced_at = synced_at              # newest products.updatedAt seen so far
+        self.full_loaded_at = full_loaded_at    # wall clock of the last full table read
+        self._sorted_order = _frozen(np.argsort(self.ids, kind='stable'))
+        self._sorted_ids = _frozen(self.ids[self._sorted_order])
+
+    def __len__(self):
+        return len(self.ids)
+
+    # ---- column access -------------------------------------------------
+
+    def name(self, pos):
+        start, end = self.name_offsets[pos], self.name_offsets[pos + 1]
+        return bytes(self.name_blob[start:end]).decode('utf-8')
+
+    def names(self, positions):
+        return [self.name(int(p)) for p in positions]
+
+    def category_id(self, pos):
+        return self.categories[self.category_codes[pos]] or None
+
+    def brand_id(self, pos):
+        return self.brands[self.brand_codes[pos]] or None
+
+    def active_positions(self):
+        return np.flatnonzero(self.active)
+
+    def positions_of(self, product_ids):
+        """Map product ids to catalog positions (-1 when the id is unknown)"""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.full(len(product_ids), -1, dtype=np.int64)
+        slot = np.searchsorted(self._sorted_ids, product_ids)
+        slot = np.minimum(slot, len(self._sorted_ids) - 1)
+        found = self._sorted_ids[slot] == product_ids
+        return np.where(found, self._sorted_order[slot], -1)
+
+    def to_frame(self):
+        """Active products as a DataFrame with the legacy products query columns"""
+        pos = self.active_positions()
+        return pd.DataFrame({
+            'id': self.ids[pos],
+            'name': pd.Series(self.names(pos), dtype=object),
+            'categoryId': pd.Series([self.categories[c] or None for c in self.category_codes[pos]], dtype=object),
+            'brandId': pd.Series([self.brands[b] or None for b in self.brand_codes[pos]], dtype=object),
+        })
+
+    # ---- building ------------------------------------------------------
+
+    @classmethod
+    def from_rows(cls, rows, version=0, synced_at=None, full_loaded_at=0.0):
+        """Snapshot of (id, name, categoryId, brandId, statusId, updatedAt) rows"""
+        rows = sorted(rows, key=lambda r: int(r[0]))
+        categories, brands = {'': 0}, {'': 0}
+        encoded_names = [(r[1] or '').encode('utf-8') for r in rows]
+        name_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        if rows:
+            name_offsets[1:] = np.cumsum([len(n) for n in encoded_names])
+        stamps = [r[5] for r in rows if r[5] is not None]
+        if stamps and (synced_at is None or max(stamps) > synced_at):
+            synced_at = max(stamps)
+        return cls(
+            ids=np.array([int(r[0]) for r in rows], dtype=np.int64),
+            name_offsets=name_offsets,
+            name_blob=np.frombuffer(b''.join(encoded_names), dtype=np.uint8).copy(),
+            category_codes=np.array([categories.setdefault(r[2] or '', len(categories)) for r in rows], dtype=np.int32),
+            brand_codes=np.array([brands.setdefault(r[3] or '', len(brands)) for r in rows], dtype=np.int32),
+            active=np.array([r[4] == 'S1' for r in rows], dtype=bool),
+            categories=categories,
+            brands=brands,
+            version=version,
+            synced_at=synced_at,
+            full_loaded_at=full_loaded_at,
+        )
+
+    def merged(self, rows):
+        """(snapshot with the changed product rows applied, whether anything actually changed).
+        Known products keep their positions and new ones are appended, so a delta only patches
+        the columns it touches; the other arrays are shared with this snapshot."""
+        newest = self.synced_at
+        latest = {}
+        for r in rows:
+            latest[int(r[0])] = r
+            if r[5] is not None and (newest is None or r[5] > newest):
+                newest = r[5]
+        category_index = {c: code for code, c in enumerate(self.categories)}
+        brand_index = {b: code for code, b in enumerate(self.brands)}
+        names, categories, brands, active = {}, {}, {}, {}   # position -> new value
+        added = []
+        product_ids = np.fromiter(latest, dtype=np.int64, count=len(latest))
+        for pid, pos in zip(product_ids.tolist(), self.positions_of(product_ids).tolist()):
+            r = latest[pid]
+            name = (r[1] or '').encode('utf-8')
+            category = category_index.setdefault(r[2] or '', len(category_index))
+            brand = brand_index.setdefault(r[3] or '', len(brand_index))
+            is_active = r[4] == 'S1'
+            if pos < 0:
+                added.append((pid, name, category, brand, is_active))
+                continue
+            if name != bytes(self.name_blob[self.name_offsets[pos]:self.name_offsets[pos + 1]]):
+                names[pos] = name
+            if category != self.category_codes[pos]:
+                categories[pos] = category
+            if brand != self.brand_codes[pos]:
+                brands[pos] = brand
+            if is_active != self.active[pos]:
+                active[pos] = is_active
+
+        changed = bool(added or names or categories or brands or active)
+        columns = {name: getattr(self, name) for name in _ARRAYS}
+        if changed:
+            if added:
+                columns['ids'] = np.concatenate([self.ids, np.array([a[0] for a in added], dtype=np.int64)])
+            columns['category_codes'] = _patched(self.category_codes, categories, [a[2] for a in added])
+            columns['brand_codes'] = _patched(self.brand_codes, brands, [a[3] for a in added])
+            columns['active'] = _patched(self.active, active, [a[4] for a in added])
+            if names or added:
+                columns['name_offsets'], columns['name_blob'] = self._patched_names(names, [a[1] for a in added])
+        return CatalogSnapshot(**columns, categories=list(category_index), brands=list(brand_index),
+                               version=self.version + 1 if changed else self.version, synced_at=newest,
+                               full_loaded_at=self.full_loaded_at), changed
+
+    def _patched_names(self, names, added):
+        """(name offsets, name blob) with the names at `names` positions replaced and `added` appended"""
+        pieces, start = [], 0
+        for pos in sorted(names):
+            pieces.append(self.name_blob[self.name_offsets[start]:self.name_offsets[pos]])
+            pieces.append(np.frombuffer(names[pos], dtype=np.uint8))
+            start = pos + 1
+        pieces.append(self.name_blob[self.name_offsets[start]:])
+        pieces.extend(np.frombuffer(name, dtype=np.uint8) for name in added)
+        lengths = np.diff(self.name_offsets)
+        lengths[list(names)] = [len(names[pos]) for pos in names]
+        lengths = np.concatenate([lengths, np.array([len(name) for name in added], dtype=np.int64)])
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        return offsets, np.concatenate(pieces)
+
+    # ---- snapshot file -------------------------------------------------
+
+    def save(self, path, refreshed_at=0.0):
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    **{name: getattr(self, name) for name in _ARRAYS},
+                    categories=np.array(self.categories, dtype=str),
+                    brands=np.array(self.brands, dtype=str),
+                    version=np.int64(self.version),
+                    synced_at=np.array(self.synced_at.isoformat() if self.synced_at else ''),
+                    refreshed_at=np.float64(refreshed_at),
+                    full_loaded_at=np.float64(self.full_loaded_at),
+                )
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Warning: could not write catalog snapshot: {e}", file=sys.stderr)
+
+    @classmethod
+    def load(cls, path):
+        """(snapshot, refreshed_at) from the on-disk file; None when there is none or it is unreadable"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as snap:
+                synced_at = str(snap['synced_at'])
+                snapshot = cls(
+                    **{name: snap[name] for name in _ARRAYS},
+                    categories=[str(c) for c in snap['categories']],
+                    brands=[str(b) for b in snap['brands']],
+                    version=int(snap['version']),
+                    synced_at=datetime.fromisoformat(synced_at) if synced_at else None,
+                    full_loaded_at=float(snap['full_loaded_at']),
+                )
+                return snapshot, float(snap['refreshed_at'])
+        except Exception as e:
+            print(f"Warning: ignoring unreadable catalog snapshot: {e}", file=sys.stderr)
+            return None
+
+
+class CatalogCache:
+    """The current CatalogSnapshot behind one reference; refreshes run one at a time and swap it.
+    Readers take `current` (or the return of ensure_fresh) once and use that snapshot throughout."""
+
+    def __init__(self, path=CATALOG_SNAPSHOT_PATH):
+        self.path = path
+        self.current = CatalogSnapshot()
+        self.refreshed_at = 0.0     # wall clock of the last successful refresh
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.current)
+
+    @property
+    def version(self):
+        return self.current.version
+
+    def load(self):
+        """Serve the on-disk snapshot; returns False when there is none or it is unreadable"""
+        loaded = CatalogSnapshot.load(self.path)
+        if loaded is None:
+            return False
+        self.current, self.refreshed_at = loaded
+        return True
+
+    # ---- database sync -------------------------------------------------
+
+    def refresh(self, conn, force_full=False):
+        """Pull products changed since the last sync; full reload when stale or out of step"""
+        with self._lock:
+            return self._refresh(conn, force_full)
+
+    def _refresh(self, conn, force_full):
+        current = self.current
+        now = time.time()
+        full = force_full or current.synced_at is None or (now - current.full_loaded_at) > CATALOG_FULL_RELOAD_SECONDS
+        cur = conn.cursor()
+        try:
+            if not full:
+                # Re-read the boundary second too; unchanged rows are ignored by the merge
+                cur.execute(f"SELECT {_PRODUCT_COLUMNS} FROM products WHERE updatedAt >= %s", (current.synced_at,))
+                snapshot, changed = current.merged(cur.fetchall())
+                # Deleted rows never show up in the delta, a count mismatch means one happened
+                cur.execute("SELECT COUNT(*) FROM products")
+                full = int(cur.fetchone()[0]) != len(snapshot)
+            if full:
+                cur.execute(f"SELECT {_PRODUCT_COLUMNS} FROM products")
+                snapshot = CatalogSnapshot.from_rows(cur.fetchall(), current.version + 1, full_loaded_at=now)
+                changed = True
+        finally:
+            cur.close()
+
+        self.refreshed_at = now
+        self.current = snapshot
+        if changed:
+            snapshot.save(self.path, now)
+        return changed
+
+    def ensure_fresh(self, connect, max_age=CATALOG_REFRESH_SECONDS):
+        """Current snapshot. Only an empty catalog is loaded before returning; one older than max_age
+        keeps being served while a background thread refreshes it with its own `connect()` connection."""
+        current = self.current
+        if len(current) and time.time() - self.refreshed_at < max_age:
+            return current
+        if not len(current):
+            with self._lock:
+                if not len(self.current):
+                    self._refresh_with(connect)
+            return self.current
+        # One refresh at a time; the thread releases the lock when it is done
+        if self._lock.acquire(blocking=False):
+            try:
+                threading.Thread(target=self._background_refresh, args=(connect,), name='catalog-refresh',
+                                 daemon=True).start()
+            except Exception:
+                self._lock.release()
+                raise
+        return current
+
+    def _refresh_with(self, connect):
+        conn = connect()
+        try:
+            return self._refresh(conn, False)
+        finally:
+            conn.close()
+
+    def _background_refresh(self, connect):
+        try:
+            self._refresh_with(connect)
+        except Exception as e:
+            print(f"Warning: catalog refresh failed, serving snapshot v{self.current.version}: {e}", file=sys.stderr)
+        finally:
+            self._lock.release()
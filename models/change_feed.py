@@ -0,0 +1,128 @@
+"""
+Interaction change feed
+The Node API appends one JSON line per interaction to an append-only file
+(ecomAPI/src/services/interactionFeed.js); the service tails it and hands each
+event to a callback. Single machine, no broker: the file is the queue.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+FEED_PATH = os.environ.get('RECO_FEED_PATH', 'models/serving/interaction_feed.jsonl')
+FEED_POLL_SECONDS = 0.2
+FEED_MAX_LINES_PER_POLL = 1000
+# Past this size the reader rotates the file to <path>.1; the writer reopens per append
+FEED_ROTATE_BYTES = 64 * 1024 * 1024
+# A line still incomplete this long after its file was rotated away is dropped
+FEED_PARTIAL_GRACE_SECONDS = 5.0
+
+
+class ChangeFeed:
+    """Tails the feed file from its current end and calls `handler(event)` per line"""
+
+    def __init__(self, handler, path=FEED_PATH, rotate_bytes=FEED_ROTATE_BYTES):
+        self.handler = handler
+        self.path = path
+        self.rotate_bytes = rotate_bytes
+        self._file = None
+        self._inode = None
+        self._partial = b''
+        self._partial_since = None
+        # Events already in the file at start-up are reflected in MySQL; skip them once
+        self._skip_existing = True
+        self.stats = {'events': 0, 'errors': 0, 'rotations': 0, 'max_handle_ms': 0.0}
+
+    def _open(self, from_end):
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+        if from_end:
+            f.seek(0, os.SEEK_END)
+        self._file = f
+        self._inode = os.fstat(f.fileno()).st_ino
+        return True
+
+    def _replaced(self):
+        """True when the path now names a different file than the one being read"""
+        try:
+            return os.stat(self.path).st_ino != self._inode
+        except FileNotFoundError:
+            return False
+
+    def poll(self):
+        """Handle complete lines appended since the last call; returns how many were handled"""
+        if self._file is None:
+            opened = self._open(from_end=self._skip_existing)
+            self._skip_existing = False
+            if not opened:
+                return 0
+        handled = 0
+        while handled < FEED_MAX_LINES_PER_POLL:
+            line = self._file.readline()
+            if not line:
+                # Drained: follow a rotation (by us or anyone) to the new file
+                if self._replaced():
+                    if self._partial and time.monotonic() - self._partial_since < FEED_PARTIAL_GRACE_SECONDS:
+                        # The rest of a line begun here is written to this (renamed) file; wait for it
+                        break
+                    if self._partial:
+                        self.stats['errors'] += 1
+                        print(f"Warning: dropped incomplete change feed line {self._partial[:200]!r}", file=sys.stderr)
+                        self._partial = b''
+                    self._file.close()
+                    self._file = None
+                    self._open(from_end=False)
+                    if self._file is None:
+                        break
+                    continue
+                break
+            if not line.endswith(b'\n'):
+                # Writer is mid-line; keep the fragment for the next poll
+                if not self._partial:
+                    self._partial_since = time.monotonic()
+                self._partial += line
+                continue
+            line, self._partial = self._partial + line, b''
+            self._dispatch(line)
+            handled += 1
+        self._maybe_rotate()
+        return handled
+
+    def _dispatch(self, line):
+        started = time.monotonic()
+        try:
+            event = json.loads(line)
+            self.handler(event)
+            self.stats['events'] += 1
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"Warning: bad change feed event {line[:200]!r}: {e}", file=sys.stderr)
+        elapsed_ms = (time.monotonic() - started) * 1000.0
+        self.stats['max_handle_ms'] = max(self.stats['max_handle_ms'], elapsed_ms)
+
+    def _maybe_rotate(self):
+        try:
+            if self._file is not None and os.fstat(self._file.fileno()).st_size > self.rotate_bytes and not self._replaced():
+                # Keep reading the renamed file to its end; new appends create a fresh file
+                os.replace(self.path, self.path + '.1')
+                self.stats['rotations'] += 1
+        except OSError as e:
+            print(f"Warning: could not rotate change feed: {e}", file=sys.stderr)
+
+    def start(self, interval=FEED_POLL_SECONDS):
+        def loop():
+            while True:
+                try:
+                    if not self.poll():
+                        time.sleep(interval)
+                except Exception as e:
+                    print(f"Warning: change feed poll failed: {e}", file=sys.stderr)
+                    time.sleep(interval)
+
+        thread = threading.Thread(target=loop, name='change-feed', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+"Frequently bought together" lists from interaction co-occurrence
+Cart and purchase events are grouped into baskets (one user's events with no gap
+longer than BASKET_GAP_SECONDS); each basket is a sparse row of action weights
+and the item x item matrix accumulates B^T B batch by batch, so nothing dense
+is ever built. Later runs only read interactions newer than the last one seen.
+The top-K per item is written in the neighbour-file format of item_neighbours.py.
+
+Build or update from the repository root (recommend_server.py also updates it):
+    python models/co_occurrence.py [--rebuild]
+"""
+
+import os
+import pickle
+import sys
+import threading
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+from fold_in import ACTION_WEIGHTS
+from item_neighbours import write_records, neighbours_path, NEIGHBOURS_DIR
+from storage import STORAGE
+
+CO_OCCURRENCE_NAME = 'bought_together'
+CO_OCCURRENCE_STATE_PATH = 'models/serving/co_occurrence_state.pkl'
+CO_OCCURRENCE_K = 50
+CO_OCCURRENCE_BATCH_ROWS = 50000
+CO_OCCURRENCE_REFRESH_SECONDS = 60
+BASKET_GAP_SECONDS = 30 * 60
+
+_BASKET_INTERACTIONS_QUERY = f"""
+    SELECT interId, userId, productId, actionCode, {STORAGE.unix_time('timestamp')}
+    FROM interactions
+    WHERE interId > %s AND actionCode IN ('cart', 'purchase')
+    ORDER BY interId
+    LIMIT {CO_OCCURRENCE_BATCH_ROWS}
+"""
+
+
+def _basket_matrix(baskets, n):
+    """Sparse (len(baskets) x n) rows of {productId: weight} dicts"""
+    rows = np.repeat(np.arange(len(baskets)), [len(b) for b in baskets])
+    cols = np.fromiter((pid for b in baskets for pid in b), dtype=np.int64, count=len(rows))
+    data = np.fromiter((w for b in baskets for w in b.values()), dtype=np.float64, count=len(rows))
+    return sp.csr_matrix((data, (rows, cols)), shape=(len(baskets), n))
+
+
+class CoOccurrence:
+    """Weighted item x item co-occurrence (indexed by productId) plus the baskets still open"""
+
+    def __init__(self, path=CO_OCCURRENCE_STATE_PATH, k=CO_OCCURRENCE_K, directory=NEIGHBOURS_DIR):
+        self.path = path
+        self.k = k
+        self.directory = directory
+        self.matrix = sp.csr_matrix((0, 0))
+        self.last_inter_id = 0
+        self.open_baskets = {}   # userId -> [last event time, {productId: weight}]
+        self.stats = {'events': 0, 'baskets': 0, 'writes': 0}
+
+    def add_events(self, rows):
+        """Fold (interId, userId, productId, actionCode, unix time) rows, in interId order, into the matrix"""
+        if not rows:
+            return
+        gap = BASKET_GAP_SECONDS
+        # A basket extended by this batch replaces its earlier contribution: C += new new^T - old old^T
+        changed = {}   # userId -> basket items before this batch touched it
+        pairs = []
+        newest = 0.0
+        for _, user_id, product_id, action_code, ts in rows:
+            user_id, product_id, ts = int(user_id), int(product_id), float(ts or 0)
+            basket = self.open_baskets.get(user_id)
+            if basket is None or ts - basket[0] > gap:
+                if user_id in changed:
+                    pairs.append((changed.pop(user_id), basket[1]))
+                basket = self.open_baskets[user_id] = [ts, {}]
+                changed[user_id] = {}
+                self.stats['baskets'] += 1
+            elif user_id not in changed:
+                changed[user_id] = dict(basket[1])
+            basket[0] = max(basket[0], ts)
+            basket[1][product_id] = max(basket[1].get(product_id, 0.0), ACTION_WEIGHTS.get(action_code, 0.0))
+            newest = max(newest, ts)
+        pairs.extend((old, self.open_baskets[user_id][1]) for user_id, old in changed.items())
+
+        n = max(self.matrix.shape[0], max(int(r[2]) for r in rows) + 1)
+        if self.matrix.shape[0] < n:
+            self.matrix = self.matrix.copy()
+            self.matrix.resize((n, n))
+        old = _basket_matrix([p[0] for p in pairs], n)
+        new = _basket_matrix([p[1] for p in pairs], n)
+        self.matrix = (self.matrix + (new.T @ new - old.T @ old)).tocsr()
+        self.matrix.eliminate_zeros()
+
+        self.last_inter_id = int(rows[-1][0])
+        self.stats['events'] += len(rows)
+        # Baskets idle past the gap can no longer grow
+        self.open_baskets = {u: b for u, b in self.open_baskets.items() if newest - b[0] <= gap}
+
+    def top_k(self, out):
+        """Fill neighbour records: per item, co-bought items by C_ij / sqrt(C_ii * C_jj)"""
+        matrix = self.matrix
+        diag = matrix.diagonal()
+        items = np.flatnonzero(np.diff(matrix.indptr))
+        out['productId'] = items
+        out['neighbours'] = -1
+        out['scores'] = 0
+        row_of = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+        norm = matrix.data / np.sqrt(np.maximum(diag[row_of] * diag[matrix.indices], 1e-12))
+        norm[row_of == matrix.indices] = -1.0
+        for slot, item in enumerate(items):
+            start, end = matrix.indptr[item], matrix.indptr[item + 1]
+            scores, cols = norm[start:end], matrix.indices[start:end]
+            width = min(self.k, len(scores))
+            top = np.argpartition(-scores, width - 1)[:width]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            top = top[scores[top] > 0]
+            out['neighbours'][slot, :len(top)] = cols[top]
+            out['scores'][slot, :len(top)] = scores[top]
+
+    def update(self, conn):
+        """Read interactions past the last one seen and rewrite the lists; returns how many were read"""
+        total = 0
+        while True:
+            cur = conn.cursor()
+            try:
+                cur.execute(_BASKET_INTERACTIONS_QUERY, (self.last_inter_id,))
+                rows = cur.fetchall()
+            finally:
+                cur.close()
+            self.add_events(rows)
+            total += len(rows)
+            if len(rows) < CO_OCCURRENCE_BATCH_ROWS:
+                break
+        if total or not os.path.exists(neighbours_path(CO_OCCURRENCE_NAME, self.directory)):
+            n_items = int(np.count_nonzero(np.diff(self.matrix.indptr))) if self.matrix.shape[0] else 0
+            write_records(CO_OCCURRENCE_NAME, n_items, self.k, self.top_k, self.directory)
+            self.stats['writes'] += 1
+            self.save()
+        return total
+
+    def start(self, connect, interval=CO_OCCURRENCE_REFRESH_SECONDS):
+        """Update every `interval` seconds on a daemon thread with its own connection"""
+        def loop():
+            conn = None
+            while True:
+                try:
+                    conn = conn or connect()
+                    self.update(conn)
+                except Exception as e:
+                    conn = None
+                    print(f"Warning: co-occurrence update failed: {e}", file=sys.stderr)
+                time.sleep(interval)
+
+        thread = threading.Thread(target=loop, name='co-occurrence', daemon=True)
+        thread.start()
+        return thread
+
+    # ---- state file ----------------------------------------------------
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'matrix': self.matrix, 'last_inter_id': self.last_inter_id,
+                             'open_baskets': self.open_baskets}, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Warning: could not write co-occurrence state: {e}", file=sys.stderr)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+            self.matrix = state['matrix'].tocsr()
+            self.last_inter_id = int(state['last_inter_id'])
+            self.open_baskets = state['open_baskets']
+            return True
+        except Exception as e:
+            print(f"Warning: ignoring unreadable co-occurrence state: {e}", file=sys.stderr)
+            return False
+
+
+def main():
+    co_occurrence = CoOccurrence()
+    if '--rebuild' not in sys.argv[1:]:
+        co_occurrence.load()
+    conn = STORAGE.connect()
+    try:
+        read = co_occurrence.update(conn)
+    finally:
+        conn.close()
+    print(f"Co-occurrence: {read} new interactions, up to interId {co_occurrence.last_inter_id}, "
+          f"{co_occurrence.matrix.nnz} non-zero pairs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""
+Item vectors for products listed after the last training run
+A new product gets the mean embedding (and bias) of trained items sharing its
+category and brand, falling back to category only, brand only, then all items
+"""
+
+import numpy as np
+
+
+def cold_item_vectors(item_vectors, item_bias, trained_category, trained_brand, cold_category, cold_brand):
+    """(vectors, biases) for cold products from catalog category/brand codes (0 = missing)"""
+    vectors = np.empty((len(cold_category), item_vectors.shape[1]), dtype=item_vectors.dtype)
+    biases = np.zeros(len(cold_category), dtype=np.float32)
+    fallback = (item_vectors.mean(axis=0), float(item_bias.mean()) if item_bias is not None else 0.0)
+    means = {}
+
+    def group_mean(mask):
+        if not mask.any():
+            return None
+        return item_vectors[mask].mean(axis=0), float(item_bias[mask].mean()) if item_bias is not None else 0.0
+
+    for i, (category, brand) in enumerate(zip(cold_category, cold_brand)):
+        key = (int(category), int(brand))
+        if key not in means:
+            same_category = (trained_category == category) & (category != 0)
+            same_brand = (trained_brand == brand) & (brand != 0)
+            means[key] = (group_mean(same_category & same_brand) or group_mean(same_category)
+                          or group_mean(same_brand) or fallback)
+        vectors[i], biases[i] = means[key]
+    return vectors, biases
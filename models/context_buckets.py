@@ -0,0 +1,118 @@
+"""
+ENCM top-N materialized per (user, context bucket)
+ENCM's context is almost entirely discrete: apart from hour, month and day of
+week, a request is one of device x time of day x season x gender x weekend.
+Shortly before the time of day turns over, a background thread scores recently
+active users for the bucket about to start and keeps each user's top-N in a
+bounded LRU keyed by (user, bucket), so the first requests of a peak find their
+answers ready. Entries expire when their bucket ends.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+BUCKET_N = 100
+BUCKET_CAPACITY = int(os.environ.get('RECO_BUCKET_CAPACITY', 200000))
+# How long before a time-of-day boundary the next bucket is materialized
+BUCKET_LEAD_SECONDS = int(os.environ.get('RECO_BUCKET_LEAD', 15 * 60))
+BUCKET_CHECK_SECONDS = 60
+# Users with an interaction this recent are materialized
+BUCKET_ACTIVE_DAYS = 7
+BUCKET_HOURS = 6
+
+TIME_OF_DAY_NAMES = ('night', 'morning', 'afternoon', 'evening')
+SEASON_NAMES = ('winter', 'spring', 'summer', 'autumn')
+
+
+def bucket_of(context_row):
+    """(device, time of day, season, gender, weekend) codes of an ENCM context row"""
+    return (int(context_row[0]), int(context_row[1]), int(context_row[2]), int(context_row[3]),
+            int(context_row[7]))
+
+
+def bucket_start(now):
+    """Start of the time-of-day bucket `now` falls in"""
+    return now.replace(hour=now.hour - now.hour % BUCKET_HOURS, minute=0, second=0, microsecond=0)
+
+
+def bucket_time_context(start):
+    """Time columns of a request in the bucket starting at `start`, as clients send them;
+    the hour is the middle of the bucket"""
+    return {
+        'time_of_day': TIME_OF_DAY_NAMES[start.hour // BUCKET_HOURS],
+        'season': SEASON_NAMES[0 if start.month <= 2 or start.month == 12 else
+                               (1 if start.month <= 5 else (2 if start.month <= 8 else 3))],
+        'hour': start.hour + BUCKET_HOURS // 2,
+        'month': start.month - 1,
+        'day_of_week': start.weekday(),
+        'is_weekend': 1 if start.weekday() >= 5 else 0,
+    }
+
+
+class BucketCache:
+    """(user, bucket) -> (product ids, scores) until the bucket ends; least recently used evicted"""
+
+    def __init__(self, capacity=BUCKET_CAPACITY):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (user, bucket) -> (expires at, product ids, scores)
+        self.stats = {'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0, 'runs': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, user_id, bucket, product_ids, scores, expires_at):
+        key = (int(user_id), bucket)
+        entry = (expires_at, np.asarray(product_ids, dtype=np.int32), np.asarray(scores, dtype=np.float16))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self.stats['stored'] += 1
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def get(self, user_id, bucket):
+        """(product ids, scores) materialized for the user in this bucket; None when absent or expired"""
+        key = (int(user_id), bucket)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+        return entry[1], entry[2].astype(np.float32)
+
+    def start(self, materialize, lead=BUCKET_LEAD_SECONDS):
+        """Call `materialize(bucket start, expires at)` for the bucket in progress, then `lead` seconds
+        before each next one, on a daemon thread"""
+        def loop():
+            done = None
+            while True:
+                now = datetime.now()
+                upcoming = bucket_start(now) + timedelta(hours=BUCKET_HOURS)
+                target = bucket_start(now) if done is None else upcoming
+                if target != done and (target - now).total_seconds() <= lead:
+                    try:
+                        started = time.time()
+                        users = materialize(target, (target + timedelta(hours=BUCKET_HOURS)).timestamp())
+                        self.stats['runs'] += 1
+                        print(f"Materialized {users} users for {target:%Y-%m-%d %H}:00 "
+                              f"({time.time() - started:.1f}s)", file=sys.stderr)
+                    except Exception as e:
+                        print(f"Warning: context bucket materialization failed: {e}", file=sys.stderr)
+                    done = target
+                time.sleep(BUCKET_CHECK_SECONDS)
+
+        thread = threading.Thread(target=loop, name='context-buckets', daemon=True)
+        thread.start()
+        return thread
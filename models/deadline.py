@@ -0,0 +1,74 @@
+"""
+Latency budgets for recommendation requests
+A request carries `budget_ms`; the pipeline checks the remaining time against a
+learned per-model scoring cost and steps down through the serving tiers:
+full model -> model on a reduced candidate set -> cached result -> popularity
+"""
+
+import threading
+import time
+
+TIER_FULL = 'full'
+TIER_REDUCED = 'reduced'
+TIER_CACHED = 'cached'
+TIER_POPULARITY = 'popularity'
+TIER_PRECOMPUTED = 'precomputed'  # read from the bulk top-N store (bulk_topn.py)
+TIER_BUCKET = 'bucket'  # materialized for the user's context bucket (context_buckets.py)
+TIER_SHED = 'shed'  # rejected by admission control, answered from the precomputed popularity list
+
+REDUCED_CANDIDATES = 200
+
+# Starting guesses until the first scoring calls have been timed
+DEFAULT_SECONDS_PER_ITEM = 2e-5
+SCORE_OVERHEAD_SECONDS = 0.02
+COST_EWMA_ALPHA = 0.2
+
+
+class Deadline:
+    def __init__(self, budget_ms, started=None):
+        self.started = time.monotonic() if started is None else started
+        self.expires = self.started + max(0.0, float(budget_ms)) / 1000.0
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    @classmethod
+    def from_payload(cls, payload, started=None):
+        """Deadline for the payload's `budget_ms`, or None when the caller sets no budget"""
+        budget_ms = payload.get('budget_ms')
+        if budget_ms is None:
+            return None
+        return cls(budget_ms, started)
+
+
+class ScoreCostModel:
+    """EWMA of per-item scoring time for each model, used to predict whether a tier fits"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._per_item = {}
+
+    def estimate(self, model_name, n_items):
+        per_item = self._per_item.get(model_name, DEFAULT_SECONDS_PER_ITEM)
+        return SCORE_OVERHEAD_SECONDS + per_item * n_items
+
+    def observe(self, model_name, n_items, seconds):
+        if n_items <= 0:
+            return
+        sample = max(0.0, seconds - SCORE_OVERHEAD_SECONDS) / n_items
+        with self._lock:
+            prev = self._per_item.get(model_name)
+            self._per_item[model_name] = sample if prev is None else (1 - COST_EWMA_ALPHA) * prev + COST_EWMA_ALPHA * sample
+
+    def choose_tier(self, model_name, n_items, deadline, has_cached):
+        """Best tier that still fits in the remaining budget"""
+        if deadline is None:
+            return TIER_FULL
+        remaining = deadline.remaining()
+        if remaining >= self.estimate(model_name, n_items):
+            return TIER_FULL
+        if n_items > REDUCED_CANDIDATES and remaining >= self.estimate(model_name, REDUCED_CANDIDATES):
+            return TIER_REDUCED
+        if has_cached:
+            return TIER_CACHED
+        return TIER_POPULARITY
@@ -0,0 +1,205 @@
+"""
+NumPy copies of trained embedding tables
+Scores users and items that have no row in the Keras model (folded-in users,
+cold-start items) with the same arithmetic as the model's call() at inference
+"""
+
+import copy
+
+import numpy as np
+
+from autotune import TUNING
+
+
+def _dense(layer):
+    """(kernel, bias, activation name) of a Keras Dense layer"""
+    activation = layer.get_config().get('activation', 'linear')
+    return layer.kernel.numpy(), layer.bias.numpy(), activation
+
+
+def _activate(z, activation):
+    if activation == 'relu':
+        return np.maximum(z, 0.0)
+    if activation == 'sigmoid':
+        return 1.0 / (1.0 + np.exp(-z))
+    if activation == 'linear':
+        return z
+    raise ValueError(f"Unsupported activation: {activation}")
+
+
+class EmbeddingTables:
+    """User/item tables (and the ENCM dense stack) of one trained model"""
+
+    def __init__(self, kind, user_vectors, item_vectors, user_bias=None, item_bias=None,
+                 global_bias=0.0, context_tables=None, dense=None, output_sigmoid=False):
+        self.kind = kind
+        self.user_vectors = user_vectors
+        self.item_vectors = item_vectors
+        self.user_bias = user_bias
+        self.item_bias = item_bias
+        self.global_bias = float(global_bias)
+        self.context_tables = context_tables or []
+        self.dense = dense or []
+        self.output_sigmoid = output_sigmoid
+        self.mean_user = user_vectors.mean(axis=0)
+        self.mean_user_bias = float(user_bias.mean()) if user_bias is not None else 0.0
+        # Rows past n_trained_items belong to cold-start products (sorted ids in cold_item_ids)
+        self.n_trained_items = len(item_vectors)
+        self.cold_item_ids = np.zeros(0, dtype=np.int64)
+        self.cold_version = None
+        # Shard-local encoder whose indices are rows of user_vectors (None: the trained user encoder)
+        self.user_encoder = None
+
+    @classmethod
+    def from_model(cls, model_name, model):
+        """Extract tables from a built model; None for models without a NumPy scorer"""
+        if model_name == 'BMF':
+            return cls(
+                'BMF',
+                model.user_embedding.embeddings.numpy(),
+                model.item_embedding.embeddings.numpy(),
+                user_bias=model.user_bias.embeddings.numpy()[:, 0],
+                item_bias=model.item_bias.embeddings.numpy()[:, 0],
+                global_bias=model.global_bias.numpy()[0],
+                # Serving BMF (model_classes) squashes the training-time output
+                output_sigmoid=True,
+            )
+        if model_name == 'ENCM':
+            dense = [_dense(layer) for layer in model.hidden_layers if hasattr(layer, 'kernel')]
+            dense.append(_dense(model.output_layer))
+            return cls(
+                'ENCM',
+                model.user_embedding.embeddings.numpy(),
+                model.item_embedding.embeddings.numpy(),
+                context_tables=[e.embeddings.numpy() for e in model.context_embeddings],
+                dense=dense,
+            )
+        return None
+
+    def with_cold_items(self, product_ids, vectors, bias=None, version=None):
+        """Copy whose item tables are the trained rows followed by rows for cold products"""
+        tables = copy.copy(self)
+        order = np.argsort(product_ids)
+        tables.cold_item_ids = np.asarray(product_ids, dtype=np.int64)[order]
+        tables.item_vectors = np.vstack([self.item_vectors[:self.n_trained_items], vectors[order]])
+        if self.item_bias is not None:
+            tables.item_bias = np.concatenate([self.item_bias[:self.n_trained_items], bias[order]])
+        tables.cold_version = version
+        return tables
+
+    def cold_rows(self, product_ids):
+        """Table rows of cold products (-1 for ids without a cold row)"""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        if not len(self.cold_item_ids):
+            return np.full(len(product_ids), -1, dtype=np.int64)
+        slot = np.minimum(np.searchsorted(self.cold_item_ids, product_ids), len(self.cold_item_ids) - 1)
+        return np.where(self.cold_item_ids[slot] == product_ids, self.n_trained_items + slot, -1)
+
+    @property
+    def dim(self):
+        return self.item_vectors.shape[1]
+
+    def user_row(self, user_idx):
+        """(vector, bias) of a trained user"""
+        bias = float(self.user_bias[user_idx]) if self.user_bias is not None else 0.0
+        return self.user_vectors[user_idx], bias
+
+    def session_similarity(self, item_rows, session_rows):
+        """Cosine of each item row to the mean of the (unit) session item rows: one matrix-vector product"""
+        session = self.item_vectors[session_rows]
+        anchor = (session / np.maximum(np.linalg.norm(session, axis=1, keepdims=True), 1e-12)).mean(axis=0)
+        anchor /= max(float(np.linalg.norm(anchor)), 1e-12)
+        items = self.item_vectors[item_rows]
+        return (items @ anchor) / np.maximum(np.linalg.norm(items, axis=1), 1e-12)
+
+    # ---- ENCM forward pass ---------------------------------------------
+
+    def _context_kernels(self):
+        """First-layer kernel rows for each context column, in input order"""
+        kernel = self.dense[0][0]
+        offset = 2 * self.dim
+        kernels = []
+        for table in self.context_tables:
+            kernels.append(kernel[offset:offset + table.shape[1]])
+            offset += table.shape[1]
+        return kernels
+
+    def encm_fixed_input(self, item_rows, context_features, columns=None):
+        """First-layer pre-activation contributed by item and context embeddings (optionally some columns)"""
+        kernel, bias, _ = self.dense[0]
+        d = self.dim
+        z = self.item_vectors[item_rows] @ kernel[d:2 * d] + bias
+        for k, (table, k_kernel) in enumerate(zip(self.context_tables, self._context_kernels())):
+            if columns is None or k in columns:
+                z += table[context_features[:, k]] @ k_kernel
+        return z
+
+    def _encm_item_base(self, item_rows, item_context):
+        """First-layer pre-activation from item, category and brand (item_context: (n_items, 2) codes)"""
+        item_features = np.zeros((len(item_rows), len(self.context_tables)), dtype=np.int64)
+        item_features[:, :2] = item_context
+        return self.encm_fixed_input(item_rows, item_features, columns=(0, 1))
+
+    def _encm_request_shift(self, request_contexts):
+        """First-layer pre-activation from the request columns 2..9, one row per context"""
+        kernels = self._context_kernels()
+        shift = np.zeros((len(request_contexts), kernels[0].shape[1]), dtype=np.float32)
+        for k in range(2, len(kernels)):
+            shift += self.context_tables[k][request_contexts[:, k - 2]] @ kernels[k]
+        return shift
+
+    def _encm_grid(self, base, shift, max_elements=None):
+        """Scores (n_shifts x n_items) of every base row plus every shift row, chunked over shifts"""
+        n_items, width = base.shape
+        max_elements = max_elements or TUNING['chunk_elements']
+        chunk = max(1, max_elements // max(1, n_items * width))
+        scores = np.empty((len(shift), n_items), dtype=np.float32)
+        for start in range(0, len(shift), chunk):
+            z0 = base[None, :, :] + shift[start:start + chunk, None, :]
+            scores[start:start + chunk] = self.encm_forward(z0.reshape(-1, width)).reshape(-1, n_items)
+        return scores
+
+    def encm_sweep(self, user_vec, item_rows, item_context, request_contexts, max_elements=None):
+        """Scores (n_contexts x n_items) for one user under several request contexts.
+
+        The first layer is additive over its inputs, so user, item, category and brand terms are
+        computed once and each context adds a single row; only the dense stack runs per pair.
+        item_context: (n_items, 2) category/brand codes; request_contexts: (n_contexts, 8) columns 2..9
+        """
+        base = self._encm_item_base(item_rows, item_context) + user_vec @ self.dense[0][0][:self.dim]
+        return self._encm_grid(base, self._encm_request_shift(request_contexts), max_elements)
+
+    def score_users(self, user_vecs, user_biases, item_rows, item_context=None, request_contexts=None,
+                    max_elements=None):
+        """Scores (n_users x n_items) for a block of users (ENCM: one request context row per user)"""
+        item_rows = np.asarray(item_rows)
+        if self.kind == 'BMF':
+            raw = user_vecs @ self.item_vectors[item_rows].T
+            raw += self.item_bias[item_rows][None, :] + np.asarray(user_biases)[:, None] + self.global_bias
+            return _activate(raw, 'sigmoid') if self.output_sigmoid else raw
+        shift = user_vecs @ self.dense[0][0][:self.dim] + self._encm_request_shift(request_contexts)
+        return self._encm_grid(self._encm_item_base(item_rows, item_context), shift, max_elements)
+
+    def encm_forward(self, z0, keep=False):
+        """Run the dense stack from first-layer pre-activations; optionally keep (z, h) per layer"""
+        trace = []
+        z = z0
+        for i, (kernel, bias, activation) in enumerate(self.dense):
+            if i:
+                z = h @ kernel + bias
+            h = _activate(z, activation)
+            if keep:
+                trace.append((z, h))
+        return (h[:, 0], trace) if keep else h[:, 0]
+
+    # ---- scoring -------------------------------------------------------
+
+    def score(self, user_vec, user_bias, item_rows, context_features=None):
+        """Predictions for one user vector over item rows (context_features: ENCM only)"""
+        item_rows = np.asarray(item_rows)
+        if self.kind == 'BMF':
+            raw = self.item_vectors[item_rows] @ user_vec + self.item_bias[item_rows] + user_bias + self.global_bias
+            return _activate(raw, 'sigmoid') if self.output_sigmoid else raw
+        z0 = self.encm_fixed_input(item_rows, np.asarray(context_features))
+        z0 += user_vec @ self.dense[0][0][:self.dim]
+        return self.encm_forward(z0)
@@ -0,0 +1,77 @@
+"""
+Cross-process lock held as a file created with O_CREAT | O_EXCL
+fcntl is not available on Windows, where the Node API spawns these scripts
+too. The file holds the owner's pid; a holder that died leaves it behind, and
+it is taken over once its mtime is older than `stale_seconds` (long-held locks
+call refresh() to stay fresh).
+"""
+
+import os
+import sys
+import threading
+import time
+
+
+class FileLock:
+    """Non-blocking: acquire() returns False while another live process holds it"""
+
+    def __init__(self, path, stale_seconds=120):
+        self.path = path
+        self.stale_seconds = stale_seconds
+        self.held = False
+
+    def acquire(self):
+        if self.held:
+            return True
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) < self.stale_seconds:
+                        return False
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(str(os.getpid()))
+            self.held = True
+            return True
+        return False
+
+    def refresh(self):
+        """Keep a long-held lock from looking stale"""
+        if self.held:
+            os.utime(self.path)
+
+    def hold(self, on_acquired, interval=30):
+        """On a daemon thread: take the lock once it is free (at once, or when its holder dies),
+        call `on_acquired()` once, then keep it fresh for the life of the process"""
+        def loop():
+            while not self.acquire():
+                time.sleep(interval)
+            try:
+                on_acquired()
+            except Exception as e:
+                print(f"Warning: {os.path.basename(self.path)} holder failed to start: {e}", file=sys.stderr)
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except OSError as e:
+                    print(f"Warning: could not refresh {self.path}: {e}", file=sys.stderr)
+
+        thread = threading.Thread(target=loop, name='file-lock', daemon=True)
+        thread.start()
+        return thread
+
+    def release(self):
+        if not self.held:
+            return
+        self.held = False
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
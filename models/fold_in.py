@@ -0,0 +1,264 @@
+"""
+Fold-in user vectors for users missing from the trained user table
+Fits a user vector against the frozen item side from the user's recent
+interactions: a ridge solve for BMF, a short gradient fit of the user
+embedding alone for ENCM. Vectors are cached in memory and on disk: each fit
+appends one JSON line to a journal that every process (one-shot CLI runs and
+servers) replays at start-up, and a compaction off the request path merges the
+journal into the npz snapshot.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from file_lock import FileLock
+
+FOLD_IN_CACHE_PATH = 'models/serving/fold_in_users.npz'
+# The server compacts this often; a CLI run compacts when the journal outgrows FOLD_IN_JOURNAL_BYTES
+FOLD_IN_COMPACT_SECONDS = 5 * 60
+FOLD_IN_JOURNAL_BYTES = 4 * 1024 * 1024
+FOLD_IN_HISTORY = 50
+FOLD_IN_TTL_SECONDS = 10 * 60
+FOLD_IN_MAX_USERS = 50000
+FOLD_IN_RIDGE = 1.0
+FOLD_IN_STEPS = 40
+FOLD_IN_LEARNING_RATE = 0.05
+
+# Same implicit-feedback ratings as extract_training_data.py
+ACTION_WEIGHTS = {'purchase': 1.0, 'cart': 0.7, 'view': 0.3}
+
+
+def fold_in_bmf(tables, item_rows, ratings, reg=FOLD_IN_RIDGE):
+    """Regularized least squares for (user vector, user bias), shrunk toward the mean user"""
+    prior = np.append(tables.mean_user, tables.mean_user_bias)
+    if not len(item_rows):
+        return prior[:-1], float(prior[-1])
+    x = np.hstack([tables.item_vectors[item_rows], np.ones((len(item_rows), 1), dtype=np.float32)])
+    residual = ratings - tables.item_bias[item_rows] - tables.global_bias - x @ prior
+    solution = prior + np.linalg.solve(x.T @ x + reg * np.eye(x.shape[1]), x.T @ residual)
+    return solution[:-1].astype(np.float32), float(solution[-1])
+
+
+def encm_user_gradient(tables, fixed, u, ratings):
+    """d(mean squared error)/d(user embedding) of the frozen ENCM stack at user embedding `u`"""
+    user_kernel = tables.dense[0][0][:tables.dim]
+    pred, trace = tables.encm_forward(fixed + u @ user_kernel, keep=True)
+    # Backpropagate d(mean squared error)/d(output) to the first-layer pre-activation
+    grad = (2.0 / len(ratings)) * (pred - ratings)[:, None]
+    for i in range(len(tables.dense) - 1, -1, -1):
+        z, h = trace[i]
+        activation = tables.dense[i][2]
+        if activation == 'relu':
+            grad = grad * (z > 0)
+        elif activation == 'sigmoid':
+            grad = grad * h * (1.0 - h)
+        elif activation != 'linear':
+            raise ValueError(f"Unsupported activation: {activation}")
+        if i:
+            grad = grad @ tables.dense[i][0].T
+    return user_kernel @ grad.sum(axis=0)
+
+
+def fold_in_encm(tables, item_rows, context_features, ratings, reg=FOLD_IN_RIDGE,
+                 steps=FOLD_IN_STEPS, lr=FOLD_IN_LEARNING_RATE):
+    """Gradient fit (Adam, MSE like training) of the user embedding with all other weights frozen"""
+    prior = tables.mean_user.astype(np.float64)
+    if not len(item_rows):
+        return prior.astype(np.float32), 0.0
+    fixed = tables.encm_fixed_input(item_rows, context_features)
+    n = len(item_rows)
+    u = prior.copy()
+    m = np.zeros_like(u)
+    v = np.zeros_like(u)
+    for t in range(1, steps + 1):
+        g = encm_user_gradient(tables, fixed, u, ratings) + 2.0 * reg / n * (u - prior)
+        m = 0.9 * m + 0.1 * g
+        v = 0.999 * v + 0.001 * g * g
+        u -= lr * (m / (1 - 0.9 ** t)) / (np.sqrt(v / (1 - 0.999 ** t)) + 1e-8)
+    return u.astype(np.float32), 0.0
+
+
+def fold_in(tables, item_rows, ratings, context_features=None):
+    if tables.kind == 'BMF':
+        return fold_in_bmf(tables, item_rows, ratings)
+    return fold_in_encm(tables, item_rows, context_features, ratings)
+
+
+class FoldInCache:
+    """(model, user) -> folded-in (vector, bias), with a TTL and an on-disk copy shared by processes"""
+
+    def __init__(self, path=FOLD_IN_CACHE_PATH, ttl=FOLD_IN_TTL_SECONDS, max_users=FOLD_IN_MAX_USERS):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self._compact_lock = FileLock(path + '.lock')
+        self.ttl = ttl
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (model, user) -> (wall clock, vector, bias)
+        self._invalidated = {}          # user -> wall clock of the last invalidation
+        self.stats = {'hits': 0, 'fits': 0, 'compactions': 0}
+
+    def get(self, model_name, user_id):
+        key = (str(model_name), str(user_id))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1], entry[2]
+
+    def put(self, model_name, user_id, vector, bias):
+        stored_at = time.time()
+        with self._lock:
+            key = (str(model_name), str(user_id))
+            self._apply(self._entries, key, stored_at, vector, float(bias))
+            self.stats['fits'] += 1
+        self._append({'model': key[0], 'user': key[1], 'at': stored_at, 'bias': float(bias),
+                      'vector': [float(x) for x in vector]})
+
+    def invalidate_user(self, user_id):
+        now = time.time()
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == str(user_id)]:
+                del self._entries[key]
+            self._invalidated[str(user_id)] = now
+        if os.path.exists(self.journal_path) or os.path.exists(self.path):
+            # Other processes replaying the journal must not bring the old vectors back
+            self._append({'user': str(user_id), 'invalidated': now})
+
+    def _apply(self, entries, key, stored_at, vector, bias):
+        """Keep the newer of two fits of one key; least recently stored users beyond max_users dropped"""
+        entry = entries.get(key)
+        if entry is not None and entry[0] > stored_at:
+            return
+        entries[key] = (stored_at, vector, bias)
+        entries.move_to_end(key)
+        while len(entries) > self.max_users:
+            entries.popitem(last=False)
+
+    def _append(self, record):
+        """One journal line per write call; appends of concurrent processes do not interleave"""
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.journal_path, 'ab') as f:
+                f.write((json.dumps(record) + '\n').encode('utf-8'))
+            if record.get('invalidated') is None and os.path.getsize(self.journal_path) > FOLD_IN_JOURNAL_BYTES:
+                self.save()
+        except Exception as e:
+            print(f"Warning: could not append to the fold-in journal: {e}", file=sys.stderr)
+
+    def _read(self, journal_path):
+        """(entries, invalidations) on disk: the snapshot, then the journal replayed over it"""
+        entries, invalidated = OrderedDict(), {}
+        now = time.time()
+        if os.path.exists(self.path):
+            with np.load(self.path, allow_pickle=False) as snap:
+                offsets = snap['offsets']
+                order = np.argsort(snap['stored_at'], kind='stable')
+                for i in order:
+                    stored_at = float(snap['stored_at'][i])
+                    if now - stored_at > self.ttl:
+                        continue
+                    vector = snap['vectors'][offsets[i]:offsets[i + 1]]
+                    key = (str(snap['models'][i]), str(snap['users'][i]))
+                    self._apply(entries, key, stored_at, vector, float(snap['biases'][i]))
+        try:
+            with open(journal_path, 'rb') as f:
+                lines = f.read().split(b'\n')
+        except FileNotFoundError:
+            lines = []
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue   # empty, or torn by a crash mid-append
+            if 'invalidated' in record:
+                user = str(record['user'])
+                invalidated[user] = max(invalidated.get(user, 0.0), float(record['invalidated']))
+            elif now - float(record['at']) <= self.ttl:
+                self._apply(entries, (str(record['model']), str(record['user'])), float(record['at']),
+                            np.array(record['vector'], dtype=np.float32), float(record['bias']))
+        return entries, invalidated
+
+    @staticmethod
+    def _drop_invalidated(entries, invalidated):
+        for key in [k for k, e in entries.items() if e[0] <= invalidated.get(k[1], -1.0)]:
+            del entries[key]
+
+    def save(self):
+        """Merge the journal, the snapshot and this process's entries into a new snapshot; skipped
+        while another process compacts, whose snapshot the journal is merged into next time"""
+        if not self._compact_lock.acquire():
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # Lines appended from here on go to a fresh journal and are merged next time
+            claimed = f"{self.journal_path}.{os.getpid()}.{threading.get_ident()}"
+            try:
+                os.replace(self.journal_path, claimed)
+            except FileNotFoundError:
+                claimed = None
+            entries, invalidated = self._read(claimed or self.journal_path)
+            with self._lock:
+                for key, (stored_at, vector, bias) in self._entries.items():
+                    self._apply(entries, key, stored_at, vector, bias)
+                # Fits older than the TTL are gone, so are the invalidations that could hide them
+                self._invalidated = {u: at for u, at in self._invalidated.items() if time.time() - at <= self.ttl}
+                for user, at in self._invalidated.items():
+                    invalidated[user] = max(invalidated.get(user, 0.0), at)
+            self._drop_invalidated(entries, invalidated)
+            items = list(entries.items())
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    models=np.array([k[0] for k, _ in items], dtype=str),
+                    users=np.array([k[1] for k, _ in items], dtype=str),
+                    stored_at=np.array([e[0] for _, e in items], dtype=np.float64),
+                    biases=np.array([e[2] for _, e in items], dtype=np.float32),
+                    # Vectors of different models may differ in width; store them flat
+                    offsets=np.cumsum([0] + [len(e[1]) for _, e in items]),
+                    vectors=np.concatenate([e[1] for _, e in items] or [np.zeros(0)]).astype(np.float32),
+                )
+            os.replace(tmp_path, self.path)
+            if claimed:
+                os.remove(claimed)
+            self.stats['compactions'] += 1
+        except Exception as e:
+            print(f"Warning: could not write fold-in cache: {e}", file=sys.stderr)
+        finally:
+            self._compact_lock.release()
+
+    def load(self):
+        if not os.path.exists(self.path) and not os.path.exists(self.journal_path):
+            return False
+        try:
+            entries, invalidated = self._read(self.journal_path)
+            self._drop_invalidated(entries, invalidated)
+            with self._lock:
+                self._entries = entries
+                self._invalidated = invalidated
+            return True
+        except Exception as e:
+            print(f"Warning: ignoring unreadable fold-in cache: {e}", file=sys.stderr)
+            self._entries.clear()
+            return False
+
+    def start(self, interval=FOLD_IN_COMPACT_SECONDS):
+        """Compact every `interval` seconds on a daemon thread"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                if os.path.exists(self.journal_path):
+                    self.save()
+
+        thread = threading.Thread(target=loop, name='fold-in-compaction', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Precomputed item-to-item neighbour lists
+An offline job ranks every trained item against all others by cosine similarity
+of the models' item embeddings (blocked matrix products on a thread pool) and
+writes one fixed-width record per item to a memory-mapped .npy file; product
+pages then read a row instead of scoring the catalog.
+
+Build from the repository root after training:
+    python models/item_neighbours.py [K]
+"""
+
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from autotune import TUNING
+
+NEIGHBOURS_DIR = 'models/serving/neighbours'
+NEIGHBOURS_K = 50
+NEIGHBOURS_RELOAD_SECONDS = 30
+# Lookup order when the caller does not name a model
+NEIGHBOUR_MODELS = ('BMF', 'NeuMF', 'ENCM')
+
+
+def neighbours_path(model_name, directory=NEIGHBOURS_DIR):
+    return os.path.join(directory, f"{model_name.lower()}_neighbours.npy")
+
+
+def record_dtype(k):
+    """One row per item: its product id, K neighbour product ids (-1 padded) and their similarities"""
+    return np.dtype([('productId', '<i4'), ('neighbours', '<i4', (k,)), ('scores', '<f2', (k,))])
+
+
+def _unit_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def item_vectors(model_name, model):
+    """Unit-norm item vectors whose dot products are the cosine similarities to rank by"""
+    if model_name == 'NeuMF':
+        # Both towers count equally: the concatenated unit rows give the mean of the two cosines
+        gmf = _unit_rows(model.item_embedding_gmf.embeddings.numpy())
+        mlp = _unit_rows(model.item_embedding_mlp.embeddings.numpy())
+        return np.hstack([gmf, mlp]) / np.sqrt(2.0, dtype=np.float32)
+    return _unit_rows(model.item_embedding.embeddings.numpy())
+
+
+def build_neighbours(vectors, product_ids, out, k=NEIGHBOURS_K, block_elements=None,
+                     workers=None):
+    """Fill `out` (records of record_dtype(k)) with each item's top-k most similar other items"""
+    n = len(vectors)
+    product_ids = np.asarray(product_ids, dtype=np.int32)
+    out['productId'] = product_ids
+    out['neighbours'] = -1
+    out['scores'] = 0
+    width = min(k, n - 1)
+    if width <= 0:
+        return
+    # Similarity block held per worker: rows x n_items float32 values
+    block = max(1, (block_elements or TUNING['neighbour_block_elements']) // n)
+
+    def run(start):
+        stop = min(start + block, n)
+        sims = vectors[start:stop] @ vectors.T
+        sims[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        top = np.argpartition(-sims, width - 1, axis=1)[:, :width]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1, kind='stable')
+        # Blocks write disjoint rows, so workers need no lock
+        out['neighbours'][start:stop, :width] = product_ids[np.take_along_axis(top, order, axis=1)]
+        out['scores'][start:stop, :width] = np.take_along_axis(top_sims, order, axis=1)
+
+    # BLAS releases the GIL, so threads keep all cores busy on the matrix products
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        list(pool.map(run, range(0, n, block)))
+
+
+def write_records(name, n, k, fill, directory=NEIGHBOURS_DIR):
+    """Let `fill(records)` populate a temporary file, then swap it in so readers never see a partial table"""
+    os.makedirs(directory, exist_ok=True)
+    path = neighbours_path(name, directory)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=record_dtype(k), shape=(n,))
+    fill(out)
+    out.flush()
+    del out
+    os.replace(tmp_path, path)
+    return path
+
+
+def write_neighbours(model_name, vectors, product_ids, k=NEIGHBOURS_K, directory=NEIGHBOURS_DIR):
+    return write_records(model_name, len(vectors), k, lambda out: build_neighbours(vectors, product_ids, out, k),
+                         directory)
+
+
+class ItemNeighbours:
+    """Read side: memory-maps the neighbour files and re-opens them when the job replaces them"""
+
+    def __init__(self, directory=NEIGHBOURS_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._tables = {}   # model -> (mtime, checked at, records, product ids)
+
+    def _table(self, model_name):
+        now = time.monotonic()
+        entry = self._tables.get(model_name)
+        if entry is not None and now - entry[1] < NEIGHBOURS_RELOAD_SECONDS:
+            return entry
+        with self._lock:
+            path = neighbours_path(model_name, self.directory)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                self._tables[model_name] = entry = (None, now, None, None)
+                return entry
+            if entry is None or entry[0] != mtime:
+                try:
+                    records = np.load(path, mmap_mode='r')
+                    # Product ids stay in memory for the row search; neighbour rows are paged in on demand
+                    entry = (mtime, now, records, np.asarray(records['productId']))
+                except Exception as e:
+                    print(f"Warning: unreadable neighbour file {path}: {e}", file=sys.stderr)
+                    entry = (mtime, now, None, None)
+            else:
+                entry = (mtime, now, entry[2], entry[3])
+            self._tables[model_name] = entry
+            return entry
+
+    def available(self, model_name):
+        return self._table(model_name)[2] is not None
+
+    def lookup(self, model_name, product_id):
+        """(neighbour product ids, similarities) of one product; None when it has no row"""
+        _, _, records, product_ids = self._table(model_name)
+        if records is None or not len(product_ids):
+            return None
+        row = int(np.searchsorted(product_ids, product_id))
+        if row >= len(product_ids) or product_ids[row] != product_id:
+            return None
+        record = records[row]
+        keep = record['neighbours'] >= 0
+        return record['neighbours'][keep], record['scores'][keep].astype(np.float32)
+
+
+def _load_model(model_name, data_stats):
+    """Build the training-time model class and load its weights from models/"""
+    from training_model_classes import BMF, NeuMF, ENCM
+
+    try:
+        with open(f'models/{model_name.lower()}_config.json', 'r') as f:
+            cfg = json.load(f)
+    except Exception:
+        cfg = {}
+    n_users = cfg.get('n_users', data_stats['n_users'])
+    n_items = cfg.get('n_items', data_stats['n_items'])
+    embedding_dim = cfg.get('embedding_dim', 50)
+    if model_name == 'BMF':
+        model = BMF(n_users=n_users, n_items=n_items, embedding_dim=embedding_dim)
+        model.build([(None,), (None,)])
+    elif model_name == 'NeuMF':
+        model = NeuMF(n_users=n_users, n_items=n_items, embedding_dim=embedding_dim,
+                      hidden_dims=cfg.get('hidden_dims', [64, 32, 16]))
+        model.build([(None,), (None,)])
+    else:
+        n_contexts = cfg.get('n_contexts', [feat[1] for feat in data_stats['context_features']])
+        model = ENCM(n_users=n_users, n_items=n_items, n_contexts=n_contexts, embedding_dim=embedding_dim,
+                     context_dims=cfg.get('context_dims', n_contexts), hidden_dims=cfg.get('hidden_dims', [64, 32]))
+        model.build([(None,), (None,), (None, len(n_contexts))])
+    model.load_weights(f'models/{model_name.lower()}_model.h5')
+    return model
+
+
+def main():
+    k = int(sys.argv[1]) if len(sys.argv) > 1 else NEIGHBOURS_K
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+    import tensorflow as tf
+    tf.config.set_visible_devices([], 'GPU')
+
+    with open('EcomModelTrain/training_data/item_encoder.pkl', 'rb') as f:
+        item_encoder = pickle.load(f)
+    with open('EcomModelTrain/training_data/data_stats.pkl', 'rb') as f:
+        data_stats = pickle.load(f)
+
+    for model_name in NEIGHBOUR_MODELS:
+        started = time.time()
+        try:
+            model = _load_model(model_name, data_stats)
+        except Exception as e:
+            print(f"Skipping {model_name}: weights not loaded ({e})")
+            continue
+        vectors = item_vectors(model_name, model)
+        # Rows past the encoder (padding in the saved table) have no product
+        n = min(len(vectors), len(item_encoder.classes_))
+        path = write_neighbours(model_name, vectors[:n], item_encoder.classes_[:n].astype(np.int64), k)
+        print(f"{model_name}: {n} items x {k} neighbours -> {path} ({time.time() - started:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
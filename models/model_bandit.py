@@ -0,0 +1,253 @@
+"""
+Per-segment model selection by Thompson sampling
+Each served list is an impression for (segment, model); a view, cart or purchase
+of one of its products by the same user within REWARD_WINDOW_SECONDS is a
+reward. Requests with model 'auto' draw from each model's Beta posterior and
+run only the model with the highest draw.
+
+Every process (one-shot CLI runs and servers alike) appends the lists it serves
+to a shared journal. Once a list's reward window has closed, whichever process
+settles next reads its rewards from the interactions table and adds it to the
+shared counts file, under a file lock, so no process overwrites another's.
+"""
+
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from file_lock import FileLock
+from storage import STORAGE
+
+AUTO_MODEL = 'auto'
+BANDIT_STATE_PATH = 'models/serving/model_bandit.json'
+BANDIT_SETTLE_SECONDS = 60
+REWARD_WINDOW_SECONDS = 30 * 60
+REWARD_ACTIONS = ('view', 'cart', 'purchase')
+BANDIT_SETTLE_USERS = 500
+
+_REWARD_EVENTS_QUERY = f"""
+    SELECT userId, productId, {STORAGE.unix_time('timestamp')} AS ts
+    FROM interactions
+    WHERE userId IN ({{users}}) AND actionCode IN ({', '.join(f"'{a}'" for a in REWARD_ACTIONS)})
+      AND timestamp >= {{since}}
+"""
+
+
+def segment_of(context, history_count, cold_threshold=10):
+    """Device type and cold/warm history, the split the scoring path already treats differently"""
+    device = str((context or {}).get('device_type') or 'unknown').lower()
+    return f"{device}:{'cold' if history_count < cold_threshold else 'warm'}"
+
+
+
+
+def attribute_rewards(serves, events, window=REWARD_WINDOW_SECONDS):
+    """Rewarded flag per serve: each (user, product, unix time) event rewards the most recent
+    unrewarded list of that user served at most `window` seconds earlier that contained the product"""
+    rewarded = [False] * len(serves)
+    by_user = defaultdict(list)
+    for i in sorted(range(len(serves)), key=lambda i: serves[i]['at']):
+        by_user[serves[i]['user']].append(i)
+    for user_id, product_id, ts in sorted(events, key=lambda e: e[2]):
+        for i in reversed(by_user.get(int(user_id), ())):
+            # Interaction timestamps have whole seconds
+            served_at = int(serves[i]['at'])
+            if served_at > ts:
+                continue
+            if ts - served_at > window:
+                break
+            if not rewarded[i] and int(product_id) in serves[i]['items']:
+                rewarded[i] = True
+                break
+    return rewarded
+
+
+class ModelBandit:
+    """Beta(1 + rewards, 1 + impressions - rewards) per (segment, model)"""
+
+    def __init__(self, path=BANDIT_STATE_PATH, seed=None):
+        self.path = path
+        self.journal_path = path + '.serves'
+        self._settle_lock = FileLock(path + '.lock')
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng(seed)
+        self._counts = {}    # (segment, model) -> [impressions, rewards], as last read from disk
+        self._loaded_mtime = None
+        self.settler = None   # daemon thread when this process settles in the background
+        self.stats = {'served': 0, 'settled': 0, 'rewards': 0}
+
+    def choose(self, segment, models):
+        """One model for this request: the arm with the highest posterior draw"""
+        models = list(models)
+        if len(models) <= 1:
+            return models[0] if models else None
+        with self._lock:
+            counts = [self._counts.get((segment, m), (0, 0)) for m in models]
+            draws = [self._rng.beta(1 + r, 1 + max(0, n - r)) for n, r in counts]
+        return models[int(np.argmax(draws))]
+
+    def record_serve(self, user_id, segment, model_name, product_ids):
+        """Append the list to the shared journal; it is counted once its reward window has closed"""
+        line = json.dumps({'at': time.time(), 'user': int(user_id), 'segment': segment, 'model': model_name,
+                           'items': [int(p) for p in product_ids]}) + '\n'
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # One short append per list: whole lines even with several processes appending
+            with self._lock, open(self.journal_path, 'a') as f:
+                f.write(line)
+            self.stats['served'] += 1
+        except Exception as e:
+            print(f"Warning: could not append to the model bandit journal: {e}", file=sys.stderr)
+
+    def snapshot(self):
+        """{segment: {model: {'impressions', 'rewards'}}} for /metrics"""
+        with self._lock:
+            return self._snapshot(self._counts)
+
+    @staticmethod
+    def _snapshot(counts):
+        out = {}
+        for (segment, model_name), (n, r) in sorted(counts.items()):
+            out.setdefault(segment, {})[model_name] = {'impressions': n, 'rewards': r}
+        return out
+
+    def _read_counts(self):
+        counts = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for segment, models in json.load(f).items():
+                    for model_name, c in models.items():
+                        counts[(segment, model_name)] = [int(c['impressions']), int(c['rewards'])]
+        return counts
+
+    def _read_serves(self, paths):
+        serves = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                lines = f.read().split(b'\n')
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue   # empty, or torn by a crash mid-append
+                record['items'] = frozenset(record['items'])
+                serves.append(record)
+        return serves
+
+    def _reward_events(self, conn, serves):
+        """(user, product, unix time) of the interactions that can reward these lists"""
+        since = min(s['at'] for s in serves)
+        days = math.ceil((time.time() - since) / 86400) + 1
+        users = sorted({s['user'] for s in serves})
+        events = []
+        cur = conn.cursor()
+        try:
+            for start in range(0, len(users), BANDIT_SETTLE_USERS):
+                chunk = users[start:start + BANDIT_SETTLE_USERS]
+                cur.execute(_REWARD_EVENTS_QUERY.format(users=', '.join(['%s'] * len(chunk)),
+                                                        since=STORAGE.days_ago(days)), chunk)
+                events.extend((int(u), int(p), int(ts)) for u, p, ts in cur.fetchall() if ts is not None and ts >= since - 1)
+        finally:
+            cur.close()
+        return events
+
+    def settle(self, conn, now=None):
+        """Count the journalled lists whose reward window has closed; False when another
+        process is settling or the interactions could not be read"""
+        now = time.time() if now is None else now
+        if not self._settle_lock.acquire():
+            return False
+        directory = os.path.dirname(self.path) or '.'
+        claimed = f"{self.journal_path}.{os.getpid()}.{threading.get_ident()}"
+        prefix = os.path.basename(self.journal_path) + '.'
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Lists served from here on go to a fresh journal. Claims left by a settle that
+            # died are picked up too: nobody else is settling while we hold the lock
+            try:
+                os.replace(self.journal_path, claimed)
+            except FileNotFoundError:
+                pass
+            paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.startswith(prefix)]
+            serves = self._read_serves(paths)
+            due = [s for s in serves if now - s['at'] > REWARD_WINDOW_SECONDS]
+            keep = [s for s in serves if now - s['at'] <= REWARD_WINDOW_SECONDS]
+            counts = self._read_counts()
+            if due:
+                due_users = {s['user'] for s in due}
+                # Open lists of the same users compete for the events, as they will when they settle
+                competing = due + [s for s in keep if s['user'] in due_users]
+                rewarded = attribute_rewards(competing, self._reward_events(conn, due))[:len(due)]
+                for serve, reward in zip(due, rewarded):
+                    c = counts.setdefault((serve['segment'], serve['model']), [0, 0])
+                    c[0] += 1
+                    c[1] += int(reward)
+                self.stats['rewards'] += sum(rewarded)
+            # Rewritten even when nothing was due: the file's mtime says when the last settle ran
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self._snapshot(counts), f)
+            if keep:
+                with open(self.journal_path, 'a') as f:
+                    f.write(''.join(json.dumps(dict(s, items=sorted(s['items']))) + '\n' for s in keep))
+            os.replace(tmp_path, self.path)
+            for path in paths:
+                os.remove(path)
+            self.stats['settled'] += len(due)
+        except Exception as e:
+            # Claimed lists stay on disk and are settled next time
+            print(f"Warning: could not settle the model bandit journal: {e}", file=sys.stderr)
+            return False
+        finally:
+            self._settle_lock.release()
+        self.load()
+        return True
+
+    def refresh(self, conn):
+        """Settle when nobody has for BANDIT_SETTLE_SECONDS, else pick up another process's settle"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime is None or time.time() - mtime >= BANDIT_SETTLE_SECONDS:
+            if os.path.exists(self.journal_path) and self.settle(conn):
+                return
+        if mtime != self._loaded_mtime:
+            self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        try:
+            mtime = os.path.getmtime(self.path)
+            counts = self._read_counts()
+            with self._lock:
+                self._counts = counts
+                self._loaded_mtime = mtime
+            return True
+        except Exception as e:
+            print(f"Warning: ignoring unreadable model bandit state: {e}", file=sys.stderr)
+            return False
+
+    def start(self, connect, interval=BANDIT_SETTLE_SECONDS):
+        """Settle every `interval` seconds on a daemon thread with its own connection"""
+        def loop():
+            conn = None
+            while True:
+                time.sleep(interval)
+                try:
+                    conn = conn or connect()
+                    self.refresh(conn)
+                except Exception as e:
+                    print(f"Warning: model bandit settle failed: {e}", file=sys.stderr)
+                    conn = None
+
+        self.settler = threading.Thread(target=loop, name='model-bandit-settle', daemon=True)
+        self.settler.start()
+        return self.settler
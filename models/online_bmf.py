@@ -0,0 +1,185 @@
+"""
+Online BMF updates from the live interaction stream
+New interactions (polled by interId) nudge the affected user and item rows of
+the serving BMF tables with bounded SGD steps; the rows are checkpointed so a
+restarted process, or a one-shot CLI run, starts from the updated tables
+"""
+
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from fold_in import ACTION_WEIGHTS
+
+ONLINE_BMF_CHECKPOINT_PATH = 'models/serving/bmf_online.npz'
+ONLINE_BMF_WEIGHTS_PATH = 'models/bmf_model.h5'
+ONLINE_POLL_SECONDS = 5
+ONLINE_CHECKPOINT_SECONDS = 300
+ONLINE_BATCH_ROWS = 5000
+ONLINE_LEARNING_RATE = 0.01
+ONLINE_REGULARIZATION = 0.01
+ONLINE_MAX_STEP = 0.05  # max L2 norm of any single row update
+
+_NEW_INTERACTIONS_QUERY = f"""
+    SELECT interId, userId, productId, actionCode
+    FROM interactions
+    WHERE interId > %s AND actionCode IN ('cart', 'purchase', 'view')
+    ORDER BY interId
+    LIMIT {ONLINE_BATCH_ROWS}
+"""
+
+
+def _bounded(step, max_norm=ONLINE_MAX_STEP):
+    norm = float(np.linalg.norm(step))
+    return step * (max_norm / norm) if norm > max_norm else step
+
+
+class OnlineBMF:
+    """SGD on trained BMF rows; unknown users are left to fold-in, cold items to the cold-item builder"""
+
+    def __init__(self, get_tables, user_rows, item_rows, path=ONLINE_BMF_CHECKPOINT_PATH,
+                 lr=ONLINE_LEARNING_RATE, reg=ONLINE_REGULARIZATION):
+        self._get_tables = get_tables   # () -> current BMF EmbeddingTables or None
+        self._user_rows = user_rows     # (tables, user ids) -> user table rows, -1 when untrained
+        self._item_rows = item_rows     # (tables, product ids) -> item table rows, -1 when unscorable
+        self.path = path
+        self.lr = lr
+        self.reg = reg
+        self.last_inter_id = None
+        self._fed_ids = set()   # interIds applied from the change feed, skipped by the poll
+        self._lock = threading.Lock()
+        # Off on servers that are not their host's writer: one checkpoint file per host
+        self.checkpoints = True
+        self.stats = {'events': 0, 'updates': 0, 'checkpoints': 0}
+
+    def apply(self, user_ids, product_ids, action_codes):
+        """One SGD pass over events; returns how many updated a trained user/item pair"""
+        tables = self._get_tables()
+        if tables is None or not len(user_ids):
+            return 0
+        users = self._user_rows(tables, np.asarray(user_ids, dtype=np.int64))
+        items = self._item_rows(tables, np.asarray(product_ids, dtype=np.int64))
+        ratings = [ACTION_WEIGHTS.get(a, 0.0) for a in action_codes]
+        updated = 0
+        with self._lock:
+            for u, i, r in zip(users, items, ratings):
+                # Cold rows are rebuilt from trained rows on every catalog change, so only trained rows learn
+                if u < 0 or i < 0 or i >= tables.n_trained_items:
+                    continue
+                p, q = tables.user_vectors[u], tables.item_vectors[i]
+                # Training target is the raw (pre-sigmoid) BMF output
+                err = r - (p @ q + tables.user_bias[u] + tables.item_bias[i] + tables.global_bias)
+                dp = _bounded(self.lr * (err * q - self.reg * p))
+                dq = _bounded(self.lr * (err * p - self.reg * q))
+                p += dp
+                q += dq
+                tables.user_bias[u] += np.clip(self.lr * (err - self.reg * tables.user_bias[u]), -ONLINE_MAX_STEP, ONLINE_MAX_STEP)
+                tables.item_bias[i] += np.clip(self.lr * (err - self.reg * tables.item_bias[i]), -ONLINE_MAX_STEP, ONLINE_MAX_STEP)
+                updated += 1
+            self.stats['events'] += len(users)
+            self.stats['updates'] += updated
+        return updated
+
+    def observe(self, inter_id, user_id, product_id, action_code):
+        """Apply one change-feed event now instead of waiting for the next poll"""
+        if inter_id is not None:
+            inter_id = int(inter_id)
+            with self._lock:
+                if (self.last_inter_id is not None and inter_id <= self.last_inter_id) or inter_id in self._fed_ids:
+                    return 0
+                self._fed_ids.add(inter_id)
+        return self.apply([user_id], [product_id], [action_code])
+
+    def poll(self, conn):
+        """Apply interactions logged since the last poll"""
+        cur = conn.cursor()
+        try:
+            if self.last_inter_id is None:
+                # Start from now; older interactions are already in the trained weights
+                cur.execute("SELECT COALESCE(MAX(interId), 0) FROM interactions")
+                self.last_inter_id = int(cur.fetchone()[0])
+                return 0
+            cur.execute(_NEW_INTERACTIONS_QUERY, (self.last_inter_id,))
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+        if not rows:
+            return 0
+        with self._lock:
+            fresh = [r for r in rows if int(r[0]) not in self._fed_ids]
+            self.last_inter_id = int(rows[-1][0])
+            self._fed_ids = {i for i in self._fed_ids if i > self.last_inter_id}
+        self.apply([r[1] for r in fresh], [r[2] for r in fresh], [r[3] for r in fresh])
+        return len(rows)
+
+    def start(self, connect, interval=ONLINE_POLL_SECONDS, checkpoint_every=ONLINE_CHECKPOINT_SECONDS):
+        """Poll on a daemon thread with its own connection, checkpointing every `checkpoint_every` seconds"""
+        def loop():
+            conn = None
+            saved_at = time.time()
+            while True:
+                try:
+                    conn = conn or connect()
+                    # Drain a backlog in full batches before sleeping
+                    while self.poll(conn) >= ONLINE_BATCH_ROWS:
+                        pass
+                except Exception as e:
+                    conn = None
+                    print(f"Warning: online BMF poll failed: {e}", file=sys.stderr)
+                if self.checkpoints and time.time() - saved_at >= checkpoint_every:
+                    self.save()
+                    saved_at = time.time()
+                time.sleep(interval)
+
+        thread = threading.Thread(target=loop, name='online-bmf', daemon=True)
+        thread.start()
+        return thread
+
+    # ---- checkpoint ----------------------------------------------------
+
+    def save(self):
+        tables = self._get_tables()
+        if tables is None or self.last_inter_id is None:
+            return
+        try:
+            n = tables.n_trained_items
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with self._lock, open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    user_vectors=tables.user_vectors,
+                    user_bias=tables.user_bias,
+                    item_vectors=tables.item_vectors[:n],
+                    item_bias=tables.item_bias[:n],
+                    last_inter_id=np.int64(self.last_inter_id),
+                )
+            os.replace(tmp_path, self.path)
+            self.stats['checkpoints'] += 1
+        except Exception as e:
+            print(f"Warning: could not write online BMF checkpoint: {e}", file=sys.stderr)
+
+    def restore(self):
+        """Load the checkpoint into the serving tables unless the model was retrained after it"""
+        tables = self._get_tables()
+        if tables is None or not os.path.exists(self.path):
+            return False
+        try:
+            if os.path.getmtime(self.path) < os.path.getmtime(ONLINE_BMF_WEIGHTS_PATH):
+                return False
+            n = tables.n_trained_items
+            with np.load(self.path, allow_pickle=False) as ckpt:
+                if ckpt['user_vectors'].shape != tables.user_vectors.shape or ckpt['item_vectors'].shape != tables.item_vectors[:n].shape:
+                    return False
+                tables.user_vectors[:] = ckpt['user_vectors']
+                tables.user_bias[:] = ckpt['user_bias']
+                tables.item_vectors[:n] = ckpt['item_vectors']
+                tables.item_bias[:n] = ckpt['item_bias']
+                self.last_inter_id = int(ckpt['last_inter_id'])
+            return True
+        except Exception as e:
+            print(f"Warning: ignoring unreadable online BMF checkpoint: {e}", file=sys.stderr)
+            return False
@@ -0,0 +1,101 @@
+"""
+Precomputed global popularity list
+Refreshed off the request path so shed or over-budget requests can be answered
+without touching the database or the models
+"""
+
+import sys
+import threading
+import time
+
+from storage import STORAGE
+
+POPULAR_REFRESH_SECONDS = 300
+POPULAR_LIST_SIZE = 200
+ACTION_POP_WEIGHTS = {'purchase': 3, 'cart': 2}
+
+_POPULAR_QUERY = f"""
+    SELECT productId,
+           SUM(CASE WHEN actionCode='purchase' THEN 3 WHEN actionCode='cart' THEN 2 ELSE 1 END) AS pop_score
+    FROM interactions
+    WHERE timestamp >= {STORAGE.days_ago(180)}
+    GROUP BY productId
+    ORDER BY pop_score DESC
+    LIMIT {POPULAR_LIST_SIZE}
+"""
+
+
+class PopularItems:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._first_refresh = threading.Lock()
+        self._scores = {}     # productId -> weighted interaction count
+        self._ranked = []     # [(productId, normalized score)], best first
+        self.refreshed_at = 0.0
+
+    def refresh(self, conn):
+        cur = conn.cursor()
+        try:
+            cur.execute(_POPULAR_QUERY)
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+        with self._lock:
+            self._scores = {int(pid): float(score) for pid, score in rows}
+            self._rerank()
+            self.refreshed_at = time.time()
+
+    def refresh_if_empty(self, conn):
+        """First refresh on the caller's thread, for processes without a refresher (the one-shot CLI)
+        or before its first run finished; skipped while another thread is already doing it"""
+        if self.refreshed_at or not self._first_refresh.acquire(blocking=False):
+            return
+        try:
+            if not self.refreshed_at:
+                self.refresh(conn)
+        finally:
+            self._first_refresh.release()
+
+    def record(self, product_id, action_code):
+        """Count one live interaction with the same weights as the refresh query"""
+        weight = ACTION_POP_WEIGHTS.get(action_code, 1)
+        with self._lock:
+            self._scores[int(product_id)] = self._scores.get(int(product_id), 0.0) + weight
+            self._rerank()
+
+    def _rerank(self):
+        ranked = sorted(self._scores.items(), key=lambda kv: kv[1], reverse=True)[:POPULAR_LIST_SIZE]
+        top = ranked[0][1] if ranked and ranked[0][1] > 0 else 1.0
+        self._ranked = [(pid, score / top) for pid, score in ranked]
+
+    def top(self, limit=POPULAR_LIST_SIZE):
+        """Best `limit` (productId, normalized score) pairs"""
+        return self._ranked[:limit]
+
+    def start_refresher(self, connect, interval=POPULAR_REFRESH_SECONDS):
+        """Refresh now on the caller's thread, so shed requests arriving right after start-up find
+        the list filled, then every `interval` seconds on a daemon thread with its own connection"""
+        try:
+            conn = connect()
+            try:
+                self.refresh(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Warning: popularity refresh failed: {e}", file=sys.stderr)
+
+        def loop():
+            conn = None
+            while True:
+                time.sleep(interval if self.refreshed_at else 0)
+                try:
+                    conn = conn or connect()
+                    self.refresh(conn)
+                except Exception as e:
+                    conn = None
+                    print(f"Warning: popularity refresh failed: {e}", file=sys.stderr)
+                    time.sleep(interval)
+
+        thread = threading.Thread(target=loop, name='popular-refresh', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,74 @@
+"""
+Rankings kept for cursor pagination
+A scored request stores its ordering, up to RANKING_MAX_PAGES pages deep, as
+int32 product ids (plus float32 scores) under a random token; later pages slice
+it instead of re-scoring
+"""
+
+import base64
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+RANKING_TTL_SECONDS = 5 * 60
+RANKING_MAX_ENTRIES = 2000
+# Pages a cursor can reach; past them the ranking ends
+RANKING_MAX_PAGES = int(os.environ.get('RECO_RANKING_MAX_PAGES', 10))
+
+
+def encode_cursor(token, offset):
+    return base64.urlsafe_b64encode(f"{token}:{int(offset)}".encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(token, offset); raises ValueError for a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        token, offset = raw.rsplit(':', 1)
+        return token, max(0, int(offset))
+    except Exception:
+        raise ValueError('invalid cursor')
+
+
+class RankingCache:
+    def __init__(self, ttl=RANKING_TTL_SECONDS, max_entries=RANKING_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # token -> (stored at, user, product ids, scores, meta)
+        self.stats = {'stored': 0, 'pages': 0, 'expired': 0}
+
+    def put(self, user_id, product_ids, scores, meta):
+        """Store a ranking; returns its token"""
+        token = secrets.token_urlsafe(9)
+        entry = (time.monotonic(), str(user_id), np.asarray(product_ids, dtype=np.int32),
+                 np.asarray(scores, dtype=np.float32), meta)
+        with self._lock:
+            self._entries[token] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.stats['stored'] += 1
+        return token
+
+    def invalidate_user(self, user_id):
+        """Drop a user's rankings (called on new interactions); their cursors recompute"""
+        with self._lock:
+            for token in [t for t, entry in self._entries.items() if entry[1] == str(user_id)]:
+                del self._entries[token]
+
+    def page(self, user_id, token, offset, limit):
+        """(product ids, scores, meta, has_more) for one page; None when the ranking is gone"""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] != str(user_id) or time.monotonic() - entry[0] > self.ttl:
+                self.stats['expired'] += 1
+                return None
+            self._entries.move_to_end(token)
+            self.stats['pages'] += 1
+        _, _, product_ids, scores, meta = entry
+        end = offset + limit
+        return product_ids[offset:end], scores[offset:end], meta, end < len(product_ids)
@@ -4,6 +4,10 @@ Recommendation API for real-time inference
 Loads pre-trained models for e-commerce recommendations
 """
 
+import time
+# Request budgets from the Node caller include process start-up (TensorFlow import, model load)
+PROCESS_STARTED = time.monotonic()
+
 import sys
 import json
 import os
@@ -11,9 +15,10 @@ import numpy as np
 import pandas as pd
 import tensorflow as tf
 from sklearn.preprocessing import LabelEncoder
-import mysql.connector
 from datetime import datetime
 import pickle
+import threading
+import copy
 
 # Redirect all print statements to stderr by default for this module
 _original_print = print
@@ -25,6 +30,9 @@ def print(*args, **kwargs):
 # Suppress TensorFlow logging and progress bars
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 tf.config.set_visible_devices([], 'GPU')
+# Thread pools, batch and chunk sizes tuned for this host by autotune.py
+from autotune import TUNING, apply_threads
+apply_threads(tf)
 tf.keras.utils.disable_interactive_logging()
 import logging
 logging.getLogger('tensorflow').setLevel(logging.ERROR)
@@ -40,40 +48,121 @@ class SuppressOutput:
         sys.stdout.close()
         sys.stdout = self._original_stdout
 
-# Database configuration
-DB_CONFIG = {
-    'host': '127.0.0.1',
-    'user': 'root',
-    'password': '',
-    'database': 'ecom'
-}
+# MySQL in production; RECO_STORAGE selects a SQLite or in-memory stand-in
+from storage import STORAGE
 
 # Import model classes
 from model_classes import BMF, NeuMF, LNCM, ENCM
+from catalog_cache import CatalogCache
+from batch_lookup import BatchLookup
+from single_flight import SingleFlight, request_key
+from deadline import (Deadline, ScoreCostModel, REDUCED_CANDIDATES,
+                      TIER_FULL, TIER_REDUCED, TIER_CACHED, TIER_POPULARITY, TIER_SHED, TIER_PRECOMPUTED,
+                      TIER_BUCKET)
+from result_cache import ResultCache
+from admission import AdmissionController
+from popular_items import PopularItems
+from embedding_tables import EmbeddingTables
+from fold_in import FoldInCache, fold_in, ACTION_WEIGHTS, FOLD_IN_HISTORY
+from cold_items import cold_item_vectors
+from online_bmf import OnlineBMF
+from bitset_index import CatalogBitsets, UserBitsets, pack
+from ranking_cache import RankingCache, RANKING_MAX_PAGES, encode_cursor, decode_cursor
+from item_neighbours import ItemNeighbours, NEIGHBOUR_MODELS
+from co_occurrence import CoOccurrence, CO_OCCURRENCE_NAME
+from session_store import SessionStore, SESSION_WEIGHT
+from model_bandit import ModelBandit, segment_of, AUTO_MODEL
+from shadow import ShadowScorer
+from bulk_topn import (TopNStore, TOPN_MIN_HISTORY, WarmCalibration, encm_calibrated, encm_user_contexts, top_n,
+                       user_frame)
+from shard_ring import Membership, RECO_SHARD_SELF, SHARD_TABLES_DIR
+from context_buckets import BucketCache, BUCKET_N, BUCKET_ACTIVE_DAYS, bucket_of, bucket_time_context
 
 
 class TrainedRecommendationSystem:
     def __init__(self):
-        self.db_connection = None
+        self._db_local = threading.local()
         self.models = {}
         self.encoders = {}
         self.data_stats = {}
         self.context_encoders = {}
+        self._encm_codes = None
+        # Serve from the last snapshot right away; a stale one is refreshed in the background
+        self.catalog_cache = CatalogCache()
+        self.catalog_cache.load()
+        # Data derived from one catalog version (ENCM codes, filter bitsets, cold-item rows) is
+        # built under this lock and published with a single assignment
+        self._derived_lock = threading.Lock()
+        # Request filters (category, brand, price range, seen/purchased) select positions before scoring
+        self.bitsets = CatalogBitsets()
+        self.user_bitsets = UserBitsets()
         self.initialize_database()
+        # Per-user single-row lookups are batched across concurrent requests
+        self.lookups = BatchLookup(self._connect)
+        # Identical requests arriving together (retries, double page loads) share one computation
+        self.inflight = SingleFlight()
+        # Budgeted requests step down to cheaper tiers using these
+        self.score_cost = ScoreCostModel()
+        self.result_cache = ResultCache()
+        # Rankings behind `next_cursor` (RANKING_MAX_PAGES deep), so later pages are slices instead of re-scoring
+        self.rankings = RankingCache()
+        # Overload protection: bounded concurrency, shed requests get precomputed popularity
+        self.admission = AdmissionController()
+        self.popular = PopularItems()
+        # Users missing from the trained user table get a vector fitted from their recent interactions
+        self.fold_in_cache = FoldInCache()
+        self.fold_in_cache.load()
+        self.tables = {}
+        # "Similar products" lists built offline by item_neighbours.py, "bought together" by co_occurrence.py
+        self.neighbours = ItemNeighbours()
+        self.co_occurrence = CoOccurrence()
+        # Products viewed in the current session (fed by the change feed) steer the ranking
+        self.sessions = SessionStore()
+        # Daily per-user top-N from bulk_topn.py; a lookup replaces scoring while it is fresh
+        self.topn = TopNStore()
+        # ENCM top-N per (user, context bucket), materialized ahead of each time-of-day bucket
+        self.context_buckets = BucketCache()
+        # model 'auto': one model per request, chosen per segment from rewards on served lists
+        self.bandit = ModelBandit()
+        self.bandit.load()
+        # Challenger models (RECO_SHADOW_MODELS) re-score served requests on a background thread
+        self.shadow = ShadowScorer(
+            lambda user_id, model_name, limit, context, filters:
+                self.get_recommendations(user_id, model_name, limit, context, None, filters, shadow=True))
+        # BMF rows keep learning from new interactions (started by recommend_server.py)
+        self.online_bmf = OnlineBMF(lambda: self.tables.get('BMF'), self._user_rows, self._item_rows)
+        # RECO_SHARD_SELF set: this node holds and serves only the users the ring assigns to it
+        self.shard = Membership() if RECO_SHARD_SELF else None
         self.load_encoders_and_stats()
         self.load_trained_models()
+        self.load_embedding_tables()
+        if self.shard is not None:
+            self._prepare_shard()
+        self.online_bmf.restore()
+
+    @property
+    def catalog(self):
+        """Current catalog snapshot; a request reads it once and passes that one along"""
+        return self.catalog_cache.current
+
+    def _connect(self):
+        """Open a connection to the configured storage backend"""
+        return STORAGE.connect()
 
     def initialize_database(self):
         try:
-            self.db_connection = mysql.connector.connect(**DB_CONFIG)
-            try:
-                cur = self.db_connection.cursor()
-                cur.execute("SET time_zone = '+07:00'")
-                cur.close()
-            except Exception as tz_e:
-                print(f"Warning: could not set session time_zone: {tz_e}")
+            self._db_local.conn = self._connect()
         except Exception as e:
-            sys.exit(1)
+            # Start anyway: the catalog snapshot serves and each thread reconnects on first use
+            print(f"Warning: database unavailable at start-up: {e}")
+
+    @property
+    def db_connection(self):
+        """Connection for the calling thread (connections are not shared across threads)"""
+        conn = getattr(self._db_local, 'conn', None)
+        if conn is None:
+            conn = self._db_local.conn = self._connect()
+        return conn
 
     def load_encoders_and_stats(self):
         """Load pre-trained encoders and data statistics"""
@@ -240,6 +329,218 @@ class TrainedRecommendationSystem:
             print(f"Error loading models: {e}")
             self.models = {'Popularity': 'fallback'}
 
+    def load_embedding_tables(self):
+        """NumPy copies of the loaded models' tables, for scoring folded-in users"""
+        for name, model in self.models.items():
+            if model == 'fallback':
+                continue
+            try:
+                tables = EmbeddingTables.from_model(name, model)
+            except Exception as e:
+                print(f"Warning: no embedding tables for {name}: {e}")
+                continue
+            if tables is not None:
+                self.tables[name] = tables
+
+    def _prepare_shard(self):
+        """Spill the full user tables to memory-mapped files and keep only this node's rows in RAM"""
+        for name in [n for n, m in self.models.items() if m != 'fallback' and n not in self.tables]:
+            print(f"Warning: {name} has no NumPy tables; not served in sharded mode")
+            del self.models[name]
+        os.makedirs(SHARD_TABLES_DIR, exist_ok=True)
+        self._shard_users = {}
+        for name, tables in self.tables.items():
+            arrays = []
+            for field in ('user_vectors', 'user_bias'):
+                values = getattr(tables, field)
+                if values is None:
+                    arrays.append(None)
+                    continue
+                path = os.path.join(SHARD_TABLES_DIR, f"{name.lower()}_{field}.npy")
+                # Nodes on one host share the files; only the first start after training writes them
+                if not self._spill_current(path, values, f"models/{name.lower()}_model.h5"):
+                    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+                    np.save(tmp_path, values)
+                    os.replace(tmp_path, path)
+                arrays.append(np.load(path, mmap_mode='r'))
+            self._shard_users[name] = arrays
+            # Scored from the tables from here on; the Keras copy of every user row is released
+            self.models[name] = 'tables'
+        self._shard_classes = self.encoders['user'].classes_
+        self.reshard(self.shard.ring())
+
+    @staticmethod
+    def _spill_current(path, values, weights_path):
+        """True when `path` already holds `values`: same shape and dtype, written after the model weights"""
+        try:
+            if os.path.getmtime(path) <= os.path.getmtime(weights_path):
+                return False
+            spilled = np.load(path, mmap_mode='r')
+            return spilled.shape == values.shape and spilled.dtype == values.dtype
+        except (OSError, ValueError):
+            return False
+
+    def reshard(self, ring):
+        """Load the rows of the users this node owns under `ring`. Each model's tables are replaced
+        whole, carrying the shard-local user encoder for their rows, so a request that read one
+        tables object never pairs an encoder with another layout's rows."""
+        owned = ring.owned_mask(RECO_SHARD_SELF, self._shard_classes)
+        # Encoder classes past the end of a table (padding) have no trained row anywhere
+        n_rows = min([len(vectors) for vectors, _ in self._shard_users.values()] or [len(owned)])
+        rows = np.flatnonzero(owned[:n_rows])
+        encoder = LabelEncoder()
+        encoder.classes_ = self._shard_classes[rows]
+        # Row copies first, outside the lock; the item side is taken from the tables current at publish time
+        user_tables = {name: (np.array(vectors[rows]), np.array(bias[rows]) if bias is not None else None)
+                       for name, (vectors, bias) in self._shard_users.items()}
+        with self._derived_lock:
+            for name, (user_vectors, user_bias) in user_tables.items():
+                tables = copy.copy(self.tables[name])
+                tables.user_vectors = user_vectors
+                tables.user_bias = user_bias
+                tables.user_encoder = encoder
+                self.tables[name] = tables
+            self.shard_users = len(rows)
+        print(f"Shard {RECO_SHARD_SELF}: {len(rows)} of {len(owned)} users across {len(ring.nodes)} nodes")
+        return len(rows)
+
+    def owns(self, user_id):
+        return self.shard is None or self.shard.ring().node_for(user_id) == RECO_SHARD_SELF
+
+    def apply_interaction_event(self, event):
+        """Change-feed event from the Node API: drop the user's cached state, update live counters"""
+        user_id = event.get('userId')
+        if user_id is None:
+            return
+        self.result_cache.invalidate_user(user_id)
+        self.fold_in_cache.invalidate_user(user_id)
+        self.user_bitsets.invalidate_user(user_id)
+        self.rankings.invalidate_user(user_id)
+        if event.get('type') != 'interaction':
+            return
+        self.popular.record(event['productId'], event.get('actionCode'))
+        # Per-user state lives on the user's own shard
+        if not self.owns(user_id):
+            return
+        if event.get('actionCode') == 'view':
+            self.sessions.record_view(user_id, event['productId'])
+        if 'BMF' in self.tables:
+            self.online_bmf.observe(event.get('interId'), user_id, event['productId'], event.get('actionCode'))
+
+    def _catalog_bitsets(self, catalog):
+        """Bitset indexes for this catalog version (prices read once per version)"""
+        bitsets = self.bitsets
+        if bitsets.version == catalog.version:
+            return bitsets
+        with self._derived_lock:
+            bitsets = self.bitsets
+            if bitsets.version == catalog.version:
+                return bitsets
+            prices = np.full(len(catalog), np.nan)
+            try:
+                # Price shown for a product is its first detail's discountPrice
+                price_query = """
+                    SELECT d.productId, d.discountPrice
+                    FROM productdetails d
+                    JOIN (SELECT productId, MIN(id) AS id FROM productdetails GROUP BY productId) f ON f.id = d.id
+                """
+                price_df = pd.read_sql(price_query, self.db_connection)
+                positions = catalog.positions_of(price_df['productId'].astype(np.int64).values)
+                found = positions >= 0
+                prices[positions[found]] = price_df['discountPrice'].astype(float).values[found]
+            except Exception as e:
+                print(f"Warning: product prices unavailable, price filters match nothing: {e}")
+            bitsets = CatalogBitsets()
+            bitsets.build(catalog, prices)
+            # A request still on an older snapshot gets its own index without replacing the newer one
+            if self.bitsets.version is None or self.bitsets.version < catalog.version:
+                self.bitsets = bitsets
+        return bitsets
+
+    def _user_exclusion(self, catalog, user_id, filters):
+        """Bitset of positions the user has seen or purchased, as requested by the filters"""
+        if not (filters.get('exclude_seen') or filters.get('exclude_purchased')):
+            return None
+        version = catalog.version
+        cached = self.user_bitsets.get(user_id, version)
+        if cached is None:
+            seen_query = f"""
+                SELECT productId, MAX(actionCode = 'purchase') AS purchased
+                FROM interactions
+                WHERE userId = {int(user_id)}
+                GROUP BY productId
+            """
+            seen_df = pd.read_sql(seen_query, self.db_connection)
+            positions = catalog.positions_of(seen_df['productId'].astype(np.int64).values)
+            found = positions >= 0
+            seen = np.zeros(len(catalog), dtype=bool)
+            purchased = np.zeros(len(catalog), dtype=bool)
+            seen[positions[found]] = True
+            purchased[positions[found & (seen_df['purchased'].astype(int).values == 1)]] = True
+            cached = (pack(seen), pack(purchased))
+            self.user_bitsets.put(user_id, version, *cached)
+        return cached[0] if filters.get('exclude_seen') else cached[1]
+
+    @staticmethod
+    def _cold_current(tables, catalog):
+        return tables.cold_version is not None and tables.cold_version >= catalog.version
+
+    def _refresh_cold_items(self, catalog):
+        """Append rows for products the models were not trained on, once per catalog version"""
+        if all(self._cold_current(tables, catalog) for tables in self.tables.values()):
+            return
+        with self._derived_lock:
+            for name, tables in list(self.tables.items()):
+                # Tables built for a newer snapshot stay; cold rows are found by product id
+                if self._cold_current(tables, catalog):
+                    continue
+                trained_ids = self.encoders['item'].classes_[:tables.n_trained_items].astype(np.int64)
+                trained_pos = catalog.positions_of(trained_ids)
+                found = trained_pos >= 0
+                trained_category = np.where(found, catalog.category_codes[trained_pos], -1)
+                trained_brand = np.where(found, catalog.brand_codes[trained_pos], -1)
+
+                cold_pos = catalog.active_positions()
+                cold_pos = cold_pos[~np.isin(catalog.ids[cold_pos], trained_ids)]
+                trained_rows = slice(0, len(trained_ids))
+                vectors, bias = cold_item_vectors(
+                    tables.item_vectors[trained_rows],
+                    tables.item_bias[trained_rows] if tables.item_bias is not None else None,
+                    trained_category, trained_brand,
+                    catalog.category_codes[cold_pos], catalog.brand_codes[cold_pos],
+                )
+                # Swap in a new object so requests already scoring keep a consistent table
+                self.tables[name] = tables.with_cold_items(catalog.ids[cold_pos], vectors, bias, catalog.version)
+
+    def _user_encoder(self, tables):
+        """Encoder whose indices are rows of these tables' user_vectors"""
+        if tables is not None and tables.user_encoder is not None:
+            return tables.user_encoder
+        return self.encoders['user']
+
+    def _user_rows(self, tables, user_ids):
+        """User table rows for user ids (-1 for users without a trained row)"""
+        encoder = self._user_encoder(tables)
+        rows = np.full(len(user_ids), -1, dtype=np.int64)
+        known = np.isin(user_ids, encoder.classes_)
+        if known.any():
+            rows[known] = encoder.transform(user_ids[known])
+        if tables is not None:
+            rows[rows >= len(tables.user_vectors)] = -1
+        return rows
+
+    def _item_rows(self, tables, product_ids):
+        """Item table rows for product ids: encoder index, else cold-item row, else -1"""
+        rows = np.full(len(product_ids), -1, dtype=np.int64)
+        trained = np.isin(product_ids, self.encoders['item'].classes_)
+        if trained.any():
+            rows[trained] = self.encoders['item'].transform(product_ids[trained])
+        if tables is not None:
+            rows[rows >= tables.n_trained_items] = -1
+            cold = rows < 0
+            rows[cold] = tables.cold_rows(product_ids[cold])
+        return rows
+
     def get_user_context(self, user_id, provided_context=None):
         """Get current context for user"""
         try:
@@ -247,16 +548,14 @@ class TrainedRecommendationSystem:
 
             # Get user gender (keep as string; map later for model)
             if 'gender' not in context:
-                user_query = f"SELECT genderId FROM users WHERE id = {user_id}"
-                user_df = pd.read_sql(user_query, self.db_connection)
-                gender = user_df.iloc[0]['genderId'] if not user_df.empty else None
+                user_rows = self.lookups.load('gender', user_id)
+                gender = user_rows[0]['genderId'] if user_rows else None
                 context['gender'] = gender if gender in ['M','FE','O'] else 'unknown'
 
             # Get device type
             if 'device_type' not in context:
-                device_query = f"SELECT device_type FROM interactions WHERE userId = {user_id} ORDER BY timestamp DESC LIMIT 1"
-                device_df = pd.read_sql(device_query, self.db_connection)
-                context['device_type'] = device_df.iloc[0]['device_type'] if not device_df.empty else 'unknown'
+                device_rows = self.lookups.load('last_device', user_id)
+                context['device_type'] = device_rows[0]['device_type'] if device_rows else 'unknown'
 
             # Get preferred categories and brands
             if 'preferred_categories' not in context or 'preferred_brands' not in context:
@@ -305,8 +604,641 @@ class TrainedRecommendationSystem:
                 'is_weekend': 0
             }
 
-    def get_recommendations(self, user_id, model_name, limit=10, provided_context=None):
-        """Get recommendations for a user using specified model"""
+    @staticmethod
+    def _encode_label(encoder, value):
+        """Encode a single label, falling back to 'unknown' (or 0) for labels unseen in training"""
+        classes = encoder.classes_
+        for label in (value, 'unknown'):
+            if label is None:
+                continue
+            label = str(label)
+            pos = np.searchsorted(classes, label)
+            if pos < len(classes) and classes[pos] == label:
+                return int(pos)
+        return 0
+
+    def _encm_item_codes(self, catalog):
+        """ENCM category/brand codes aligned with catalog positions, rebuilt once per catalog version"""
+        codes = self._encm_codes
+        if codes is None or codes[0] != catalog.version:
+            category_vocab = np.array([self._encode_label(self.context_encoders['category'], c or 'unknown')
+                                       for c in catalog.categories], dtype=np.int32)
+            brand_vocab = np.array([self._encode_label(self.context_encoders['brand'], b or 'unknown')
+                                    for b in catalog.brands], dtype=np.int32)
+            codes = (catalog.version, category_vocab[catalog.category_codes], brand_vocab[catalog.brand_codes])
+            with self._derived_lock:
+                if self._encm_codes is None or self._encm_codes[0] < catalog.version:
+                    self._encm_codes = codes
+        return codes[1], codes[2]
+
+    def _encm_context_row(self, context):
+        """Item-independent ENCM context columns (device .. is_weekend) for one request"""
+        time_of_day_map = {'night': 0, 'morning': 1, 'afternoon': 2, 'evening': 3}
+        season_map = {'winter': 0, 'spring': 1, 'summer': 2, 'autumn': 3}
+        gender_map = {'M': 0, 'FE': 1, 'O': 2}
+
+        device_type_id = self._encode_label(self.context_encoders['device'], context.get('device_type', 'unknown'))
+        time_of_day = time_of_day_map.get(context.get('time_of_day', 'morning'), 1)  # default to morning
+        season = season_map.get(context.get('season', 'summer'), 2)  # default to summer
+        gender_id = gender_map.get(context.get('gender', 'M'), 3)  # default to unknown (3)
+        return np.array([
+            device_type_id, time_of_day, season, gender_id,
+            context.get('hour', 12), context.get('month', 5),
+            context.get('day_of_week', 0), context.get('is_weekend', 0)
+        ], dtype=np.int32)
+
+    def _encm_context_features(self, catalog, cand_pos, context):
+        """ENCM context matrix (category, brand, device .. is_weekend) for candidate catalog positions;
+        all zeros for positions missing from the catalog"""
+        # Item-side codes are cached per catalog version; the request context is a single
+        # row broadcast over every candidate
+        category_codes, brand_codes = self._encm_item_codes(catalog)
+        found = cand_pos >= 0
+        context_features = np.zeros((len(cand_pos), 10), dtype=np.int32)
+        context_features[found, 0] = category_codes[cand_pos[found]]
+        context_features[found, 1] = brand_codes[cand_pos[found]]
+        context_features[found, 2:] = self._encm_context_row(context)
+        return context_features
+
+    @staticmethod
+    def _preference_masks(catalog, cand_pos, preferred_brands, preferred_categories):
+        """Boolean brand/category preference hits for catalog positions"""
+        brand_codes = [code for code, b in enumerate(catalog.brands) if b and b in preferred_brands]
+        category_codes = [code for code, c in enumerate(catalog.categories) if c and c in preferred_categories]
+        found = cand_pos >= 0
+        brand_hit = np.zeros(len(cand_pos), dtype=bool)
+        category_hit = np.zeros(len(cand_pos), dtype=bool)
+        brand_hit[found] = np.isin(catalog.brand_codes[cand_pos[found]], brand_codes)
+        category_hit[found] = np.isin(catalog.category_codes[cand_pos[found]], category_codes)
+        return brand_hit, category_hit
+
+    @staticmethod
+    def _prior_vector(priors_df, product_ids):
+        """Normalized popularity priors aligned with product_ids (0 for products without interactions)"""
+        if priors_df.empty:
+            return np.zeros(len(product_ids), dtype=np.float32)
+        pop = priors_df['pop_score'].astype(float)
+        max_pop = pop.max()
+        norm = pop / max_pop if max_pop > 0 else pop * 0.0
+        lookup = pd.Series(norm.values, index=priors_df['productId'].astype(np.int64).values)
+        return pd.Series(np.asarray(product_ids, dtype=np.int64)).map(lookup).fillna(0.0).values.astype(np.float32)
+
+    def _context_priors(self, context, product_ids):
+        """Normalized popularity priors of product_ids for the request context (time of day, weekend,
+        gender); zeros when the query fails"""
+        try:
+            if not len(product_ids):
+                return np.zeros(0, dtype=np.float32)
+            ids = ','.join(str(int(p)) for p in product_ids)
+            gender_filter = context.get('gender', 'unknown')
+            base_query = f"""
+                SELECT p.id AS productId,
+                       SUM(CASE WHEN i.actionCode='purchase' THEN 3 WHEN i.actionCode='cart' THEN 2 ELSE 1 END) AS pop_score
+                FROM interactions i
+                JOIN products p ON p.id = i.productId
+                LEFT JOIN users u ON u.id = i.userId
+                WHERE p.id IN ({ids})
+            """
+            # Map int time_of_day
+            try:
+                hour = int(context.get('hour', 12))
+                dow = int(context.get('day_of_week', 0))
+                is_weekend = int(context.get('is_weekend', 0))
+                time_of_day = int(context.get('time_of_day', 1))
+                tod_bounds = {0:(0,6),1:(6,12),2:(12,18),3:(18,24)}
+                if time_of_day in tod_bounds:
+                    h0, h1 = tod_bounds[time_of_day]
+                    base_query += f" AND {STORAGE.hour('i.timestamp')} >= {h0} AND {STORAGE.hour('i.timestamp')} < {h1}"
+                if is_weekend == 1:
+                    base_query += f" AND {STORAGE.weekday('i.timestamp')} IN (5,6)"
+                else:
+                    base_query += f" AND {STORAGE.weekday('i.timestamp')} IN (0,1,2,3,4)"
+                base_query += f" AND i.timestamp >= {STORAGE.days_ago(180)}"
+            except Exception:
+                pass
+            if gender_filter in ['M','FE','O']:
+                base_query += f" AND u.genderId = '{gender_filter}'"
+            base_query += " GROUP BY p.id"
+            priors_df = pd.read_sql(base_query, self.db_connection)
+            return self._prior_vector(priors_df, product_ids)
+        except Exception:
+            return np.zeros(len(product_ids), dtype=np.float32)
+
+    def _history_count(self, user_id):
+        """Interactions of the user (cold start below 10); 0 when the lookup fails"""
+        try:
+            hist_rows = self.lookups.load('history_count', int(user_id))
+            return int(hist_rows[0]['cnt']) if hist_rows else 0
+        except Exception:
+            return 0
+
+    @staticmethod
+    def _session_shifted(tables, item_rows, scores, session_rows):
+        """Scores of candidates close to the session's items moved up, by at most SESSION_WEIGHT of the range"""
+        spread = float(scores.max() - scores.min())
+        similarity = tables.session_similarity(item_rows, session_rows)
+        return scores + SESSION_WEIGHT * spread * similarity.astype(scores.dtype)
+
+    @staticmethod
+    def _encm_ranking(predictions_flat, prior_vec, brand_hit, category_hit, has_prefs, history_count, limit):
+        """(top indices, final scores) of ENCM predictions: cold users (under 10 interactions) blend them
+        with the context priors and get preferred items first, warm users the light calibration"""
+        is_pref = brand_hit | category_hit
+        if history_count < 10:
+            # Normalize predictions 0..1
+            pmin = float(np.min(predictions_flat))
+            pmax = float(np.max(predictions_flat))
+            pred_norm = (predictions_flat - pmin) / (pmax - pmin + 1e-8)
+            priors_vec = prior_vec.copy()
+            # Preference boosts gated by priors
+            brand_boost = brand_hit.astype(np.float32)
+            category_boost = category_hit.astype(np.float32)
+            threshold = 10.0
+            k = 0.5
+            alpha_tmp = 1.0 / (1.0 + np.exp(-k * (history_count - threshold)))
+            coldness = 1.0 - alpha_tmp
+            w_brand = 0.8 if has_prefs else 0.3
+            w_cat = 0.8 if has_prefs else 0.3
+            raw_boost = (w_brand * brand_boost + w_cat * category_boost)
+            boost_vec = coldness * raw_boost * prior_vec
+            priors_vec = np.clip(priors_vec + boost_vec, 0.0, 1.0)
+            alpha = 1.0 / (1.0 + np.exp(-0.5 * (history_count - 10.0)))
+            if not has_prefs:
+                alpha = max(0.2, alpha * 0.5)
+            else:
+                alpha = min(alpha, 0.35)
+            blended = alpha * pred_norm + (1 - alpha) * priors_vec
+            time_weight = 0.5 + 0.5 * priors_vec
+            blended = blended * time_weight
+            predictions_flat = blended
+            # Preference-first rerank with time constraint
+            order_desc = np.argsort(predictions_flat)[::-1]
+            min_prior = 0.25
+            pref_indices = order_desc[is_pref[order_desc] & (prior_vec[order_desc] >= min_prior)]
+            nonpref_indices = order_desc[~is_pref[order_desc]]
+            if len(pref_indices) > 0:
+                preferred_quota = min(len(pref_indices), max(int(0.5 * limit), 3))
+                need = max(limit - preferred_quota, 0)
+                top_indices = list(pref_indices[:preferred_quota]) + list(nonpref_indices[:need])
+            else:
+                top_indices = order_desc[:limit]
+            return top_indices, predictions_flat
+        try:
+            # Small time-aware calibration and preference bonus gated by time prior
+            calibrated = encm_calibrated(predictions_flat, prior_vec, is_pref)
+            order_desc = np.argsort(calibrated)[::-1]
+            top_indices = order_desc[:limit]
+            predictions_flat = calibrated
+        except Exception:
+            order_desc = np.argsort(predictions_flat)[::-1]
+            top_indices = order_desc[:limit]
+        return top_indices, predictions_flat
+
+    @staticmethod
+    def _pad_by_prior(top_indices, predictions_flat, prior_vec, limit):
+        """(indices, scores) of the ranked items, padded to `limit` by prior among the candidates
+        not already chosen"""
+        top_indices = [int(idx) for idx in top_indices]
+        item_scores = [float(predictions_flat[idx]) for idx in top_indices]
+        if len(top_indices) < limit:
+            chosen = np.zeros(len(predictions_flat), dtype=bool)
+            chosen[top_indices] = True
+            by_prior = np.argsort(-prior_vec, kind='stable')
+            extra = [int(idx) for idx in by_prior[~chosen[by_prior]][:limit - len(top_indices)]]
+            top_indices += extra
+            item_scores += [float(prior_vec[idx]) for idx in extra]
+        return top_indices, item_scores
+
+    @staticmethod
+    def _display_fields(catalog, positions):
+        """(name, brand) for the final items, gathered from the catalog in one pass"""
+        fields = []
+        for pos in positions:
+            if pos < 0:
+                fields.append((None, 'Unknown Brand'))
+            else:
+                fields.append((catalog.name(pos), catalog.brand_id(pos) or 'Unknown Brand'))
+        return fields
+
+    def _fold_in_history(self, user_id, context, tables):
+        """(item rows, ENCM context rows, ratings) of the user's recent interactions with scorable items"""
+        history_query = f"""
+            SELECT productId, actionCode, device_type, timestamp
+            FROM interactions
+            WHERE userId = {int(user_id)} AND actionCode IN ('cart', 'purchase', 'view')
+            ORDER BY timestamp DESC
+            LIMIT {FOLD_IN_HISTORY}
+        """
+        history = pd.read_sql(history_query, self.db_connection)
+        product_ids = history['productId'].astype(np.int64).values
+        item_rows = self._item_rows(tables, product_ids)
+        known = item_rows >= 0
+        history = history[known]
+        item_rows = item_rows[known]
+        ratings = history['actionCode'].map(ACTION_WEIGHTS).fillna(0.0).values.astype(np.float64)
+
+        # Context columns as built by extract_training_data.py, at each interaction's time
+        ts = pd.to_datetime(history['timestamp'])
+        hour = ts.dt.hour.values
+        month = ts.dt.month.values - 1
+        day_of_week = ts.dt.dayofweek.values
+        context_features = np.zeros((len(history), 10), dtype=np.int32)
+        if len(history):
+            catalog = self.catalog
+            category_codes, brand_codes = self._encm_item_codes(catalog)
+            positions = catalog.positions_of(product_ids[known])
+            found = positions >= 0
+            context_features[found, 0] = category_codes[positions[found]]
+            context_features[found, 1] = brand_codes[positions[found]]
+            context_features[:, 2] = [self._encode_label(self.context_encoders['device'], d or 'unknown')
+                                      for d in history['device_type']]
+            context_features[:, 3] = hour // 6
+            context_features[:, 4] = np.select([month <= 2, month <= 5, month <= 8], [0, 1, 2], 3)
+            context_features[:, 5] = {'M': 0, 'FE': 1, 'O': 2}.get(context.get('gender'), 3)
+            context_features[:, 6] = hour
+            context_features[:, 7] = month
+            context_features[:, 8] = day_of_week
+            context_features[:, 9] = day_of_week >= 5
+        return item_rows, context_features, ratings
+
+    def _fold_in_user(self, user_id, model_name, tables, context):
+        """Cached or freshly fitted (vector, bias) for a user without a trained row"""
+        cached = self.fold_in_cache.get(model_name, user_id)
+        if cached is not None:
+            return cached
+        try:
+            item_rows, context_features, ratings = self._fold_in_history(user_id, context, tables)
+        except Exception as e:
+            # No history available: the mean user is still better than another user's row
+            print(f"Warning: fold-in history unavailable for user {user_id}: {e}")
+            return tables.mean_user, tables.mean_user_bias
+        vector, bias = fold_in(tables, item_rows, ratings, context_features)
+        self.fold_in_cache.put(model_name, user_id, vector, bias)
+        return vector, bias
+
+    def choose_model(self, user_id, provided_context=None):
+        """(model, segment) for a model 'auto' request"""
+        history_count = self._history_count(user_id)
+        # The segment's device is the one scoring sees: the request's, else the user's last one.
+        # Preferences do not enter it; skip their query
+        context = self.get_user_context(user_id, dict(provided_context or {}, preferred_categories=[],
+                                                      preferred_brands=[]))
+        segment = segment_of(context, history_count)
+        if self.bandit.settler is None:
+            # A one-shot run counts the lists whose reward window has closed since the last settle
+            self.bandit.refresh(self.db_connection)
+        arms = [name for name, model in self.models.items() if model != 'fallback'] or ['Popularity']
+        return self.bandit.choose(segment, arms), segment
+
+    def _check_role(self, user_id):
+        """Error response unless the user has role R2 / value 'user'; None when allowed"""
+        try:
+            role_rows = self.lookups.load('role', int(user_id))
+            if not role_rows:
+                return {'ok': False, 'error': 'User not found or no role assigned'}
+            role_value = str(role_rows[0].get('role_value') or '').lower()
+            user_role_code = str(role_rows[0].get('roleId') or '').upper()
+            if not (user_role_code == 'R2' or role_value == 'user'):
+                return {'ok': False, 'error': 'User role not permitted for recommendations'}
+        except Exception as e:
+            return {'ok': False, 'error': f'Role check failed: {e}'}
+        return None
+
+    def sweep_contexts(self, user_id, contexts, limit=10, filters=None):
+        """ENCM top-k for one user under each of several contexts, in one batched forward pass; each
+        context's list is ranked as a request in that context is served (session shift, cold-user blend
+        or warm calibration with that context's priors, padding by prior)"""
+        try:
+            tables = self.tables.get('ENCM')
+            if tables is None:
+                return {'ok': False, 'error': 'Context sweep needs the ENCM model'}
+            role_error = self._check_role(user_id)
+            if role_error:
+                return role_error
+
+            catalog = self.catalog_cache.ensure_fresh(self._connect)
+            self._refresh_cold_items(catalog)
+            tables = self.tables['ENCM']
+            if filters:
+                cand_pos = self._catalog_bitsets(catalog).positions(filters, self._user_exclusion(catalog, user_id, filters))
+            else:
+                cand_pos = catalog.active_positions()
+            product_ids = catalog.ids[cand_pos]
+            item_rows = self._item_rows(tables, product_ids)
+            scorable = item_rows >= 0
+            cand_pos, product_ids, item_rows = cand_pos[scorable], product_ids[scorable], item_rows[scorable]
+
+            # User-level fields (gender, device, preferences) are looked up once and shared
+            base_context = self.get_user_context(user_id, {})
+            user_id_int = int(user_id)
+            user_encoder = self._user_encoder(tables)
+            if user_id_int in user_encoder.classes_:
+                user_idx = int(user_encoder.transform([user_id_int])[0])
+            else:
+                user_idx = len(tables.user_vectors)
+            if user_idx < len(tables.user_vectors):
+                user_vec, _ = tables.user_row(user_idx)
+            else:
+                user_vec, _ = self._fold_in_user(user_id_int, 'ENCM', tables, base_context)
+
+            sweep = [dict(base_context, **(ctx or {})) for ctx in contexts]
+            if not len(item_rows) or not sweep:
+                return {'ok': True, 'model': 'ENCM', 'results': [{'context': ctx, 'items': []} for ctx in sweep]}
+            category_codes, brand_codes = self._encm_item_codes(catalog)
+            item_context = np.stack([category_codes[cand_pos], brand_codes[cand_pos]], axis=1)
+            request_contexts = np.stack([self._encm_context_row(ctx) for ctx in sweep])
+            scores = tables.encm_sweep(user_vec, item_rows, item_context, request_contexts)
+
+            session_rows = np.zeros(0, dtype=np.int64)
+            if len(item_rows) > 1:
+                session_rows = self._item_rows(tables, self.sessions.recent(user_id))
+                session_rows = session_rows[session_rows >= 0]
+            history_count = self._history_count(user_id)
+            priors = {}   # contexts that differ only in device share one priors query
+            results = []
+            for ctx, row_scores in zip(sweep, scores):
+                if len(session_rows):
+                    row_scores = self._session_shifted(tables, item_rows, row_scores, session_rows)
+                prior_key = tuple(str(ctx.get(f)) for f in ('gender', 'time_of_day', 'is_weekend', 'hour', 'day_of_week'))
+                if prior_key not in priors:
+                    priors[prior_key] = self._context_priors(ctx, product_ids)
+                prior_vec = priors[prior_key]
+                preferred_brands = set(ctx.get('preferred_brands', []) or [])
+                preferred_categories = set(ctx.get('preferred_categories', []) or [])
+                brand_hit, category_hit = self._preference_masks(catalog, cand_pos, preferred_brands, preferred_categories)
+                top, final_scores = self._encm_ranking(row_scores, prior_vec, brand_hit, category_hit,
+                                                       bool(preferred_brands or preferred_categories), history_count, limit)
+                top, item_scores = self._pad_by_prior(top, final_scores, prior_vec, limit)
+                items = []
+                for idx, score, (product_name, brand_name) in zip(
+                        top, item_scores, self._display_fields(catalog, cand_pos[top])):
+                    items.append({
+                        'productId': int(product_ids[idx]),
+                        'productName': product_name,
+                        'brandName': brand_name,
+                        'score': score
+                    })
+                results.append({'context': ctx, 'items': items})
+            return {'ok': True, 'model': 'ENCM', 'results': results}
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+    def rerank(self, user_id, model_name, product_ids, provided_context=None, deadline=None, filters=None):
+        """Score and reorder a caller-supplied product list; products the model cannot score go last, unscored"""
+        product_ids = list(dict.fromkeys(int(p) for p in product_ids))
+        if not product_ids:
+            return {'ok': True, 'items': [], 'context': provided_context or {}, 'model': model_name}
+        result = self.get_recommendations(user_id, model_name, len(product_ids), provided_context, deadline,
+                                          filters, candidates=product_ids)
+        if not result.get('ok') or filters:
+            return result
+        ranked = {item['productId'] for item in result['items']}
+        unscored = [pid for pid in product_ids if pid not in ranked]
+        catalog = self.catalog
+        positions = catalog.positions_of(unscored)
+        items = list(result['items'])
+        for product_id, (product_name, brand_name) in zip(unscored, self._display_fields(catalog, positions)):
+            items.append({
+                'productId': product_id,
+                'productName': product_name,
+                'brandName': brand_name,
+                'score': None
+            })
+        return dict(result, items=items)
+
+    def page_response(self, user_id, token, offset, limit=10):
+        """Next page sliced from a stored ranking; None when it has expired"""
+        page = self.rankings.page(user_id, token, offset, limit)
+        if page is None:
+            return None
+        product_ids, scores, meta, has_more = page
+        catalog = self.catalog
+        items = []
+        for product_id, score, (product_name, brand_name) in zip(
+                product_ids, scores, self._display_fields(catalog, catalog.positions_of(product_ids))):
+            items.append({
+                'productId': int(product_id),
+                'productName': product_name,
+                'brandName': brand_name,
+                'score': float(score)
+            })
+        result = dict(meta, ok=True, items=items)
+        if has_more:
+            result['next_cursor'] = encode_cursor(token, offset + len(items))
+        return result
+
+    def similar_items(self, product_id, limit=10, model_name=None):
+        """Active products most similar to one product, read from the precomputed neighbour lists"""
+        try:
+            product_id = int(product_id)
+            names = [model_name] if model_name else [m for m in NEIGHBOUR_MODELS if self.neighbours.available(m)]
+            found = None
+            for name in names:
+                found = self.neighbours.lookup(name, product_id)
+                if found is not None:
+                    model_name = name
+                    break
+            if found is None:
+                return {'ok': True, 'productId': product_id, 'items': [], 'model': model_name}
+            neighbour_ids, scores = found
+            catalog = self.catalog_cache.ensure_fresh(self._connect)
+            positions = catalog.positions_of(neighbour_ids)
+            # Lists are built offline; drop products deactivated since
+            active = np.zeros(len(positions), dtype=bool)
+            active[positions >= 0] = catalog.active[positions[positions >= 0]]
+            keep = np.flatnonzero(active)[:limit]
+            items = []
+            for idx, (product_name, brand_name) in zip(keep, self._display_fields(catalog, positions[keep])):
+                items.append({
+                    'productId': int(neighbour_ids[idx]),
+                    'productName': product_name,
+                    'brandName': brand_name,
+                    'score': float(scores[idx])
+                })
+            return {'ok': True, 'productId': product_id, 'items': items, 'model': model_name}
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+    def bought_together(self, product_ids, limit=10):
+        """Cross-sell for a cart: co-bought products of every cart item, scores summed, cart items excluded"""
+        try:
+            product_ids = list(dict.fromkeys(int(p) for p in product_ids))
+            merged = {}
+            for product_id in product_ids:
+                found = self.neighbours.lookup(CO_OCCURRENCE_NAME, product_id)
+                if found is None:
+                    continue
+                for neighbour_id, score in zip(*found):
+                    merged[int(neighbour_id)] = merged.get(int(neighbour_id), 0.0) + float(score)
+            for product_id in product_ids:
+                merged.pop(product_id, None)
+            ranked = sorted(merged.items(), key=lambda kv: -kv[1])
+            catalog = self.catalog_cache.ensure_fresh(self._connect)
+            positions = catalog.positions_of([pid for pid, _ in ranked])
+            active = np.zeros(len(positions), dtype=bool)
+            active[positions >= 0] = catalog.active[positions[positions >= 0]]
+            keep = np.flatnonzero(active)[:limit]
+            items = []
+            for idx, (product_name, brand_name) in zip(keep, self._display_fields(catalog, positions[keep])):
+                items.append({
+                    'productId': ranked[idx][0],
+                    'productName': product_name,
+                    'brandName': brand_name,
+                    'score': ranked[idx][1]
+                })
+            return {'ok': True, 'product_ids': product_ids, 'items': items, 'model': 'CoOccurrence'}
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+    def materialize_bucket(self, start, expires_at):
+        """Score recently active warm users with ENCM, calibrated as live, for the context bucket starting
+        at `start`"""
+        tables = self.tables.get('ENCM')
+        if tables is None:
+            return 0
+        catalog = self.catalog_cache.ensure_fresh(self._connect)
+        self._refresh_cold_items(catalog)
+        tables = self.tables['ENCM']
+        cand_pos = catalog.active_positions()
+        product_ids = catalog.ids[cand_pos]
+        item_rows = self._item_rows(tables, product_ids)
+        scorable = item_rows >= 0
+        positions, product_ids, item_rows = cand_pos[scorable], product_ids[scorable], item_rows[scorable]
+        if not len(item_rows):
+            return 0
+        category_codes, brand_codes = self._encm_item_codes(catalog)
+        item_context = np.stack([category_codes[positions], brand_codes[positions]], axis=1)
+
+        active_df = pd.read_sql(f"""
+            SELECT DISTINCT userId FROM interactions
+            WHERE timestamp >= {STORAGE.days_ago(BUCKET_ACTIVE_DAYS)}
+        """, self.db_connection)
+        user_ids = active_df['userId'].dropna().astype(np.int64).values
+        user_rows = self._user_rows(tables, user_ids)
+        user_ids, user_rows = user_ids[user_rows >= 0], user_rows[user_rows >= 0]
+        users = user_frame(self, user_ids)
+        # Cold users get the prior-blended path live, as in the bulk store
+        warm = (users['cnt'] >= TOPN_MIN_HISTORY).values
+        user_ids, user_rows = user_ids[warm], user_rows[warm]
+        time_context = bucket_time_context(start)
+        user_contexts = encm_user_contexts(self, users[warm], time_context)
+        calibration = WarmCalibration(self, catalog, positions, product_ids, users[warm], time_context)
+        user_biases = tables.user_bias if tables.user_bias is not None else np.zeros(len(tables.user_vectors))
+
+        block = max(1, TUNING['chunk_elements'] // (len(item_rows) * tables.dense[0][0].shape[1]))
+        for first in range(0, len(user_ids), block):
+            rows = user_rows[first:first + block]
+            scores = tables.score_users(tables.user_vectors[rows], user_biases[rows], item_rows, item_context,
+                                        user_contexts[first:first + block])
+            top, top_scores = top_n(calibration.apply(scores, first), BUCKET_N)
+            for i in range(len(rows)):
+                self.context_buckets.put(user_ids[first + i], bucket_of(user_contexts[first + i]),
+                                         product_ids[top[i]], top_scores[i], expires_at)
+        return len(user_ids)
+
+    def _stored_response(self, user_id, model_name, found, limit, provided_context, tier):
+        """Response from a precomputed (product ids, scores) list, minus deactivated products;
+        None when live scoring is needed"""
+        if found is None:
+            return None
+        product_ids, scores = found
+        catalog = self.catalog
+        positions = catalog.positions_of(product_ids)
+        active = np.zeros(len(positions), dtype=bool)
+        active[positions >= 0] = catalog.active[positions[positions >= 0]]
+        keep = np.flatnonzero(active)
+        if len(keep) < limit:
+            return None
+        items = []
+        for idx, (product_name, brand_name) in zip(keep[:limit], self._display_fields(catalog, positions[keep[:limit]])):
+            items.append({
+                'productId': int(product_ids[idx]),
+                'productName': product_name,
+                'brandName': brand_name,
+                'score': float(scores[idx])
+            })
+        context = provided_context or {}
+        result = {'ok': True, 'items': items, 'context': context, 'model': model_name, 'tier': tier}
+        if len(keep) > limit:
+            keep = keep[:limit * RANKING_MAX_PAGES]
+            token = self.rankings.put(user_id, product_ids[keep], scores[keep],
+                                      {'context': context, 'model': model_name, 'tier': tier})
+            result['next_cursor'] = encode_cursor(token, limit)
+        return result
+
+    def precomputed_response(self, user_id, model_name, limit, provided_context=None):
+        """Top-N from the context buckets (ENCM) or the bulk store; None when live scoring is needed.
+        ENCM lists are only served for the context bucket they were scored in."""
+        if len(self.sessions.recent(user_id)):
+            return None
+        bucket = None
+        if model_name == 'ENCM':
+            # Preferences do not enter the bucket; skip their query
+            context = self.get_user_context(user_id, dict(provided_context or {}, preferred_categories=[],
+                                                          preferred_brands=[]))
+            bucket = bucket_of(self._encm_context_row(context))
+            if len(self.context_buckets):
+                found = self._stored_response(user_id, model_name, self.context_buckets.get(user_id, bucket), limit,
+                                              provided_context, TIER_BUCKET)
+                if found is not None:
+                    return found
+        return self._stored_response(user_id, model_name, self.topn.lookup(model_name, user_id, bucket), limit,
+                                     provided_context, TIER_PRECOMPUTED)
+
+    def budget_spent_response(self, user_id, model_name, limit=10, filters=None, candidates=None):
+        """Cached result when there is one, else precomputed popularity; no DB or model work"""
+        cached = None if (filters or candidates is not None) else self.result_cache.get(user_id, model_name)
+        if cached is not None:
+            return dict(cached, items=cached['items'][:limit], tier=TIER_CACHED)
+        return dict(self.popular_response(limit, filters, candidates), tier=TIER_POPULARITY)
+
+    def popular_response(self, limit=10, filters=None, product_ids=None):
+        """Cheap answer for shed requests: precomputed popularity, no DB or model work once the list
+        is filled; short lists are padded from the catalog, and no list at all is an error"""
+        if not self.popular.refreshed_at:
+            try:
+                self.popular.refresh_if_empty(self.db_connection)
+            except Exception as e:
+                print(f"Warning: popularity refresh failed: {e}", file=sys.stderr)
+        ranked = self.popular.top()
+        if product_ids is not None:
+            # Shed rerank: the caller's products by global popularity, the rest in their given order
+            popularity = dict(ranked)
+            product_ids = list(dict.fromkeys(int(p) for p in product_ids))
+            ranked = sorted(((pid, popularity.get(pid, 0.0)) for pid in product_ids), key=lambda kv: -kv[1])
+            limit = len(ranked)
+        catalog, bitsets = self.catalog, self.bitsets
+        positions = catalog.positions_of([pid for pid, _ in ranked])
+        allowed = catalog.active
+        if filters and bitsets.version == catalog.version:
+            # Catalog filters only when their bitsets are already built; user exclusions need MySQL
+            allowed = np.zeros(len(catalog), dtype=bool)
+            allowed[bitsets.positions(filters)] = True
+        active = np.array([pos >= 0 and bool(allowed[pos]) for pos in positions], dtype=bool)
+        keep = np.flatnonzero(active)[:limit]
+        ranked = [ranked[i] for i in keep]
+        positions = positions[keep]
+        if product_ids is None and len(ranked) < limit:
+            # Products without recent interactions, in catalog order, after the popular ones
+            pad = np.setdiff1d(np.flatnonzero(allowed), positions, assume_unique=True)[:limit - len(ranked)]
+            ranked += [(int(catalog.ids[pos]), 0.0) for pos in pad]
+            positions = np.concatenate([positions, pad]).astype(np.int64)
+        if not ranked:
+            return {'ok': False, 'error': 'No popular products available'}
+        items = []
+        for (product_id, score), (product_name, brand_name) in zip(ranked, self._display_fields(catalog, positions)):
+            items.append({
+                'productId': int(product_id),
+                'productName': product_name,
+                'brandName': brand_name,
+                'score': float(score)
+            })
+        return {'ok': True, 'items': items, 'context': {}, 'model': 'Popularity', 'tier': TIER_SHED}
+
+    def get_recommendations(self, user_id, model_name, limit=10, provided_context=None, deadline=None, filters=None,
+                            candidates=None, shadow=False):
+        """Get recommendations for a user using specified model, within the optional deadline and filters
+        (`candidates`: restrict scoring to these product ids, see rerank; `shadow`: challenger run, not served)"""
         try:
             if model_name not in self.models:
                 # Choose best available fallback order
@@ -320,126 +1252,164 @@ class TrainedRecommendationSystem:
             model = self.models.get(model_name)
 
             # Early role check: only R2 or value 'user'
-            try:
-                role_q = f"""
-                    SELECT u.roleId,
-                           a.value AS role_value,
-                           a.code AS role_code
-                    FROM users u
-                    LEFT JOIN allcodes a
-                      ON a.type = 'ROLE' AND a.code = u.roleId
-                    WHERE u.id = {int(user_id)}
-                """
-                role_df = pd.read_sql(role_q, self.db_connection)
-                if role_df.empty:
-                    return {'ok': False, 'error': 'User not found or no role assigned'}
-                role_value = str(role_df.iloc[0].get('role_value') or '').lower()
-                user_role_code = str(role_df.iloc[0].get('roleId') or '').upper()
-                if not (user_role_code == 'R2' or role_value == 'user'):
-                    return {'ok': False, 'error': 'User role not permitted for recommendations'}
-            except Exception as e:
-                return {'ok': False, 'error': f'Role check failed: {e}'}
-
-            # Get all available products
-            products_df = pd.read_sql("SELECT id, name, categoryId, brandId FROM products WHERE statusId = 'S1'", self.db_connection)
-            product_ids = products_df['id'].values
+            role_error = self._check_role(user_id)
+            if role_error:
+                return role_error
+
+            # Not even the scoring overhead fits: skip the catalog refresh and the DB reads
+            if deadline is not None and deadline.remaining() < self.score_cost.estimate(model_name, 0):
+                return self.budget_spent_response(user_id, model_name, limit, filters, candidates)
+
+            # Candidates are positions in this one catalog snapshot; display fields are attached to
+            # the final top-k only
+            catalog = self.catalog_cache.ensure_fresh(self._connect)
+            if not (filters or candidates is not None or shadow):
+                precomputed = self.precomputed_response(user_id, model_name, limit, provided_context)
+                if precomputed is not None:
+                    return precomputed
+            self._refresh_cold_items(catalog)
+            tables = self.tables.get(model_name)
+            if candidates is not None:
+                # Caller-supplied list: work follows the list size, not the catalog
+                cand_pos = catalog.positions_of(candidates)
+                cand_pos = np.unique(cand_pos[cand_pos >= 0])
+                if filters:
+                    bitsets = self._catalog_bitsets(catalog)
+                    exclude = self._user_exclusion(catalog, user_id, filters)
+                    cand_pos = cand_pos[np.isin(cand_pos, bitsets.positions(filters, exclude))]
+            elif filters:
+                bitsets = self._catalog_bitsets(catalog)
+                cand_pos = bitsets.positions(filters, self._user_exclusion(catalog, user_id, filters))
+            else:
+                cand_pos = catalog.active_positions()
+            if (filters or candidates is not None) and not len(cand_pos):
+                return {'ok': True, 'items': [], 'context': provided_context or {}, 'model': model_name, 'tier': TIER_FULL}
+            product_ids = catalog.ids[cand_pos]
 
             # Convert to model indices
             try:
                 user_id_int = int(user_id)
-                if user_id_int in self.encoders['user'].classes_:
-                    user_idx = self.encoders['user'].transform([user_id_int])[0]
+                # Row indices of the tables read above (shard-local when sharded)
+                user_encoder = self._user_encoder(tables)
+                user_known = user_id_int in user_encoder.classes_
+                if user_known:
+                    user_idx = user_encoder.transform([user_id_int])[0]
                 else:
-                    user_idx = 0  # fallback
-
-                valid_product_ids = [pid for pid in product_ids if pid in self.encoders['item'].classes_]
-                if not valid_product_ids:
-                    valid_product_ids = [self.encoders['item'].classes_[0]]
-                item_indices = self.encoders['item'].transform(valid_product_ids)
+                    user_idx = 0  # placeholder row; scored with a folded-in vector where supported
+
+                # Products listed after training are scored through their cold-item rows
+                item_rows = self._item_rows(tables, product_ids)
+                scorable = item_rows >= 0
+                valid_product_ids = product_ids[scorable]
+                cand_pos = cand_pos[scorable]
+                item_indices = item_rows[scorable]
+                if candidates is not None and not len(valid_product_ids):
+                    return {'ok': True, 'items': [], 'context': provided_context or {}, 'model': model_name, 'tier': TIER_FULL}
+                if not len(valid_product_ids):
+                    valid_product_ids = np.array([self.encoders['item'].classes_[0]], dtype=np.int64)
+                    cand_pos = catalog.positions_of(valid_product_ids)
+                    item_indices = self.encoders['item'].transform(valid_product_ids)
 
                 # Guard indices within model embeddings
                 model_n_users = getattr(model, 'n_users', None)
                 model_n_items = getattr(model, 'n_items', None)
                 if isinstance(model_n_users, int) and user_idx >= model_n_users:
                     user_idx = 0
+                    user_known = False
+                if tables is not None:
+                    model_n_items = len(tables.item_vectors)
                 if isinstance(model_n_items, int):
                     mask = item_indices < model_n_items
                     if not np.any(mask):
                         model_name = 'Popularity'
                         model = self.models.get('Popularity')
+                        tables = None
                     else:
                         item_indices = item_indices[mask]
-                        valid_product_ids = list(np.array(valid_product_ids)[mask])
+                        valid_product_ids = valid_product_ids[mask]
+                        cand_pos = cand_pos[mask]
             except Exception as e:
                 return {'ok': False, 'error': f'Encoding error: {e}'}
 
             # Get user context
             context = self.get_user_context(user_id, provided_context)
 
+            # NumPy tables score folded-in users and cold items; everything else uses model.predict
+            user_vector = None
+            if tables is not None:
+                if not user_known:
+                    user_vector = self._fold_in_user(user_id_int, model_name, tables, context)
+                elif self.shard is not None or (len(item_indices) and item_indices.max() >= tables.n_trained_items):
+                    user_vector = tables.user_row(user_idx)
+
             # Prepare input data
             n_items = len(valid_product_ids)
             if n_items == 0:
                 model_name = 'Popularity'
                 model = self.models.get('Popularity')
-                valid_product_ids = [int(self.encoders['item'].classes_[0])]
+                valid_product_ids = np.array([int(self.encoders['item'].classes_[0])], dtype=np.int64)
+                cand_pos = catalog.positions_of(valid_product_ids)
                 n_items = 1
                 item_indices = self.encoders['item'].transform(valid_product_ids)
             user_indices = np.full(n_items, user_idx)
 
+            # Preference hits per candidate, from catalog codes instead of per-item lookups
+            preferred_brands = set(context.get('preferred_brands', []) or [])
+            preferred_categories = set(context.get('preferred_categories', []) or [])
+            has_prefs = (len(preferred_brands) > 0) or (len(preferred_categories) > 0)
+            brand_hit, category_hit = self._preference_masks(catalog, cand_pos, preferred_brands, preferred_categories)
+            is_pref = brand_hit | category_hit
+
+            # Degrade with the remaining budget: full -> reduced candidates -> cached -> popularity
+            tier = TIER_POPULARITY if (model_name == 'Popularity' or model == 'fallback') else TIER_FULL
+            budget_popularity = False
+            if tier == TIER_FULL and deadline is not None:
+                # Cached results are unfiltered full-catalog rankings
+                cached = None if (filters or candidates is not None) else self.result_cache.get(user_id, model_name)
+                tier = self.score_cost.choose_tier(model_name, n_items, deadline, cached is not None)
+                if tier == TIER_CACHED:
+                    return dict(cached, items=cached['items'][:limit], tier=TIER_CACHED)
+                if tier == TIER_POPULARITY:
+                    model_name = 'Popularity'
+                    model = self.models.get('Popularity')
+                    budget_popularity = True
+
+            # Compute priors for ENCM blend/padding (also ranks the reduced candidate tier); a popularity
+            # tier chosen for the budget pads with the popularity path's own priors instead
+            prior_vec = None if budget_popularity else self._context_priors(context, valid_product_ids)
+            if tier == TIER_REDUCED:
+                # Keep the candidates most likely to reach the top-k: preferred first, then by prior
+                keep = np.sort(np.lexsort((-prior_vec, ~is_pref))[:REDUCED_CANDIDATES])
+                valid_product_ids = valid_product_ids[keep]
+                cand_pos = cand_pos[keep]
+                item_indices = item_indices[keep]
+                prior_vec = prior_vec[keep]
+                brand_hit, category_hit, is_pref = brand_hit[keep], category_hit[keep], is_pref[keep]
+                n_items = len(keep)
+                user_indices = np.full(n_items, user_idx)
+
+            score_started = time.monotonic()
             if model_name == 'ENCM':
-                # Get context features for ENCM
-                context_features = []
-                for pid in valid_product_ids:
-                    product_row = products_df[products_df['id'] == pid]
-                    if not product_row.empty:
-                        prod = product_row.iloc[0]
-
-                        # Encode features
-                        category_id = self.context_encoders['category'].transform([prod['categoryId'] or 'unknown'])[0]
-                        brand_id = self.context_encoders['brand'].transform([prod['brandId'] or 'unknown'])[0]
-                        device_type_id = self.context_encoders['device'].transform([context.get('device_type', 'unknown')])[0]
-
-                        # Time features - convert strings to integers
-                        time_of_day_str = context.get('time_of_day', 'morning')
-                        season_str = context.get('season', 'summer')
-                        gender_str = context.get('gender', 'M')
-
-                        # Convert string to int
-                        time_of_day_map = {'night': 0, 'morning': 1, 'afternoon': 2, 'evening': 3}
-                        season_map = {'winter': 0, 'spring': 1, 'summer': 2, 'autumn': 3}
-                        gender_map = {'M': 0, 'FE': 1, 'O': 2}  # Add gender mapping
-
-                        time_of_day = time_of_day_map.get(time_of_day_str, 1)  # default to morning
-                        season = season_map.get(season_str, 2)  # default to summer
-                        gender_id = gender_map.get(gender_str, 3)  # default to unknown (3)
-                        # gender_id đã được convert ở trên
-                        hour_id = context.get('hour', 12)
-                        month_id = context.get('month', 5)
-                        day_of_week_id = context.get('day_of_week', 0)
-                        is_weekend_id = context.get('is_weekend', 0)
-
-                        context_feature = [
-                            category_id, brand_id, device_type_id, time_of_day, season, gender_id,
-                            hour_id, month_id, day_of_week_id, is_weekend_id
-                        ]
-                        context_features.append(context_feature)
-                    else:
-                        context_features.append([0] * 10)
-
-                context_features = np.array(context_features, dtype=np.int32)
-                with SuppressOutput():
-                    predictions = model.predict([user_indices, item_indices, context_features], batch_size=32, verbose=0)
+                context_features = self._encm_context_features(catalog, cand_pos, context)
+                if user_vector is not None:
+                    predictions = tables.score(*user_vector, item_indices, context_features)
+                else:
+                    with SuppressOutput():
+                        predictions = model.predict([user_indices, item_indices, context_features], batch_size=TUNING['predict_batch_size'], verbose=0)
             elif model_name == 'LNCM':
                 # Two-input model without explicit context (LNCM active)
                 with SuppressOutput():
-                    predictions = model.predict([user_indices, item_indices], batch_size=32, verbose=0)
+                    predictions = model.predict([user_indices, item_indices], batch_size=TUNING['predict_batch_size'], verbose=0)
+            elif model_name == 'BMF' and tables is not None:
+                # Always from the tables: they carry the online updates
+                predictions = tables.score(*(user_vector or tables.user_row(user_idx)), item_indices)
             elif model_name in ['BMF', 'NeuMF']:
                 with SuppressOutput():
-                    predictions = model.predict([user_indices, item_indices], batch_size=32, verbose=0)
+                    predictions = model.predict([user_indices, item_indices], batch_size=TUNING['predict_batch_size'], verbose=0)
             else:
                 # Popularity fallback or explicit Popularity
                 try:
-                    valid_ids_tuple = tuple(int(x) for x in valid_product_ids)
+                    ids = ','.join(str(int(p)) for p in valid_product_ids)
                     gender_filter = context.get('gender', 'unknown')
                     base_query = f"""
                         SELECT p.id AS productId,
@@ -447,7 +1417,7 @@ class TrainedRecommendationSystem:
                         FROM interactions i
                         JOIN products p ON p.id = i.productId
                         LEFT JOIN users u ON u.id = i.userId
-                        WHERE p.id IN {valid_ids_tuple}
+                        WHERE p.id IN ({ids})
                     """
                     if gender_filter in ['M','FE','O']:
                         base_query += f" AND u.genderId = '{gender_filter}'"
@@ -456,263 +1426,180 @@ class TrainedRecommendationSystem:
                     tod_map = {'night': (0,6), 'morning': (6,12), 'afternoon': (12,18), 'evening': (18,24)}
                     if isinstance(tod, str) and tod in tod_map:
                         h0, h1 = tod_map[tod]
-                        base_query += f" AND HOUR(i.timestamp) >= {h0} AND HOUR(i.timestamp) < {h1}"
+                        base_query += f" AND {STORAGE.hour('i.timestamp')} >= {h0} AND {STORAGE.hour('i.timestamp')} < {h1}"
                     elif isinstance(tod, int):
                         tb = {0:(0,6),1:(6,12),2:(12,18),3:(18,24)}
                         if tod in tb:
                             h0, h1 = tb[tod]
-                            base_query += f" AND HOUR(i.timestamp) >= {h0} AND HOUR(i.timestamp) < {h1}"
+                            base_query += f" AND {STORAGE.hour('i.timestamp')} >= {h0} AND {STORAGE.hour('i.timestamp')} < {h1}"
                     # Weekend filter
                     is_weekend = int(context.get('is_weekend', 0))
                     if is_weekend == 1:
-                        base_query += " AND WEEKDAY(i.timestamp) IN (5,6)"
+                        base_query += f" AND {STORAGE.weekday('i.timestamp')} IN (5,6)"
                     else:
-                        base_query += " AND WEEKDAY(i.timestamp) IN (0,1,2,3,4)"
-                    base_query += " AND i.timestamp >= DATE_SUB(NOW(), INTERVAL 180 DAY) GROUP BY p.id"
+                        base_query += f" AND {STORAGE.weekday('i.timestamp')} IN (0,1,2,3,4)"
+                    base_query += f" AND i.timestamp >= {STORAGE.days_ago(180)} GROUP BY p.id"
                     priors_df = pd.read_sql(base_query, self.db_connection)
-                    prior_scores = {int(pid): 0.0 for pid in valid_product_ids}
-                    if not priors_df.empty:
-                        priors_df['pop_score'] = priors_df['pop_score'].astype(float)
-                        max_pop = priors_df['pop_score'].max()
-                        priors_df['norm'] = priors_df['pop_score'] / max_pop if max_pop > 0 else 0.0
-                        for _, r in priors_df.iterrows():
-                            prior_scores[int(r['productId'])] = float(r['norm'])
+                    pop_prior_vec = self._prior_vector(priors_df, valid_product_ids)
+                    if prior_vec is None:
+                        prior_vec = pop_prior_vec
                     # Score = prior + preference boosts (time-gated)
-                    preferred_brands = set(context.get('preferred_brands', []) or [])
-                    preferred_categories = set(context.get('preferred_categories', []) or [])
-                    brand_series = products_df.set_index('id')['brandId']
-                    category_series = products_df.set_index('id')['categoryId']
-                    scores = []
-                    for pid in valid_product_ids:
-                        base = prior_scores.get(int(pid), 0.0)
-                        boost = 0.0
-                        b = brand_series.get(pid)
-                        c = category_series.get(pid)
-                        has_prefs = (len(preferred_brands) > 0) or (len(preferred_categories) > 0)
-                        if b in preferred_brands and b is not None:
-                            boost += 0.8 if has_prefs else 0.3
-                        if c in preferred_categories and c is not None:
-                            boost += 0.8 if has_prefs else 0.3
-                        if (b in preferred_brands and b is not None) and (c in preferred_categories and c is not None):
-                            boost += 0.2
-                        scores.append(min(1.0, base + boost))
-                    scores = np.array(scores, dtype=np.float32)
+                    w_pref = 0.8 if has_prefs else 0.3
+                    boost = w_pref * brand_hit + w_pref * category_hit + 0.2 * (brand_hit & category_hit)
+                    scores = np.minimum(1.0, pop_prior_vec + boost).astype(np.float32)
                     # Preferred-first rerank with time constraint
-                    is_pref = np.zeros_like(scores, dtype=np.int32)
-                    for i, pid in enumerate(valid_product_ids):
-                        b = brand_series.get(pid)
-                        c = category_series.get(pid)
-                        if (b in preferred_brands and b is not None) or (c in preferred_categories and c is not None):
-                            is_pref[i] = 1
                     score_order_desc = np.argsort(scores)[::-1]
                     min_prior = 0.25
-                    pref_indices = [idx for idx in score_order_desc if is_pref[idx] == 1 and prior_scores.get(int(valid_product_ids[idx]), 0.0) >= min_prior]
-                    nonpref_indices = [idx for idx in score_order_desc if is_pref[idx] == 0]
+                    pref_indices = score_order_desc[is_pref[score_order_desc] & (pop_prior_vec[score_order_desc] >= min_prior)]
+                    nonpref_indices = score_order_desc[~is_pref[score_order_desc]]
                     if len(pref_indices) > 0:
                         preferred_quota = min(len(pref_indices), max(int(0.5 * limit), 3))
                         need = max(limit - preferred_quota, 0)
-                        top_indices = pref_indices[:preferred_quota] + nonpref_indices[:need]
+                        top_indices = list(pref_indices[:preferred_quota]) + list(nonpref_indices[:need])
                     else:
                         top_indices = score_order_desc[:limit]
                     predictions_flat = scores
                 except Exception as e:
                     return {'ok': False, 'error': str(e)}
 
-            # Compute priors for ENCM blend/padding
-            try:
-                valid_ids_tuple = tuple(int(x) for x in valid_product_ids)
-                gender_filter = context.get('gender', 'unknown')
-                base_query = f"""
-                    SELECT p.id AS productId,
-                           SUM(CASE WHEN i.actionCode='purchase' THEN 3 WHEN i.actionCode='cart' THEN 2 ELSE 1 END) AS pop_score
-                    FROM interactions i
-                    JOIN products p ON p.id = i.productId
-                    LEFT JOIN users u ON u.id = i.userId
-                    WHERE p.id IN {valid_ids_tuple}
-                """
-                # Map int time_of_day
-                try:
-                    hour = int(context.get('hour', 12))
-                    dow = int(context.get('day_of_week', 0))
-                    is_weekend = int(context.get('is_weekend', 0))
-                    time_of_day = int(context.get('time_of_day', 1))
-                    tod_bounds = {0:(0,6),1:(6,12),2:(12,18),3:(18,24)}
-                    if time_of_day in tod_bounds:
-                        h0, h1 = tod_bounds[time_of_day]
-                        base_query += f" AND HOUR(i.timestamp) >= {h0} AND HOUR(i.timestamp) < {h1}"
-                    if is_weekend == 1:
-                        base_query += " AND WEEKDAY(i.timestamp) IN (5,6)"
-                    else:
-                        base_query += " AND WEEKDAY(i.timestamp) IN (0,1,2,3,4)"
-                    base_query += " AND i.timestamp >= DATE_SUB(NOW(), INTERVAL 180 DAY)"
-                except Exception:
-                    pass
-                if gender_filter in ['M','FE','O']:
-                    base_query += f" AND u.genderId = '{gender_filter}'"
-                base_query += " GROUP BY p.id"
-                priors_df = pd.read_sql(base_query, self.db_connection)
-                if priors_df.empty:
-                    prior_scores = {int(pid): 0.0 for pid in valid_product_ids}
-                else:
-                    priors_df['pop_score'] = priors_df['pop_score'].astype(float)
-                    max_pop = priors_df['pop_score'].max()
-                    priors_df['norm'] = priors_df['pop_score'] / max_pop if max_pop > 0 else 0.0
-                    prior_scores = {int(r['productId']): float(r['norm']) for _, r in priors_df.iterrows()}
-                    for pid in valid_product_ids:
-                        if int(pid) not in prior_scores:
-                            prior_scores[int(pid)] = 0.0
-            except Exception:
-                prior_scores = {int(pid): 0.0 for pid in valid_product_ids}
-
+            if 'predictions' in locals():
+                self.score_cost.observe(model_name, n_items, time.monotonic() - score_started)
             predictions_flat = predictions.flatten() if 'predictions' in locals() else predictions_flat
-            # History count (cold start)
-            try:
-                hist_df = pd.read_sql(
-                    f"""
-                    SELECT COUNT(*) AS cnt
-                    FROM interactions
-                    WHERE userId = {int(user_id)}
-                      AND actionCode IN ('cart','purchase','view')
-                    """,
-                    self.db_connection
-                )
-                history_count = int(hist_df.iloc[0]['cnt']) if not hist_df.empty else 0
-            except Exception:
-                history_count = 0
-
-            cold_threshold = 10
-            is_cold = history_count < cold_threshold
-
-            if model_name == 'ENCM' and is_cold:
-                # Normalize predictions 0..1
-                pmin = float(np.min(predictions_flat))
-                pmax = float(np.max(predictions_flat))
-                pred_norm = (predictions_flat - pmin) / (pmax - pmin + 1e-8)
-                priors_vec = np.array([prior_scores[int(pid)] for pid in valid_product_ids], dtype=np.float32)
-                # Preference boosts gated by priors
-                preferred_brands = set(context.get('preferred_brands', []) or [])
-                preferred_categories = set(context.get('preferred_categories', []) or [])
-                brand_boost = np.zeros_like(priors_vec)
-                category_boost = np.zeros_like(priors_vec)
-                brand_series = products_df.set_index('id')['brandId']
-                category_series = products_df.set_index('id')['categoryId']
-                for i, pid in enumerate(valid_product_ids):
-                    b = brand_series.get(pid)
-                    c = category_series.get(pid)
-                    if b in preferred_brands and b is not None:
-                        brand_boost[i] = 1.0
-                    if c in preferred_categories and c is not None:
-                        category_boost[i] = 1.0
-                threshold = 10.0
-                k = 0.5
-                alpha_tmp = 1.0 / (1.0 + np.exp(-k * (history_count - threshold)))
-                coldness = 1.0 - alpha_tmp
-                has_prefs = (len(preferred_brands) > 0) or (len(preferred_categories) > 0)
-                w_brand = 0.8 if has_prefs else 0.3
-                w_cat = 0.8 if has_prefs else 0.3
-                raw_boost = (w_brand * brand_boost + w_cat * category_boost)
-                boost_vec = coldness * raw_boost * np.array([prior_scores[int(pid)] for pid in valid_product_ids], dtype=np.float32)
-                priors_vec = np.clip(priors_vec + boost_vec, 0.0, 1.0)
-                alpha = 1.0 / (1.0 + np.exp(-0.5 * (history_count - 10.0)))
-                if not has_prefs:
-                    alpha = max(0.2, alpha * 0.5)
-                else:
-                    alpha = min(alpha, 0.35)
-                blended = alpha * pred_norm + (1 - alpha) * priors_vec
-                time_weight = 0.5 + 0.5 * priors_vec
-                blended = blended * time_weight
-                predictions_flat = blended
-                # Preference-first rerank with time constraint
-                is_pref = np.zeros_like(predictions_flat, dtype=np.int32)
-                for i, pid in enumerate(valid_product_ids):
-                    b = brand_series.get(pid)
-                    c = category_series.get(pid)
-                    if (b in preferred_brands and b is not None) or (c in preferred_categories and c is not None):
-                        is_pref[i] = 1
-                order_desc = np.argsort(predictions_flat)[::-1]
-                min_prior = 0.25
-                priors_vec2 = np.array([prior_scores.get(int(pid), 0.0) for pid in valid_product_ids], dtype=np.float32)
-                pref_indices = [idx for idx in order_desc if is_pref[idx] == 1 and priors_vec2[idx] >= min_prior]
-                nonpref_indices = [idx for idx in order_desc if is_pref[idx] == 0]
-                if len(pref_indices) > 0:
-                    preferred_quota = min(len(pref_indices), max(int(0.5 * limit), 3))
-                    need = max(limit - preferred_quota, 0)
-                    top_indices = list(pref_indices[:preferred_quota]) + list(nonpref_indices[:need])
-                else:
-                    top_indices = order_desc[:limit]
+            # Candidates close to what the user is viewing right now move up, by at most
+            # SESSION_WEIGHT of the score range
+            session_rows = np.zeros(0, dtype=np.int64)
+            if tables is not None and 'predictions' in locals() and n_items > 1:
+                session_rows = self._item_rows(tables, self.sessions.recent(user_id))
+                session_rows = session_rows[session_rows >= 0]
+            if len(session_rows):
+                predictions_flat = self._session_shifted(tables, item_indices, predictions_flat, session_rows)
+            history_count = self._history_count(user_id)
+
+            if model_name == 'ENCM':
+                top_indices, predictions_flat = self._encm_ranking(predictions_flat, prior_vec, brand_hit, category_hit,
+                                                                   has_prefs, history_count, limit)
             elif model_name == 'Popularity' or model == 'fallback':
                 # top_indices computed in popularity path
                 pass
             else:
-                # Warm user path: lightly rerank ENCM predictions by time-consistent priors and preferences
-                if model_name == 'ENCM':
-                    try:
-                        priors_vec = np.array([prior_scores.get(int(pid), 0.0) for pid in valid_product_ids], dtype=np.float32)
-                        # Small time-aware calibration
-                        calibrated = predictions_flat + 0.15 * priors_vec
-                        # Small preference bonus gated by time prior
-                        preferred_brands = set(context.get('preferred_brands', []) or [])
-                        preferred_categories = set(context.get('preferred_categories', []) or [])
-                        brand_series = products_df.set_index('id')['brandId']
-                        category_series = products_df.set_index('id')['categoryId']
-                        for i, pid in enumerate(valid_product_ids):
-                            if priors_vec[i] >= 0.25:
-                                b = brand_series.get(pid)
-                                c = category_series.get(pid)
-                                if (b in preferred_brands and b is not None) or (c in preferred_categories and c is not None):
-                                    calibrated[i] += 0.07
-                        order_desc = np.argsort(calibrated)[::-1]
-                        top_indices = order_desc[:limit]
-                        predictions_flat = calibrated
-                    except Exception:
-                        order_desc = np.argsort(predictions_flat)[::-1]
-                        top_indices = order_desc[:limit]
-                else:
-                    order_desc = np.argsort(predictions_flat)[::-1]
-                    top_indices = order_desc[:limit]
+                order_desc = np.argsort(predictions_flat)[::-1]
+                top_indices = order_desc[:limit]
+
+            top_indices, item_scores = self._pad_by_prior(top_indices, predictions_flat, prior_vec, limit)
 
-            # Build recommendations
+            # Late materialization: name/brand for the final items only
             recommendations = []
-            for idx in top_indices:
-                product_id = valid_product_ids[int(idx)]
-                score = float(predictions_flat[int(idx)])
-                product_row = products_df[products_df['id'] == product_id].iloc[0]
-                product_name = product_row['name']
-                brand_name = product_row['brandId'] or 'Unknown Brand'
+            for idx, score, (product_name, brand_name) in zip(
+                    top_indices, item_scores, self._display_fields(catalog, cand_pos[top_indices])):
                 recommendations.append({
-                    'productId': int(product_id),
+                    'productId': int(valid_product_ids[idx]),
                     'productName': product_name,
                     'brandName': brand_name,
                     'score': score
                 })
 
-            # Padding to ensure limit
-            if len(recommendations) < limit:
-                try:
-                    existing = set([r['productId'] for r in recommendations])
-                    need = limit - len(recommendations)
-                    extra = [pid for pid in sorted(valid_product_ids, key=lambda x: prior_scores.get(int(x), 0.0), reverse=True) if int(pid) not in existing]
-                    for pid in extra[:need]:
-                        product_row = products_df[products_df['id'] == pid].iloc[0]
-                        recommendations.append({
-                            'productId': int(pid),
-                            'productName': product_row['name'],
-                            'brandName': product_row['brandId'] or 'Unknown Brand',
-                            'score': float(prior_scores.get(int(pid), 0.0))
-                        })
-                except Exception:
-                    pass
-
-            return {
+            result = {
                 'ok': True,
                 'items': recommendations,
                 'context': context,
-                'model': model_name
+                'model': model_name,
+                'tier': tier
             }
+            if shadow:
+                return result
+            if tier in (TIER_FULL, TIER_REDUCED) and not filters and candidates is None and not len(session_rows):
+                self.result_cache.put(user_id, model_name, result)
+
+            # Ordering for later pages: this page as served, then the next best by score, at most
+            # RANKING_MAX_PAGES pages deep; only those are sorted
+            rest = np.ones(len(valid_product_ids), dtype=bool)
+            rest[top_indices] = False
+            rest = np.flatnonzero(rest)
+            depth = limit * (RANKING_MAX_PAGES - 1)
+            if 0 < depth < len(rest):
+                rest = rest[np.argpartition(-predictions_flat[rest], depth - 1)[:depth]]
+            elif depth <= 0:
+                rest = rest[:0]
+            rest = rest[np.argsort(-predictions_flat[rest], kind='stable')]
+            if len(rest):
+                token = self.rankings.put(
+                    user_id,
+                    np.concatenate([valid_product_ids[top_indices], valid_product_ids[rest]]),
+                    np.concatenate([item_scores, predictions_flat[rest]]),
+                    {'context': context, 'model': model_name, 'tier': tier},
+                )
+                result = dict(result, next_cursor=encode_cursor(token, len(top_indices)))
+            return result
         except Exception as e:
             return {'ok': False, 'error': str(e)}
 
 
+def handle_request(reco_system, payload, started=None):
+    """Run one recommendation payload (shared by the CLI and recommend_server.py)"""
+    user_id = payload.get('user_id')
+    limit = payload.get('limit', 10)
+    # 'auto' lets the per-segment bandit pick the model
+    model_name = payload.get('model', 'BMF')
+    context = payload.get('context', {})
+    # Optional: categories, brands, price_ranges, price_min, price_max, exclude_seen, exclude_purchased
+    filters = payload.get('filters') or None
+    # Rerank mode: order exactly these products instead of searching the catalog
+    product_ids = payload.get('product_ids')
+    # Sweep mode: ENCM top-k under each of these contexts
+    contexts = payload.get('contexts')
+
+    if not user_id:
+        return {'ok': False, 'error': 'user_id is required'}
+
+    # Later pages of an earlier response: slice its stored ranking
+    offset = 0
+    if payload.get('cursor'):
+        try:
+            token, offset = decode_cursor(str(payload['cursor']))
+        except ValueError as e:
+            return {'ok': False, 'error': str(e)}
+        page = reco_system.page_response(user_id, token, offset, limit)
+        if page is not None:
+            return page
+        # Ranking expired: recompute through this page and drop the items already served
+        limit = offset + limit
+
+    deadline = Deadline.from_payload(payload, started)
+
+    def compute():
+        # Coalesced followers never take a slot; only the leader goes through admission
+        if not reco_system.admission.acquire(deadline):
+            shed = reco_system.popular_response(limit, filters, product_ids)
+            if contexts is not None and shed['ok']:
+                # Popularity ignores context: the same list answers every context
+                items = shed.pop('items')
+                shed['results'] = [{'context': ctx, 'items': items} for ctx in contexts]
+            return shed
+        try:
+            if contexts is not None:
+                return reco_system.sweep_contexts(user_id, contexts, limit, filters)
+            chosen, segment = model_name, None
+            if model_name == AUTO_MODEL:
+                chosen, segment = reco_system.choose_model(user_id, context)
+            if product_ids is not None:
+                result = reco_system.rerank(user_id, chosen, product_ids, context, deadline, filters)
+            else:
+                result = reco_system.get_recommendations(user_id, chosen, limit, context, deadline, filters)
+                reco_system.shadow.submit(user_id, result, limit, context, filters)
+            # Lists from a fallback model or tier say nothing about the chosen arm
+            if segment is not None and result.get('ok') and result.get('model') == chosen:
+                reco_system.bandit.record_serve(user_id, segment, chosen, [item['productId'] for item in result['items']])
+            return result
+        finally:
+            reco_system.admission.release()
+
+    key = request_key(user_id, model_name, limit, context if contexts is None else {'contexts': contexts}, filters, product_ids)
+    result = reco_system.inflight.do(key, compute)
+    if offset and result.get('ok'):
+        result = dict(result, items=result['items'][offset:])
+    return result
+
+
 def main():
     """Main API handler"""
     try:
@@ -723,23 +1610,15 @@ def main():
             return
 
         payload = json.loads(input_data)
-
-        user_id = payload.get('user_id')
-        limit = payload.get('limit', 10)
-        model_name = payload.get('model', 'BMF')
-        context = payload.get('context', {})
-
-        if not user_id:
+        if not payload.get('user_id'):
             _original_print(json.dumps({'ok': False, 'error': 'user_id is required'}))
             return
 
-        # Initialize recommendation system (singleton pattern would be better in production)
+        # One-shot process; recommend_server.py keeps a single instance alive instead
         reco_system = TrainedRecommendationSystem()
 
-        # Get recommendations
-        result = reco_system.get_recommendations(user_id, model_name, limit, context)
-
-        _original_print(json.dumps(result))
+        # The caller's budget covers process start-up too
+        _original_print(json.dumps(handle_request(reco_system, payload, started=PROCESS_STARTED)))
 
     except Exception as e:
         _original_print(json.dumps({'ok': False, 'error': str(e)}))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Long-running recommendation service
+Keeps one TrainedRecommendationSystem in memory and answers the same JSON payload
+as recommend_api.py over HTTP, so concurrent requests share models, the catalog
+and batched DB lookups. Run from the repository root: python models/recommend_server.py
+"""
+
+import os
+
+from flask import Flask, request, jsonify
+
+from recommend_api import TrainedRecommendationSystem, handle_request, print, tf
+from autotune import ensure_tuned
+from shard_ring import RECO_SHARD_SELF
+from change_feed import ChangeFeed
+from file_lock import FileLock
+
+RECO_HOST = os.environ.get('RECO_HOST', '127.0.0.1')
+RECO_PORT = int(os.environ.get('RECO_PORT', 8010))
+# Benchmark this host at startup when it has no stored tuning (models/autotune.py)
+RECO_AUTOTUNE = os.environ.get('RECO_AUTOTUNE', '0') == '1'
+# Servers on one host share models/serving; the holder of this lock is the only one rewriting its files
+SERVING_WRITER_LOCK_PATH = 'models/serving/writer.lock'
+
+app = Flask(__name__)
+reco_system = None
+feed = None
+
+
+@app.route('/recommend', methods=['POST'])
+def recommend():
+    """Same payload and response as `recommend_api.py` on stdin/stdout"""
+    try:
+        payload = request.get_json(silent=True) or {}
+        return jsonify(handle_request(reco_system, payload))
+    except Exception as e:
+        return jsonify({'ok': False, 'error': str(e)})
+
+
+@app.route('/rerank', methods=['POST'])
+def rerank():
+    """Reorder the payload's `product_ids` for the user (same payload otherwise)"""
+    try:
+        payload = request.get_json(silent=True) or {}
+        if not isinstance(payload.get('product_ids'), list):
+            return jsonify({'ok': False, 'error': 'product_ids list is required'})
+        return jsonify(handle_request(reco_system, payload))
+    except Exception as e:
+        return jsonify({'ok': False, 'error': str(e)})
+
+
+@app.route('/sweep', methods=['POST'])
+def sweep():
+    """ENCM top-k for the payload's `contexts` list (one result per context)"""
+    try:
+        payload = request.get_json(silent=True) or {}
+        if not isinstance(payload.get('contexts'), list):
+            return jsonify({'ok': False, 'error': 'contexts list is required'})
+        return jsonify(handle_request(reco_system, payload))
+    except Exception as e:
+        return jsonify({'ok': False, 'error': str(e)})
+
+
+@app.route('/similar/<int:product_id>')
+def similar(product_id):
+    """Precomputed neighbours of a product (query: limit, model); no user, no scoring"""
+    try:
+        limit = int(request.args.get('limit', 10))
+        return jsonify(reco_system.similar_items(product_id, limit, request.args.get('model')))
+    except Exception as e:
+        return jsonify({'ok': False, 'error': str(e)})
+
+
+@app.route('/bought-together', methods=['POST'])
+def bought_together():
+    """Cross-sell for the payload's `product_ids` (a cart) from co-occurrence lists"""
+    try:
+        payload = request.get_json(silent=True) or {}
+        if not isinstance(payload.get('product_ids'), list):
+            return jsonify({'ok': False, 'error': 'product_ids list is required'})
+        return jsonify(reco_system.bought_together(payload['product_ids'], int(payload.get('limit', 10))))
+    except Exception as e:
+        return jsonify({'ok': False, 'error': str(e)})
+
+
+@app.route('/health')
+def health():
+    return jsonify({
+        'ok': True,
+        'models': list(reco_system.models.keys()),
+        'catalog_version': reco_system.catalog.version,
+        'shard': {'self': RECO_SHARD_SELF, 'users': reco_system.shard_users,
+                  'nodes': reco_system.shard.ring().nodes} if reco_system.shard is not None else None,
+    })
+
+
+@app.route('/metrics')
+def metrics():
+    return jsonify({
+        'lookups': reco_system.lookups.stats,
+        'inflight': reco_system.inflight.stats,
+        'admission': reco_system.admission.metrics(),
+        'online_bmf': reco_system.online_bmf.stats,
+        'sessions': len(reco_system.sessions),
+        'model_bandit': reco_system.bandit.snapshot(),
+        'shadow': reco_system.shadow.stats,
+        'topn': reco_system.topn.stats,
+        'context_buckets': dict(reco_system.context_buckets.stats, entries=len(reco_system.context_buckets)),
+        'change_feed': feed.stats if feed else None,
+        'co_occurrence': reco_system.co_occurrence.stats,
+    })
+
+
+if __name__ == '__main__':
+    if RECO_AUTOTUNE:
+        # Before the models load: TensorFlow's thread pools are fixed at first use
+        ensure_tuned(tf)
+    reco_system = TrainedRecommendationSystem()
+    # First fill before app.run: requests shed during a start-up spike are answered from it
+    reco_system.popular.start_refresher(reco_system._connect)
+    if 'BMF' in reco_system.tables:
+        # Every server learns online; only the host's writer checkpoints
+        reco_system.online_bmf.checkpoints = False
+        reco_system.online_bmf.start(reco_system._connect)
+
+    def start_writers():
+        reco_system.online_bmf.checkpoints = True
+        # Fold-in fits journaled by the servers and the CLI processes are merged into the snapshot
+        reco_system.fold_in_cache.start()
+        # New cart/purchase events extend the co-occurrence lists every minute; the others
+        # pick the rewritten lists up from the file
+        reco_system.co_occurrence.load()
+        reco_system.co_occurrence.start(reco_system._connect)
+        print(f"Writing shared serving files from this server (pid {os.getpid()})")
+
+    FileLock(SERVING_WRITER_LOCK_PATH).hold(start_writers)
+    reco_system.shadow.start()
+    # Lists served by this and the CLI processes are counted once their reward window closes
+    reco_system.bandit.start(reco_system._connect)
+    if reco_system.shard is not None:
+        # Nodes joining or leaving the membership move user rows between shards
+        reco_system.shard.start(reco_system.reshard)
+    if 'ENCM' in reco_system.tables:
+        # Peak requests find their ENCM answers ready for the time-of-day bucket they arrive in
+        reco_system.context_buckets.start(reco_system.materialize_bucket)
+    # New interactions from the Node API invalidate per-user caches within a poll interval
+    feed = ChangeFeed(reco_system.apply_interaction_event)
+    feed.start()
+    print(f"Recommendation service listening on {RECO_HOST}:{RECO_PORT}")
+    app.run(host=RECO_HOST, port=RECO_PORT, threaded=True)
@@ -0,0 +1,52 @@
+"""
+Recent recommendation results kept in memory
+Serves the `cached` tier when a request's budget is too small to score
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+RESULT_CACHE_TTL_SECONDS = 15 * 60
+RESULT_CACHE_MAX_ENTRIES = 10000
+
+
+class ResultCache:
+    """LRU of the last good response per (user, model), with a TTL"""
+
+    def __init__(self, ttl=RESULT_CACHE_TTL_SECONDS, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(user_id, model_name):
+        return (str(user_id), str(model_name))
+
+    def get(self, user_id, model_name):
+        key = self.key(user_id, model_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, result = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def put(self, user_id, model_name, result):
+        key = self.key(user_id, model_name)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        """Drop every model's result for a user (called on new interactions)"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == str(user_id)]:
+                del self._entries[key]
@@ -0,0 +1,51 @@
+"""
+In-session view history
+The last few products each active user viewed, fed by the change feed; scoring
+pulls candidates similar to the session's mean item embedding up the ranking
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+SESSION_MAX_VIEWS = 20
+SESSION_IDLE_SECONDS = 30 * 60
+SESSION_MAX_USERS = 50000
+# Max shift of a candidate's score, as a fraction of the request's score range
+SESSION_WEIGHT = 0.25
+
+
+class SessionStore:
+    """LRU of user -> last SESSION_MAX_VIEWS viewed product ids; a session ends after SESSION_IDLE_SECONDS"""
+
+    def __init__(self, max_views=SESSION_MAX_VIEWS, idle=SESSION_IDLE_SECONDS, max_users=SESSION_MAX_USERS):
+        self.max_views = max_views
+        self.idle = idle
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()   # user -> (last view at, deque of product ids)
+
+    def record_view(self, user_id, product_id):
+        key = str(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(key)
+            views = entry[1] if entry is not None and now - entry[0] <= self.idle else deque(maxlen=self.max_views)
+            views.append(int(product_id))
+            self._sessions[key] = (now, views)
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_users:
+                self._sessions.popitem(last=False)
+
+    def recent(self, user_id):
+        """Product ids viewed in the user's current session, oldest first (empty when none)"""
+        with self._lock:
+            entry = self._sessions.get(str(user_id))
+            if entry is None or time.monotonic() - entry[0] > self.idle:
+                return np.zeros(0, dtype=np.int64)
+            return np.fromiter(entry[1], dtype=np.int64, count=len(entry[1]))
+
+    def __len__(self):
+        return len(self._sessions)
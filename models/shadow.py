@@ -0,0 +1,132 @@
+"""
+Shadow scoring of challenger models
+Served requests are queued after the primary response is built; a background
+thread re-scores them with each challenger and appends both ranked lists to a
+binary log for offline comparison. Requests are sampled less as the queue
+fills and dropped when it is full, so shadow work never delays serving.
+"""
+
+import os
+import queue
+import random
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+SHADOW_MODELS = [m for m in os.environ.get('RECO_SHADOW_MODELS', '').split(',') if m.strip()]
+SHADOW_LOG_PATH = os.environ.get('RECO_SHADOW_LOG', 'models/serving/shadow.log')
+SHADOW_SAMPLE_RATE = float(os.environ.get('RECO_SHADOW_SAMPLE', 1.0))
+SHADOW_QUEUE_SIZE = 256
+SHADOW_ROTATE_BYTES = 64 * 1024 * 1024
+
+# Record: time, user, primary model, challenger model, primary length, challenger length,
+# then primary ids (int32), challenger ids (int32) and challenger scores (float16)
+_HEADER = struct.Struct('<dq16s16sHH')
+
+
+def encode_record(ts, user_id, primary_model, challenger_model, primary_ids, challenger_ids, challenger_scores):
+    primary_ids = np.asarray(primary_ids, dtype='<i4')
+    challenger_ids = np.asarray(challenger_ids, dtype='<i4')
+    header = _HEADER.pack(ts, int(user_id), primary_model.encode('ascii')[:16], challenger_model.encode('ascii')[:16],
+                          len(primary_ids), len(challenger_ids))
+    return header + primary_ids.tobytes() + challenger_ids.tobytes() + np.asarray(challenger_scores, dtype='<f2').tobytes()
+
+
+def read_shadow_log(path=SHADOW_LOG_PATH):
+    """Yield dict records from a shadow log (for offline comparison)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        ts, user_id, primary, challenger, n_primary, n_challenger = _HEADER.unpack_from(data, offset)
+        offset += _HEADER.size
+        end = offset + 4 * n_primary + 6 * n_challenger
+        if end > len(data):
+            break   # torn tail from a crash mid-write
+        primary_ids = np.frombuffer(data, '<i4', n_primary, offset)
+        challenger_ids = np.frombuffer(data, '<i4', n_challenger, offset + 4 * n_primary)
+        scores = np.frombuffer(data, '<f2', n_challenger, offset + 4 * (n_primary + n_challenger))
+        offset = end
+        yield {
+            'ts': ts, 'user_id': user_id,
+            'primary_model': primary.rstrip(b'\0').decode('ascii'),
+            'challenger_model': challenger.rstrip(b'\0').decode('ascii'),
+            'primary_ids': primary_ids, 'challenger_ids': challenger_ids, 'challenger_scores': scores,
+        }
+
+
+class ShadowScorer:
+    """`score(user_id, model, limit, context, filters)` -> response dict, run off the request path"""
+
+    def __init__(self, score, challengers=SHADOW_MODELS, path=SHADOW_LOG_PATH, sample_rate=SHADOW_SAMPLE_RATE,
+                 max_queue=SHADOW_QUEUE_SIZE):
+        self.score = score
+        self.challengers = list(challengers)
+        self.path = path
+        self.sample_rate = sample_rate
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._started = False
+        self.stats = {'queued': 0, 'sampled_out': 0, 'dropped': 0, 'scored': 0, 'skipped': 0, 'errors': 0}
+
+    def submit(self, user_id, primary, limit, context, filters):
+        """Queue a served response for shadow scoring; never blocks"""
+        if not self._started or not primary.get('ok'):
+            return False
+        # Sample less as the queue fills, so a backlog drains instead of growing
+        backlog = self._queue.qsize() / self._queue.maxsize
+        if random.random() >= self.sample_rate * (1.0 - backlog):
+            self.stats['sampled_out'] += 1
+            return False
+        job = (time.time(), user_id, primary.get('model'), [item['productId'] for item in primary['items']],
+               limit, context, filters)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+        self.stats['queued'] += 1
+        return True
+
+    def _run(self, job):
+        ts, user_id, primary_model, primary_ids, limit, context, filters = job
+        records = []
+        for challenger in self.challengers:
+            if challenger == primary_model:
+                continue
+            result = self.score(user_id, challenger, limit, context, filters)
+            # A challenger that is not loaded falls back to another model; that is no comparison
+            if not result.get('ok') or result.get('model') != challenger:
+                self.stats['skipped'] += 1
+                continue
+            items = result['items']
+            records.append(encode_record(ts, user_id, primary_model or '', challenger,
+                                         primary_ids, [item['productId'] for item in items],
+                                         [item['score'] or 0.0 for item in items]))
+        if records:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > SHADOW_ROTATE_BYTES:
+                os.replace(self.path, self.path + '.1')
+            with open(self.path, 'ab') as f:
+                f.write(b''.join(records))
+            self.stats['scored'] += len(records)
+
+    def start(self):
+        if not self.challengers:
+            return None
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+        def loop():
+            while True:
+                job = self._queue.get()
+                try:
+                    self._run(job)
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    print(f"Warning: shadow scoring failed: {e}", file=sys.stderr)
+
+        thread = threading.Thread(target=loop, name='shadow-scorer', daemon=True)
+        thread.start()
+        self._started = True
+        return thread
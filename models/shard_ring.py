@@ -0,0 +1,119 @@
+"""
+Consistent-hash placement of users on serving nodes
+Each node URL owns SHARD_VNODES points on a 64-bit ring; a user belongs to the
+first node point at or after the hash of its id, so a join or leave only moves
+the users on the arcs that changed. Membership is a JSON list of node URLs
+(SHARD_NODES_PATH), re-read by every node and router when the file changes;
+RECO_SHARD_NODES fixes the list instead.
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+# This node's URL as listed in the membership; empty means one node serves every user
+RECO_SHARD_SELF = os.environ.get('RECO_SHARD_SELF', '').rstrip('/')
+SHARD_NODES_PATH = os.environ.get('RECO_SHARD_NODES_FILE', 'models/serving/shard_nodes.json')
+SHARD_FIXED_NODES = [n.strip().rstrip('/') for n in os.environ.get('RECO_SHARD_NODES', '').split(',') if n.strip()]
+SHARD_VNODES = 160
+SHARD_CHECK_SECONDS = 5
+# Full user tables, memory-mapped by every node; only owned rows are copied into RAM
+SHARD_TABLES_DIR = 'models/serving/user_tables'
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    def __init__(self, nodes=(), vnodes=SHARD_VNODES):
+        self.nodes = sorted(set(nodes))
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._keys = [p[0] for p in points]
+        self._owners = [p[1] for p in points]
+
+    def node_for(self, user_id, exclude=()):
+        """Owning node of a user; with `exclude`, the next node clockwise that is not excluded"""
+        if not self._keys:
+            return None
+        start = bisect.bisect_left(self._keys, _hash(int(user_id)))
+        for step in range(len(self._keys)):
+            node = self._owners[(start + step) % len(self._keys)]
+            if node not in exclude:
+                return node
+        return None
+
+    def owned_mask(self, node, user_ids):
+        """Boolean mask of the user ids this node owns"""
+        return np.array([self.node_for(u) == node for u in user_ids], dtype=bool)
+
+
+class Membership:
+    """Current HashRing, rebuilt when the membership file changes"""
+
+    def __init__(self, path=SHARD_NODES_PATH, fixed_nodes=SHARD_FIXED_NODES):
+        self.path = path
+        self.fixed_nodes = list(fixed_nodes)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._ring = HashRing(self.fixed_nodes)
+        self.version = 0
+
+    def ring(self):
+        if self.fixed_nodes or time.monotonic() - self._checked_at < SHARD_CHECK_SECONDS:
+            return self._ring
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                mtime = None
+            if mtime != self._mtime:
+                nodes = self.read() if mtime is not None else []
+                if nodes != self._ring.nodes:
+                    self._ring = HashRing(nodes)
+                    self.version += 1
+                self._mtime = mtime
+            return self._ring
+
+    def read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return sorted({str(n).rstrip('/') for n in json.load(f)})
+        except Exception as e:
+            print(f"Warning: unreadable shard membership {self.path}: {e}", file=sys.stderr)
+            return self._ring.nodes
+
+    def write(self, nodes):
+        """Replace the node list (join/leave); watchers pick it up within SHARD_CHECK_SECONDS"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(sorted({n.rstrip('/') for n in nodes}), f, indent=2)
+        os.replace(tmp_path, self.path)
+        self._checked_at = 0.0
+
+    def start(self, on_change, interval=SHARD_CHECK_SECONDS):
+        """Call `on_change(ring)` on a daemon thread whenever the membership changes"""
+        def loop():
+            seen = self.version
+            while True:
+                time.sleep(interval)
+                try:
+                    ring = self.ring()
+                    if self.version != seen:
+                        seen = self.version
+                        on_change(ring)
+                except Exception as e:
+                    print(f"Warning: shard rebalance failed: {e}", file=sys.stderr)
+
+        thread = threading.Thread(target=loop, name='shard-membership', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Router for user-sharded serving
+Sends each request to the node that owns its user on the consistent-hash ring
+(shard_ring.py); item-only requests (/similar, /bought-together) may go to any
+node, since item tables are replicated. A node that does not answer is skipped
+for SHARD_DOWN_SECONDS and its users go to the next node on the ring, which
+serves them as unknown users (folded in) until membership is updated.
+
+Use ShardRouter from Python, or run the HTTP router and point the Node API's
+RECO_SERVICE_URL at it. From the repository root:
+    python models/shard_router.py                 serve on RECO_PORT
+    python models/shard_router.py join <url>      add a node to the membership
+    python models/shard_router.py leave <url>     remove one
+    python models/shard_router.py nodes           list them
+"""
+
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from shard_ring import Membership
+
+SHARD_TIMEOUT_SECONDS = float(os.environ.get('RECO_SHARD_TIMEOUT_MS', 30000)) / 1000.0
+SHARD_DOWN_SECONDS = 10
+
+
+class ShardRouter:
+    def __init__(self, membership=None, timeout=SHARD_TIMEOUT_SECONDS):
+        self.membership = membership or Membership()
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._down = {}   # node -> skipped until (monotonic)
+        self._any = itertools.count()
+        self.stats = {'routed': 0, 'failovers': 0, 'unavailable': 0}
+
+    def _down_nodes(self):
+        now = time.monotonic()
+        with self._lock:
+            self._down = {node: until for node, until in self._down.items() if until > now}
+            return set(self._down)
+
+    def _mark_down(self, node):
+        with self._lock:
+            self._down[node] = time.monotonic() + SHARD_DOWN_SECONDS
+
+    def _call(self, node, path, payload=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(node + path, data=data, headers={'Content-Type': 'application/json'},
+                                     method='POST' if data is not None else 'GET')
+        with urllib.request.urlopen(req, timeout=self.timeout) as res:
+            return json.loads(res.read().decode('utf-8'))
+
+    def _send(self, pick, path, payload=None):
+        """Try nodes from `pick(excluded)` until one answers"""
+        excluded = self._down_nodes()
+        failed_over = False
+        while True:
+            node = pick(excluded)
+            if node is None:
+                self.stats['unavailable'] += 1
+                return {'ok': False, 'error': 'No shard available'}
+            try:
+                result = self._call(node, path, payload)
+                self.stats['routed'] += 1
+                self.stats['failovers'] += failed_over
+                return result
+            except (urllib.error.URLError, OSError) as e:
+                print(f"Warning: shard {node} failed: {e}", file=sys.stderr)
+                self._mark_down(node)
+                excluded = excluded | {node}
+                failed_over = True
+
+    def node_for(self, user_id):
+        return self.membership.ring().node_for(user_id, self._down_nodes())
+
+    def request(self, payload, path='/recommend'):
+        """Same payload and response as recommend_server.py, answered by the user's shard"""
+        if not payload.get('user_id'):
+            return {'ok': False, 'error': 'user_id is required'}
+        user_id = int(payload['user_id'])
+        return self._send(lambda excluded: self.membership.ring().node_for(user_id, excluded), path, payload)
+
+    def any_node(self, path, payload=None):
+        """Item-only requests: rotate over the live nodes"""
+        def pick(excluded):
+            nodes = [n for n in self.membership.ring().nodes if n not in excluded]
+            return nodes[next(self._any) % len(nodes)] if nodes else None
+        return self._send(pick, path, payload)
+
+
+def serve():
+    from flask import Flask, request, jsonify
+
+    host = os.environ.get('RECO_HOST', '127.0.0.1')
+    port = int(os.environ.get('RECO_PORT', 8010))
+    router = ShardRouter()
+    app = Flask(__name__)
+
+    def user_route(path):
+        def view():
+            try:
+                return jsonify(router.request(request.get_json(silent=True) or {}, path))
+            except Exception as e:
+                return jsonify({'ok': False, 'error': str(e)})
+        return view
+
+    for path in ('/recommend', '/rerank', '/sweep'):
+        app.add_url_rule(path, path.strip('/'), user_route(path), methods=['POST'])
+
+    @app.route('/similar/<int:product_id>')
+    def similar(product_id):
+        try:
+            query = request.query_string.decode('utf-8')
+            return jsonify(router.any_node(f'/similar/{product_id}' + (f'?{query}' if query else '')))
+        except Exception as e:
+            return jsonify({'ok': False, 'error': str(e)})
+
+    @app.route('/bought-together', methods=['POST'])
+    def bought_together():
+        try:
+            return jsonify(router.any_node('/bought-together', request.get_json(silent=True) or {}))
+        except Exception as e:
+            return jsonify({'ok': False, 'error': str(e)})
+
+    @app.route('/health')
+    def health():
+        return jsonify({'ok': True, 'nodes': router.membership.ring().nodes, 'down': sorted(router._down_nodes())})
+
+    @app.route('/metrics')
+    def metrics():
+        return jsonify(dict(router.stats, nodes=router.membership.ring().nodes))
+
+    print(f"Shard router listening on {host}:{port}", file=sys.stderr)
+    app.run(host=host, port=port, threaded=True)
+
+
+def main():
+    args = sys.argv[1:]
+    if not args:
+        serve()
+        return
+    membership = Membership()
+    nodes = membership.read() if os.path.exists(membership.path) else []
+    if args[0] == 'join' and len(args) == 2:
+        membership.write(nodes + [args[1]])
+    elif args[0] == 'leave' and len(args) == 2:
+        membership.write([n for n in nodes if n != args[1].rstrip('/')])
+    elif args[0] != 'nodes':
+        print(__doc__)
+        sys.exit(1)
+    print('\n'.join(membership.read() if os.path.exists(membership.path) else []))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Single-flight coalescing of identical in-flight requests
+The first caller for a key computes the result; callers arriving while it runs
+wait on the same future and receive the same result
+"""
+
+import json
+import threading
+from concurrent.futures import Future
+
+
+def request_key(user_id, model_name, limit, context, filters=None, product_ids=None):
+    """Identity of a recommendation request (context, filters and rerank list compared by value)"""
+    return (str(user_id), str(model_name), int(limit), json.dumps(context or {}, sort_keys=True, default=str),
+            json.dumps(filters or {}, sort_keys=True, default=str),
+            None if product_ids is None else tuple(str(p) for p in product_ids))
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.stats = {'leaders': 0, 'coalesced': 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                self.stats['leaders'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Storage backends for the tables the recommender reads
+(users, allcodes, products, productdetails, interactions)
+MySQL is production. SQLite holds the same tables in a file or in memory, so the
+service can be run, tested and benchmarked on one machine without a database
+server. Queries are written once; the few dialect-specific expressions (hour,
+weekday, "N days ago", unix time) come from the active backend, STORAGE, picked
+by RECO_STORAGE:
+    mysql (default) | sqlite:<path> | memory (in-memory, filled from the CSVs)
+
+Fill a SQLite file from the training extract, from the repository root:
+    python models/storage.py <db path> [csv dir] [--now]
+"""
+
+import glob
+import itertools
+import os
+import pickle
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+# Database configuration
+DB_CONFIG = {
+    'host': '127.0.0.1',
+    'user': 'root',
+    'password': '',
+    'database': 'ecom'
+}
+# Interaction timestamps are stored in shop-local time
+DB_TIME_ZONE = '+07:00'
+RECO_STORAGE = os.environ.get('RECO_STORAGE', 'mysql')
+CSV_DIR = 'EcomModelTrain/training_data'
+
+_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Names of in-memory databases; id() may repeat while a connection keeps an old one alive
+_memory_names = itertools.count()
+
+# The columns the recommender reads, with the ecom schema's names
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY, email TEXT, firstName TEXT, lastName TEXT,
+        genderId TEXT, roleId TEXT, statusId TEXT
+    );
+    CREATE TABLE IF NOT EXISTS allcodes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT, value TEXT, code TEXT
+    );
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY, name TEXT, statusId TEXT, categoryId TEXT, brandId TEXT,
+        view INTEGER DEFAULT 0, createdAt TIMESTAMP, updatedAt TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS productdetails (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, productId INTEGER, nameDetail TEXT,
+        originalPrice INTEGER, discountPrice INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS interactions (
+        interId INTEGER PRIMARY KEY AUTOINCREMENT, userId INTEGER NOT NULL, productId INTEGER NOT NULL,
+        actionCode TEXT, device_type TEXT, timestamp TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS interactions_user ON interactions (userId, timestamp);
+    CREATE INDEX IF NOT EXISTS interactions_product ON interactions (productId);
+    CREATE INDEX IF NOT EXISTS interactions_time ON interactions (timestamp);
+    CREATE INDEX IF NOT EXISTS productdetails_product ON productdetails (productId);
+    CREATE INDEX IF NOT EXISTS products_updated ON products (updatedAt);
+"""
+
+# TIMESTAMP columns come back as datetime, as from MySQL
+sqlite3.register_adapter(datetime, lambda value: value.strftime(_TIMESTAMP_FORMAT))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+
+
+def _utc_offset():
+    sign = -1 if DB_TIME_ZONE[0] == '-' else 1
+    hours, minutes = DB_TIME_ZONE[1:].split(':')
+    return sign * timedelta(hours=int(hours), minutes=int(minutes))
+
+
+class MySQLStorage:
+    name = 'mysql'
+
+    def __init__(self, config=DB_CONFIG):
+        self.config = config
+
+    def connect(self):
+        """Open a MySQL connection with the session settings used by every query"""
+        import mysql.connector
+
+        conn = mysql.connector.connect(**self.config)
+        # Long-lived connections must not keep reading one REPEATABLE READ snapshot
+        conn.autocommit = True
+        try:
+            cur = conn.cursor()
+            cur.execute(f"SET time_zone = '{DB_TIME_ZONE}'")
+            cur.close()
+        except Exception as tz_e:
+            print(f"Warning: could not set session time_zone: {tz_e}", file=sys.stderr)
+        return conn
+
+    @staticmethod
+    def hour(column):
+        return f"HOUR({column})"
+
+    @staticmethod
+    def weekday(column):
+        """0 = Monday"""
+        return f"WEEKDAY({column})"
+
+    @staticmethod
+    def days_ago(days):
+        return f"DATE_SUB(NOW(), INTERVAL {int(days)} DAY)"
+
+    @staticmethod
+    def unix_time(column):
+        return f"UNIX_TIMESTAMP({column})"
+
+
+class _SQLiteCursor(sqlite3.Cursor):
+    """Accepts the %s placeholders the queries are written with"""
+
+    def execute(self, sql, parameters=()):
+        return super().execute(sql.replace('%s', '?'), parameters)
+
+
+class _SQLiteConnection(sqlite3.Connection):
+    def cursor(self, factory=_SQLiteCursor):
+        return super().cursor(factory)
+
+
+class SQLiteStorage:
+    """Same tables in a SQLite file, or in memory (path None) shared by every connection of the process"""
+    name = 'sqlite'
+
+    def __init__(self, path=None):
+        if path:
+            self.uri = f"file:{os.path.abspath(path)}"
+        else:
+            self.uri = f"file:reco_{os.getpid()}_{next(_memory_names)}?mode=memory&cache=shared"
+        # An in-memory database lives while one connection is open
+        self._anchor = self.connect()
+        self._anchor.executescript(SQLITE_SCHEMA)
+
+    def connect(self):
+        # Connections stay on the thread that opened them, as with MySQL here
+        return sqlite3.connect(self.uri, uri=True, factory=_SQLiteConnection, isolation_level=None,
+                               detect_types=sqlite3.PARSE_DECLTYPES, timeout=30)
+
+    @staticmethod
+    def hour(column):
+        return f"CAST(strftime('%H', {column}) AS INTEGER)"
+
+    @staticmethod
+    def weekday(column):
+        """0 = Monday (strftime's %w counts from Sunday)"""
+        return f"((CAST(strftime('%w', {column}) AS INTEGER) + 6) % 7)"
+
+    @staticmethod
+    def days_ago(days):
+        return f"datetime('now', '{DB_TIME_ZONE}', '-{int(days)} days')"
+
+    @staticmethod
+    def unix_time(column):
+        # From the julian day: strftime's %s would read as a placeholder
+        offset = ('-' if DB_TIME_ZONE[0] == '+' else '+') + DB_TIME_ZONE[1:]
+        return f"CAST(ROUND((julianday({column}, '{offset}') - 2440587.5) * 86400) AS INTEGER)"
+
+
+def load_csv(storage, directory=CSV_DIR, now=False):
+    """Fill users, products and interactions from the training extract's CSVs (`now`: shift
+    timestamps so the newest interaction is the current time and time windows see the data).
+    The extract has no prices, so productdetails stays empty."""
+    frames = [pd.read_csv(path) for path in sorted(glob.glob(os.path.join(directory, '*.csv')))]
+    if not frames:
+        raise FileNotFoundError(f"no CSV files in {directory}")
+    df = pd.concat(frames, ignore_index=True)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df = df.sort_values('timestamp', kind='stable')
+    if now:
+        local_now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0) + _utc_offset()
+        df['timestamp'] += local_now - df['timestamp'].max()
+
+    # Category and brand ids back from the codes the extract stored
+    with open(os.path.join(directory, 'context_encoders.pkl'), 'rb') as f:
+        context_encoders = pickle.load(f)
+    categories = context_encoders['category'].classes_
+    brands = context_encoders['brand'].classes_
+    genders = {0: 'M', 1: 'FE', 2: 'O'}
+    loaded_at = datetime.now().replace(microsecond=0)
+
+    products = df.drop_duplicates('productId')
+    users = df.drop_duplicates('userId')
+    conn = storage.connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN")
+        cur.executemany("INSERT OR REPLACE INTO products (id, name, statusId, categoryId, brandId, createdAt, updatedAt) "
+                        "VALUES (?, ?, 'S1', ?, ?, ?, ?)",
+                        [(int(r.productId), f"Product {int(r.productId)}", str(categories[int(r.category_encoded)]),
+                          str(brands[int(r.brand_encoded)]), loaded_at, loaded_at)
+                         for r in products.itertuples()])
+        cur.executemany("INSERT OR REPLACE INTO users (id, genderId, roleId, statusId) VALUES (?, ?, 'R2', 'S1')",
+                        [(int(r.userId), genders.get(int(r.gender_encoded))) for r in users.itertuples()])
+        cur.execute("DELETE FROM allcodes WHERE type = 'ROLE'")
+        cur.executemany("INSERT INTO allcodes (type, value, code) VALUES ('ROLE', ?, ?)",
+                        [('admin', 'R1'), ('user', 'R2')])
+        cur.executemany("INSERT INTO interactions (userId, productId, actionCode, device_type, timestamp) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [(int(r.userId), int(r.productId), r.actionCode,
+                          r.device_type if isinstance(r.device_type, str) else None, r.timestamp.to_pydatetime())
+                         for r in df.itertuples()])
+        cur.execute("COMMIT")
+        cur.close()
+    finally:
+        conn.close()
+    return {'users': len(users), 'products': len(products), 'interactions': len(df)}
+
+
+def make_storage(spec=RECO_STORAGE):
+    if spec == 'mysql':
+        return MySQLStorage()
+    if spec.startswith('sqlite:'):
+        return SQLiteStorage(spec[len('sqlite:'):])
+    if spec == 'memory':
+        storage = SQLiteStorage()
+        load_csv(storage, now=True)
+        return storage
+    raise ValueError(f"Unknown RECO_STORAGE: {spec}")
+
+
+STORAGE = make_storage()
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+    started = time.time()
+    counts = load_csv(SQLiteStorage(args[0]), args[1] if len(args) > 1 else CSV_DIR, now='--now' in sys.argv[1:])
+    print(f"{args[0]}: {counts} ({time.time() - started:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
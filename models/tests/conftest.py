@@ -0,0 +1,37 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The service modules import each other by bare name, as when run from models/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_tables import EmbeddingTables  # noqa: E402
+
+
+@pytest.fixture
+def bmf_tables():
+    """Small random BMF tables: 20 users, 30 items, 4 factors"""
+    rng = np.random.default_rng(0)
+    return EmbeddingTables('BMF', rng.normal(size=(20, 4)).astype(np.float32),
+                           rng.normal(size=(30, 4)).astype(np.float32),
+                           user_bias=rng.normal(size=20).astype(np.float32),
+                           item_bias=rng.normal(size=30).astype(np.float32), global_bias=0.1, output_sigmoid=True)
+
+
+@pytest.fixture
+def encm_tables():
+    """Small random ENCM tables: 20 users, 30 items, 10 context columns of 12 codes, one hidden layer
+    and a linear output like training_model_classes.ENCM"""
+    rng = np.random.default_rng(1)
+    dim, width, hidden = 4, 2, 8
+    dense = [
+        (rng.normal(size=(2 * dim + 10 * width, hidden)).astype(np.float32),
+         rng.normal(size=hidden).astype(np.float32), 'relu'),
+        (rng.normal(size=(hidden, 1)).astype(np.float32), rng.normal(size=1).astype(np.float32), 'linear'),
+    ]
+    return EmbeddingTables('ENCM', rng.normal(size=(20, dim)).astype(np.float32),
+                           rng.normal(size=(30, dim)).astype(np.float32),
+                           context_tables=[rng.normal(size=(12, width)).astype(np.float32) for _ in range(10)],
+                           dense=dense)
@@ -0,0 +1,45 @@
+import threading
+import time
+
+from admission import AdmissionController
+from deadline import Deadline
+
+
+def test_slots_are_bounded_and_released():
+    admission = AdmissionController(max_concurrent=2, max_queue=0, max_wait=0.01)
+    assert admission.acquire() and admission.acquire()
+    assert not admission.acquire()
+    admission.release()
+    assert admission.acquire()
+    metrics = admission.metrics()
+    assert metrics['running'] == 2 and metrics['shed_queue_full'] == 1 and metrics['admitted'] == 3
+
+
+def test_queued_request_is_shed_after_max_wait():
+    admission = AdmissionController(max_concurrent=1, max_queue=4, max_wait=0.05)
+    assert admission.acquire()
+    started = time.monotonic()
+    assert not admission.acquire()
+    assert time.monotonic() - started >= 0.05
+    assert admission.stats['shed_wait'] == 1 and admission.waiting == 0
+
+
+def test_queued_request_gives_up_at_its_deadline():
+    admission = AdmissionController(max_concurrent=1, max_queue=4, max_wait=10)
+    assert admission.acquire()
+    started = time.monotonic()
+    assert not admission.acquire(Deadline(30))
+    assert time.monotonic() - started < 5
+
+
+def test_queued_request_takes_the_released_slot():
+    admission = AdmissionController(max_concurrent=1, max_queue=4, max_wait=5)
+    assert admission.acquire()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(admission.acquire()))
+    waiter.start()
+    while admission.waiting == 0:
+        time.sleep(0.001)
+    admission.release()
+    waiter.join()
+    assert got == [True] and admission.running == 1 and admission.metrics()['shed_rate'] == 0.0
@@ -0,0 +1,57 @@
+import json
+import subprocess
+
+import autotune
+from autotune import DEFAULTS, host_key, load_tuning, run_autotune
+
+
+def fake_run(timings):
+    """subprocess.run stand-in answering each --measure child from its thread pair"""
+    def run(args, env, **kwargs):
+        pair = (int(env['RECO_INTRA_OP_THREADS']), int(env['RECO_INTER_OP_THREADS']))
+        return subprocess.CompletedProcess(args, 0, stdout='warming up\n' + json.dumps(timings(pair)) + '\n')
+    return run
+
+
+def test_stored_entry_then_env_overrides(tmp_path, monkeypatch):
+    path = tmp_path / 'autotune.json'
+    path.write_text(json.dumps({host_key(): {'predict_batch_size': 512, 'intra_op_threads': 4},
+                                'other|host|1': {'chunk_elements': 1}}))
+    monkeypatch.setenv('RECO_INTRA_OP_THREADS', '2')
+    config = load_tuning(str(path))
+    assert config == dict(DEFAULTS, predict_batch_size=512, intra_op_threads=2)
+
+
+def test_missing_or_unreadable_files_give_the_defaults(tmp_path, monkeypatch):
+    for env in autotune._OVERRIDES.values():
+        monkeypatch.delenv(env, raising=False)
+    assert load_tuning(str(tmp_path / 'absent.json')) == DEFAULTS
+    (tmp_path / 'broken.json').write_text('{')
+    assert load_tuning(str(tmp_path / 'broken.json')) == DEFAULTS
+
+
+def test_autotune_stores_the_fastest_setting(tmp_path, monkeypatch):
+    def timings(pair):
+        slow = 1.0 if pair == (2, 1) else 3.0
+        return {'predict': {'ENCM': {str(b): slow + abs(b - 512) / 1e4 for b in autotune.BATCH_SIZES}},
+                'grid': {str(1 << 20): 0.5, str(1 << 22): 0.2}, 'neighbours': {}}
+    monkeypatch.setattr(autotune, '_thread_pairs', lambda: [(0, 0), (2, 1), (4, 2)])
+    monkeypatch.setattr(autotune.subprocess, 'run', fake_run(timings))
+    path = str(tmp_path / 'autotune.json')
+    config = run_autotune(path)
+    assert config == dict(DEFAULTS, intra_op_threads=2, inter_op_threads=1, predict_batch_size=512,
+                          chunk_elements=1 << 22)
+    stored = json.load(open(path))[host_key()]
+    assert stored['models'] == ['ENCM'] and stored['intra_op_threads'] == 2
+
+
+def test_failed_children_are_skipped(tmp_path, monkeypatch):
+    def timings(pair):
+        if pair == (0, 0):
+            raise RuntimeError('child crashed')
+        return {'predict': {}, 'grid': {}, 'neighbours': {}}
+    monkeypatch.setattr(autotune, '_thread_pairs', lambda: [(0, 0), (1, 1)])
+    monkeypatch.setattr(autotune.subprocess, 'run', fake_run(timings))
+    assert run_autotune(str(tmp_path / 'autotune.json')) == dict(DEFAULTS, intra_op_threads=1, inter_op_threads=1)
+    monkeypatch.setattr(autotune, '_thread_pairs', lambda: [(0, 0)])
+    assert run_autotune(str(tmp_path / 'other.json')) is None
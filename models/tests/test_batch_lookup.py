@@ -0,0 +1,69 @@
+import re
+import threading
+
+import pytest
+
+from batch_lookup import BatchLookup
+
+
+class UsersDB:
+    """users table answering the gender lookup; counts queries and connections"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.queries = []
+        self.connections = 0
+
+    def connect(self):
+        self.connections += 1
+        return self
+
+    def cursor(self):
+        return self
+
+    def close(self):
+        pass
+
+    def execute(self, sql):
+        if self.fail:
+            raise ConnectionError('lost connection')
+        ids = [int(x) for x in re.search(r'IN \(([^)]*)\)', sql).group(1).split(',')]
+        self.queries.append(ids)
+        self.description = [('user_id',), ('genderId',)]
+        self._rows = [(u, 'M' if u % 2 else 'FE') for u in ids if u < 100]
+
+    def fetchall(self):
+        return self._rows
+
+
+def test_concurrent_lookups_share_one_query():
+    db = UsersDB()
+    lookups = BatchLookup(db.connect, window=0.05)
+    futures = [lookups.load_async('gender', u) for u in (1, 2, 3, 2, 500)]
+    results = [f.result(timeout=5) for f in futures]
+    assert results == [[{'genderId': 'M'}], [{'genderId': 'FE'}], [{'genderId': 'M'}], [{'genderId': 'FE'}], []]
+    assert len(db.queries) == 1 and sorted(db.queries[0]) == [1, 2, 3, 500]
+
+
+def test_lookups_from_threads_are_batched():
+    db = UsersDB()
+    lookups = BatchLookup(db.connect, window=0.05)
+    results = {}
+    threads = [threading.Thread(target=lambda u=u: results.__setitem__(u, lookups.load('gender', u)))
+               for u in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(results[u] == [{'genderId': 'M' if u % 2 else 'FE'}] for u in range(20))
+    assert len(db.queries) < 20
+
+
+def test_failed_batch_fails_its_callers_and_reconnects():
+    db = UsersDB(fail=True)
+    lookups = BatchLookup(db.connect, window=0.001)
+    with pytest.raises(ConnectionError):
+        lookups.load('gender', 1, timeout=5)
+    db.fail = False
+    assert lookups.load('gender', 1, timeout=5) == [{'genderId': 'M'}]
+    assert db.connections == 2
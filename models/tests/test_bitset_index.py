@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import numpy as np
+
+from bitset_index import CatalogBitsets, UserBitsets, pack, unpack
+from catalog_cache import CatalogSnapshot
+
+
+def catalog():
+    rows = [(pid, f'P{pid}', 'giay' if pid % 2 else 'balo', ('nike', 'prada', 'chanel')[pid % 3],
+             'S2' if pid == 6 else 'S1', datetime(2025, 1, 1)) for pid in range(1, 11)]
+    return CatalogSnapshot.from_rows(rows, version=3)
+
+
+def built():
+    snapshot = catalog()
+    prices = np.array([150000.0, 250000.0, np.nan, 1500000.0, 5000000.0, 100.0, 999999.0, 200000.0, 0.0, 3000000.0])
+    bitsets = CatalogBitsets()
+    bitsets.build(snapshot, prices)
+    return snapshot, bitsets
+
+
+def brute_force(snapshot, prices, keep):
+    return [pos for pos in range(len(snapshot)) if snapshot.active[pos] and keep(pos, prices[pos])]
+
+
+def test_pack_round_trips_any_length():
+    mask = np.random.default_rng(0).random(37) < 0.4
+    assert np.array_equal(unpack(pack(mask), 37), mask)
+
+
+def test_filters_match_a_brute_force_scan():
+    snapshot, bitsets = built()
+    prices = bitsets.prices
+    got = bitsets.positions({'categories': ['giay'], 'brands': ['nike', 'chanel']})
+    want = brute_force(snapshot, prices, lambda pos, _: snapshot.category_id(pos) == 'giay'
+                       and snapshot.brand_id(pos) in ('nike', 'chanel'))
+    assert list(got) == want
+    got = bitsets.positions({'price_ranges': ['mid', 'premium'], 'price_max': 4000000})
+    want = brute_force(snapshot, prices, lambda pos, p: (200000 <= p < 1000000 or p >= 3000000) and p <= 4000000)
+    assert list(got) == want
+    assert list(bitsets.positions({'brands': ['unknown-brand']})) == []
+    assert list(bitsets.positions()) == list(snapshot.active_positions())
+
+
+def test_exclude_bitset_removes_positions():
+    snapshot, bitsets = built()
+    seen = np.zeros(len(snapshot), dtype=bool)
+    seen[[0, 3]] = True
+    got = bitsets.positions({'categories': ['giay', 'balo']}, exclude=pack(seen))
+    assert 0 not in got and 3 not in got and len(got) == len(snapshot.active_positions()) - 2
+
+
+def test_user_bitsets_are_per_catalog_version():
+    users = UserBitsets()
+    users.put(7, 3, 'seen', 'purchased')
+    assert users.get('7', 3) == ('seen', 'purchased')
+    assert users.get(7, 4) is None
+    users.invalidate_user(7)
+    assert users.get(7, 3) is None
@@ -0,0 +1,80 @@
+import numpy as np
+
+from bulk_topn import TopNStore, build_store, encm_calibrated, top_n
+from context_buckets import bucket_of
+
+
+class Reversed:
+    """Calibration stand-in that turns every ranking upside down"""
+
+    def apply(self, scores, start):
+        return -scores
+
+
+def test_top_n_matches_a_full_sort():
+    scores = np.random.default_rng(3).normal(size=(6, 40))
+    top, top_scores = top_n(scores, 5)
+    assert (top == np.argsort(-scores, axis=1)[:, :5]).all()
+    assert np.allclose(top_scores, -np.sort(-scores, axis=1)[:, :5])
+    assert top_n(scores[:, :3], 5)[0].shape == (6, 3)
+
+
+def test_encm_calibration():
+    scores = np.array([0.5, 0.5, 0.5])
+    priors = np.array([0.2, 0.5, 0.5])
+    preferred = np.array([True, True, False])
+    assert np.allclose(encm_calibrated(scores, priors, preferred), [0.53, 0.645, 0.575])
+
+
+def bmf_store(tables, directory, **kwargs):
+    user_ids = np.array([3, 7, 11, 15])
+    product_ids = np.arange(100, 130)
+    build_store('BMF', tables, user_ids, tables.user_vectors[user_ids], tables.user_bias[user_ids], product_ids,
+                np.arange(30), n=5, directory=str(directory), workers=1, **kwargs)
+    return user_ids, product_ids
+
+
+def test_lookups_match_live_scores(bmf_tables, tmp_path):
+    user_ids, product_ids = bmf_store(bmf_tables, tmp_path)
+    store = TopNStore(str(tmp_path))
+    for user_id in user_ids:
+        live = bmf_tables.score_users(bmf_tables.user_vectors[[user_id]], bmf_tables.user_bias[[user_id]], np.arange(30))
+        top, top_scores = top_n(live, 5)
+        ids, scores = store.lookup('BMF', user_id)
+        assert list(ids) == list(product_ids[top[0]])
+        assert np.allclose(scores, top_scores[0], atol=1e-3)
+    assert store.lookup('BMF', 4) is None and store.lookup('BMF', 999) is None
+    assert store.lookup('ENCM', 3) is None
+    assert store.stats['hits'] == 4 and store.stats['misses'] == 2
+
+
+def test_calibration_hook_reorders_the_lists(bmf_tables, tmp_path):
+    plain, calibrated = tmp_path / 'plain', tmp_path / 'calibrated'
+    bmf_store(bmf_tables, plain)
+    bmf_store(bmf_tables, calibrated, calibration=Reversed())
+    live = bmf_tables.score_users(bmf_tables.user_vectors[[7]], bmf_tables.user_bias[[7]], np.arange(30))
+    ids, _ = TopNStore(str(calibrated)).lookup('BMF', 7)
+    assert list(ids) == list(100 + np.argsort(live[0])[:5])
+    assert list(ids) != list(TopNStore(str(plain)).lookup('BMF', 7)[0])
+
+
+def test_stale_stores_are_not_served(bmf_tables, tmp_path):
+    bmf_store(bmf_tables, tmp_path)
+    store = TopNStore(str(tmp_path), max_age=-1)
+    assert store.lookup('BMF', 3) is None and store.stats['stale'] == 1
+
+
+def test_encm_lists_only_serve_their_bucket(encm_tables, tmp_path):
+    user_ids = np.array([2, 5])
+    contexts = np.array([[1, 2, 1, 0, 3, 4, 5, 0], [0, 3, 2, 1, 3, 4, 6, 1]], dtype=np.int32)
+    item_context = np.stack([np.arange(30) % 12, np.arange(30) % 7], axis=1)
+    build_store('ENCM', encm_tables, user_ids, encm_tables.user_vectors[user_ids], np.zeros(2), np.arange(30),
+                np.arange(30), item_context, contexts, n=4, directory=str(tmp_path), workers=1)
+    store = TopNStore(str(tmp_path))
+    for user_id, row in zip(user_ids, contexts):
+        live = encm_tables.score_users(encm_tables.user_vectors[[user_id]], np.zeros(1), np.arange(30),
+                                       item_context, row[None, :])
+        ids, _ = store.lookup('ENCM', user_id, bucket_of(row))
+        assert list(ids) == list(top_n(live, 4)[0][0])
+    assert store.lookup('ENCM', 2, bucket_of(contexts[1])) is None
+    assert store.stats['other_bucket'] == 1
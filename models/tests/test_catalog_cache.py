@@ -0,0 +1,179 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from catalog_cache import CatalogCache, CatalogSnapshot
+
+T0 = datetime(2025, 1, 1)
+
+
+def product(pid, name=None, category='giay', brand='nike', status='S1', minutes=0):
+    return (pid, name or f'P{pid}', category, brand, status, T0 + timedelta(minutes=minutes))
+
+
+class ProductsDB:
+    """products table behind the cursor calls CatalogCache makes"""
+
+    def __init__(self, rows):
+        self.rows = {r[0]: r for r in rows}
+        self.queries = 0
+
+    def put(self, row):
+        self.rows[row[0]] = row
+
+    def connect(self):
+        return self
+
+    def cursor(self):
+        return self
+
+    def close(self):
+        pass
+
+    def execute(self, sql, params=()):
+        self.queries += 1
+        if 'COUNT(*)' in sql:
+            self._result = [(len(self.rows),)]
+        elif 'updatedAt >=' in sql:
+            self._result = [r for r in self.rows.values() if r[5] >= params[0]]
+        else:
+            self._result = list(self.rows.values())
+
+    def fetchall(self):
+        return self._result
+
+    def fetchone(self):
+        return self._result[0]
+
+
+def columns(snapshot):
+    """Catalog contents by product id, independent of positions and code numbering"""
+    return {int(pid): (snapshot.name(pos), snapshot.category_id(pos), snapshot.brand_id(pos), bool(snapshot.active[pos]))
+            for pos, pid in enumerate(snapshot.ids)}
+
+
+def test_merged_matches_a_full_build():
+    base = CatalogSnapshot.from_rows([product(p) for p in range(1, 6)], version=1)
+    delta = [product(2, name='renamed'), product(3, category='balo'), product(4, status='S2'),
+             product(9, name='new', brand='prada', minutes=5)]
+    merged, changed = base.merged(delta)
+    full = CatalogSnapshot.from_rows([product(1), product(5)] + delta)
+    assert changed and merged.version == 2
+    assert columns(merged) == columns(full)
+    assert merged.synced_at == T0 + timedelta(minutes=5)
+
+
+def test_merged_keeps_positions_and_shares_untouched_columns():
+    base = CatalogSnapshot.from_rows([product(p) for p in (10, 20, 30)])
+    merged, _ = base.merged([product(20, status='S2'), product(15)])
+    assert list(merged.ids[:3]) == [10, 20, 30] and merged.ids[3] == 15
+    assert list(merged.positions_of([15, 30, 99])) == [3, 2, -1]
+    unchanged, changed = merged.merged([product(10)])
+    assert not changed and unchanged.version == merged.version
+    assert unchanged.name_blob is merged.name_blob
+
+
+def test_snapshot_arrays_are_read_only():
+    snapshot = CatalogSnapshot.from_rows([product(1)])
+    try:
+        snapshot.active[0] = False
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('snapshot columns must not be writable')
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / 'catalog.npz')
+    snapshot = CatalogSnapshot.from_rows([product(1, name='Áo khoác'), product(2, status='S2', minutes=3)], version=4)
+    snapshot.save(path, refreshed_at=123.0)
+    loaded, refreshed_at = CatalogSnapshot.load(path)
+    assert refreshed_at == 123.0 and loaded.version == 4 and loaded.synced_at == snapshot.synced_at
+    assert columns(loaded) == columns(snapshot)
+    assert CatalogSnapshot.load(str(tmp_path / 'missing.npz')) is None
+
+
+def test_refresh_applies_deltas_and_reloads_after_a_delete(tmp_path):
+    db = ProductsDB([product(p) for p in range(1, 4)])
+    cache = CatalogCache(str(tmp_path / 'catalog.npz'))
+    assert cache.refresh(db) and len(cache) == 3
+    first = cache.current
+    db.put(product(2, name='changed', minutes=1))
+    assert cache.refresh(db)
+    assert cache.current.name(cache.current.positions_of([2])[0]) == 'changed'
+    assert first.name(first.positions_of([2])[0]) == 'P2'
+    assert not cache.refresh(db)
+    del db.rows[3]
+    assert cache.refresh(db) and sorted(cache.current.ids) == [1, 2]
+
+
+def test_start_up_serves_the_saved_snapshot_without_the_database(tmp_path):
+    path = str(tmp_path / 'catalog.npz')
+    CatalogCache(path).refresh(ProductsDB([product(1), product(2)]))
+    cache = CatalogCache(path)
+    assert cache.load() and len(cache) == 2
+
+    def unreachable():
+        raise ConnectionError('database down')
+
+    # Stale: served as is while the refresh fails in the background
+    snapshot = cache.ensure_fresh(unreachable, max_age=0)
+    assert snapshot is cache.current and len(snapshot) == 2
+    deadline = time.time() + 5
+    while cache._lock.locked() and time.time() < deadline:
+        time.sleep(0.01)
+    assert not cache._lock.locked()
+
+
+def test_ensure_fresh_refreshes_a_stale_snapshot_in_the_background(tmp_path):
+    db = ProductsDB([product(1)])
+    cache = CatalogCache(str(tmp_path / 'catalog.npz'))
+    assert len(cache.ensure_fresh(db.connect)) == 1
+    db.put(product(2, minutes=1))
+    release = threading.Event()
+
+    def slow_connect():
+        release.wait(5)
+        return db
+
+    stale = cache.ensure_fresh(slow_connect, max_age=0)
+    assert len(stale) == 1
+    release.set()
+    deadline = time.time() + 5
+    while len(cache.current) != 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert sorted(cache.current.ids) == [1, 2]
+    assert np.array_equal(stale.ids, [1])
+
+
+def test_readers_see_whole_snapshots_during_refreshes(tmp_path):
+    db = ProductsDB([product(p) for p in range(1, 50)])
+    cache = CatalogCache(str(tmp_path / 'catalog.npz'))
+    cache.refresh(db)
+    errors = []
+    stop = threading.Event()
+
+    def read():
+        while not stop.is_set():
+            snapshot = cache.current
+            try:
+                # Every column of one snapshot agrees on its length and ids
+                n = len(snapshot.ids)
+                assert len(snapshot.active) == n and len(snapshot.name_offsets) == n + 1
+                assert list(snapshot.positions_of(snapshot.ids)) == list(range(n))
+            except AssertionError as e:
+                errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for t in readers:
+        t.start()
+    for i in range(30):
+        db.put(product(100 + i, minutes=i + 1))
+        db.put(product(1 + i % 40, name=f'v{i}', minutes=i + 1))
+        cache.refresh(db)
+    stop.set()
+    for t in readers:
+        t.join()
+    assert not errors and len(cache) == 79
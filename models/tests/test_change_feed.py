@@ -0,0 +1,84 @@
+import json
+import os
+
+import change_feed
+from change_feed import ChangeFeed
+
+
+def append(path, text):
+    with open(path, 'a') as f:
+        f.write(text)
+
+
+def event(user_id):
+    return json.dumps({'type': 'interaction', 'userId': user_id, 'productId': 1, 'actionCode': 'view'}) + '\n'
+
+
+def test_lines_present_at_start_up_are_skipped(tmp_path):
+    path = str(tmp_path / 'feed.jsonl')
+    append(path, event(1))
+    seen = []
+    feed = ChangeFeed(seen.append, path=path)
+    assert feed.poll() == 0
+    append(path, event(2))
+    assert feed.poll() == 1 and [e['userId'] for e in seen] == [2]
+
+
+def test_a_line_is_handled_once_complete(tmp_path):
+    path = str(tmp_path / 'feed.jsonl')
+    append(path, '')
+    seen = []
+    feed = ChangeFeed(seen.append, path=path)
+    feed.poll()
+    append(path, '{"userId": 3')
+    assert feed.poll() == 0 and not seen
+    append(path, '}\nnot json\n')
+    assert feed.poll() == 2 and seen == [{'userId': 3}]
+    assert feed.stats['events'] == 1 and feed.stats['errors'] == 1
+
+
+def test_reader_rotates_the_file_and_follows_it(tmp_path):
+    path = str(tmp_path / 'feed.jsonl')
+    append(path, '')
+    seen = []
+    feed = ChangeFeed(seen.append, path=path, rotate_bytes=50)
+    feed.poll()
+    append(path, event(1) + event(2))
+    feed.poll()
+    assert os.path.exists(path + '.1') and feed.stats['rotations'] == 1
+    append(path, event(3))
+    feed.poll()
+    assert [e['userId'] for e in seen] == [1, 2, 3]
+
+
+def test_line_in_flight_during_a_rotation_is_not_lost(tmp_path):
+    path = str(tmp_path / 'feed.jsonl')
+    append(path, '')
+    seen = []
+    feed = ChangeFeed(seen.append, path=path)
+    feed.poll()
+    append(path, '{"userId": 1, "a": ')
+    feed.poll()
+    os.replace(path, path + '.1')
+    append(path, event(2))
+    feed.poll()
+    assert not seen
+    # The rest of the in-flight write lands in the renamed file
+    append(path + '.1', '1}\n')
+    feed.poll()
+    assert [e['userId'] for e in seen] == [1, 2]
+
+
+def test_fragment_never_completed_is_dropped_after_the_grace(tmp_path, monkeypatch):
+    path = str(tmp_path / 'feed.jsonl')
+    append(path, '')
+    seen = []
+    feed = ChangeFeed(seen.append, path=path)
+    feed.poll()
+    append(path, '{"userId": 1')
+    feed.poll()
+    os.replace(path, path + '.1')
+    append(path, event(2))
+    monkeypatch.setattr(change_feed, 'FEED_PARTIAL_GRACE_SECONDS', 0.0)
+    feed.poll()
+    assert [e['userId'] for e in seen] == [2] and feed.stats['errors'] == 1
@@ -0,0 +1,68 @@
+import numpy as np
+
+from co_occurrence import BASKET_GAP_SECONDS, CoOccurrence
+from item_neighbours import ItemNeighbours, write_records
+
+
+def event_stream(n=400, seed=2):
+    """(interId, userId, productId, actionCode, unix time) rows in interId order"""
+    rng = np.random.default_rng(seed)
+    times = np.cumsum(rng.exponential(BASKET_GAP_SECONDS / 4, size=n))
+    return [(i + 1, int(rng.integers(6)), int(rng.integers(25)), str(rng.choice(['cart', 'purchase'])), float(t))
+            for i, t in enumerate(times)]
+
+
+def dense(co_occurrence, n):
+    matrix = co_occurrence.matrix.toarray()
+    out = np.zeros((n, n))
+    out[:matrix.shape[0], :matrix.shape[1]] = matrix
+    return out
+
+
+def test_incremental_batches_match_a_full_build(tmp_path):
+    rows = event_stream()
+    full = CoOccurrence(path=str(tmp_path / 'full.pkl'))
+    full.add_events(rows)
+    incremental = CoOccurrence(path=str(tmp_path / 'incremental.pkl'))
+    for start, end in [(0, 7), (7, 150), (150, 151), (151, 320), (320, 400)]:
+        incremental.add_events(rows[start:end])
+    assert incremental.last_inter_id == full.last_inter_id == 400
+    assert np.allclose(dense(incremental, 25), dense(full, 25))
+
+
+def test_state_round_trips_and_continues(tmp_path):
+    rows = event_stream(seed=3)
+    full = CoOccurrence(path=str(tmp_path / 'full.pkl'))
+    full.add_events(rows)
+    first = CoOccurrence(path=str(tmp_path / 'state.pkl'))
+    first.add_events(rows[:200])
+    first.save()
+    resumed = CoOccurrence(path=str(tmp_path / 'state.pkl'))
+    assert resumed.load() and resumed.last_inter_id == 200
+    resumed.add_events(rows[200:])
+    assert np.allclose(dense(resumed, 25), dense(full, 25))
+
+
+def test_baskets_split_on_the_gap():
+    co_occurrence = CoOccurrence()
+    co_occurrence.add_events([(1, 1, 3, 'cart', 0.0), (2, 1, 4, 'purchase', 60.0),
+                              (3, 1, 5, 'purchase', 60.0 + BASKET_GAP_SECONDS + 1)])
+    matrix = co_occurrence.matrix.toarray()
+    assert matrix[3, 4] == matrix[4, 3] == 0.7
+    assert matrix[3, 5] == matrix[4, 5] == 0
+    assert co_occurrence.stats['baskets'] == 2
+
+
+def test_top_k_lists_are_normalized_and_exclude_the_item(tmp_path):
+    co_occurrence = CoOccurrence(k=3, directory=str(tmp_path))
+    co_occurrence.add_events(event_stream(seed=4))
+    n_items = int(np.count_nonzero(np.diff(co_occurrence.matrix.indptr)))
+    write_records('bought_together', n_items, 3, co_occurrence.top_k, str(tmp_path))
+    matrix = co_occurrence.matrix.toarray()
+    diag = np.diag(matrix)
+    neighbours = ItemNeighbours(str(tmp_path))
+    for item in np.flatnonzero(diag):
+        ids, scores = neighbours.lookup('bought_together', int(item))
+        assert item not in ids and list(scores) == sorted(scores, reverse=True)
+        expected = matrix[item, ids] / np.sqrt(diag[item] * diag[ids])
+        assert np.allclose(scores, expected, atol=2e-3)
@@ -0,0 +1,26 @@
+import numpy as np
+
+from cold_items import cold_item_vectors
+
+
+def test_cold_vectors_fall_back_from_category_and_brand_to_all_items():
+    vectors = np.array([[1, 0], [3, 0], [0, 2], [0, 4]], dtype=np.float32)
+    bias = np.array([1.0, 3.0, 5.0, 7.0], dtype=np.float32)
+    category = np.array([1, 1, 2, 2])
+    brand = np.array([1, 2, 1, 2])
+    got, got_bias = cold_item_vectors(vectors, bias, category, brand,
+                                      cold_category=np.array([1, 1, 0, 9, 0]), cold_brand=np.array([2, 5, 1, 9, 0]))
+    assert np.allclose(got[0], [3, 0]) and got_bias[0] == 3.0          # same category and brand
+    assert np.allclose(got[1], [2, 0]) and got_bias[1] == 2.0          # same category
+    assert np.allclose(got[2], [0.5, 1]) and got_bias[2] == 3.0        # same brand
+    assert np.allclose(got[3], vectors.mean(axis=0)) and got_bias[3] == 4.0
+    assert np.allclose(got[4], vectors.mean(axis=0))                   # no codes at all
+
+
+def test_tables_score_cold_items_through_their_rows(bmf_tables):
+    vectors = np.ones((2, 4), dtype=np.float32)
+    tables = bmf_tables.with_cold_items(np.array([900, 500]), vectors, np.array([0.2, 0.1], dtype=np.float32), version=3)
+    assert list(tables.cold_rows([500, 900, 7])) == [30, 31, -1]
+    assert list(bmf_tables.cold_rows([500])) == [-1]
+    assert tables.item_vectors.shape == (32, 4) and bmf_tables.item_vectors.shape == (30, 4)
+    assert np.isclose(tables.item_bias[30], 0.1) and tables.cold_version == 3
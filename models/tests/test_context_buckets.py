@@ -0,0 +1,42 @@
+import time
+from datetime import datetime
+
+import numpy as np
+
+from context_buckets import BucketCache, bucket_of, bucket_start, bucket_time_context
+
+
+def test_bucket_start_floors_to_the_time_of_day():
+    assert bucket_start(datetime(2026, 3, 7, 5, 59, 30)) == datetime(2026, 3, 7, 0, 0)
+    assert bucket_start(datetime(2026, 3, 7, 6, 0, 1)) == datetime(2026, 3, 7, 6, 0)
+    assert bucket_start(datetime(2026, 3, 7, 23, 10)) == datetime(2026, 3, 7, 18, 0)
+
+
+def test_bucket_time_context_names_the_bucket():
+    saturday_evening = bucket_time_context(datetime(2026, 12, 5, 18))
+    assert saturday_evening['time_of_day'] == 'evening' and saturday_evening['season'] == 'winter'
+    assert saturday_evening['hour'] == 21 and saturday_evening['month'] == 11
+    assert saturday_evening['is_weekend'] == 1
+    monday_morning = bucket_time_context(datetime(2026, 6, 1, 6))
+    assert (monday_morning['time_of_day'], monday_morning['season'], monday_morning['is_weekend']) == ('morning', 'summer', 0)
+
+
+def test_bucket_of_keeps_the_discrete_columns():
+    assert bucket_of(np.array([2, 3, 0, 1, 21, 11, 5, 1])) == (2, 3, 0, 1, 1)
+
+
+def test_cache_expires_and_evicts_the_least_recent():
+    cache = BucketCache(capacity=2)
+    bucket = (1, 2, 3, 0, 0)
+    later = time.time() + 60
+    cache.put(1, bucket, [5, 6], [0.5, 0.25], later)
+    cache.put(2, bucket, [7], [0.1], later)
+    ids, scores = cache.get(1, bucket)
+    assert ids.tolist() == [5, 6] and np.allclose(scores, [0.5, 0.25])
+    assert cache.get(1, (1, 2, 3, 0, 1)) is None
+    cache.put(3, bucket, [8], [0.1], later)
+    assert cache.get(2, bucket) is None and cache.get(1, bucket) is not None
+    assert cache.stats['evicted'] == 1
+    cache.put(4, bucket, [9], [0.1], time.time() - 1)
+    # Evicted user 3 on the way in, and dropped when read expired
+    assert cache.get(4, bucket) is None and len(cache) == 1
@@ -0,0 +1,47 @@
+import time
+
+from deadline import (Deadline, ScoreCostModel, REDUCED_CANDIDATES, SCORE_OVERHEAD_SECONDS, TIER_CACHED,
+                      TIER_FULL, TIER_POPULARITY, TIER_REDUCED)
+
+
+class Remaining:
+    """Deadline stand-in with a fixed remaining budget"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def remaining(self):
+        return self.seconds
+
+
+def test_deadline_from_payload():
+    assert Deadline.from_payload({}) is None
+    started = time.monotonic() - 0.05
+    deadline = Deadline.from_payload({'budget_ms': 100}, started)
+    assert 0 < deadline.remaining() <= 0.05
+    assert Deadline(-5).remaining() <= 0
+
+
+def test_cost_model_learns_per_item_time():
+    costs = ScoreCostModel()
+    costs.observe('ENCM', 1000, SCORE_OVERHEAD_SECONDS + 1.0)
+    assert abs(costs.estimate('ENCM', 500) - (SCORE_OVERHEAD_SECONDS + 0.5)) < 1e-9
+    costs.observe('ENCM', 1000, SCORE_OVERHEAD_SECONDS)
+    assert costs.estimate('ENCM', 1000) < SCORE_OVERHEAD_SECONDS + 1.0
+    costs.observe('ENCM', 0, 5.0)
+    assert costs.estimate('BMF', 0) == SCORE_OVERHEAD_SECONDS
+
+
+def test_tiers_step_down_with_the_budget():
+    costs = ScoreCostModel()
+    costs.observe('ENCM', 1000, SCORE_OVERHEAD_SECONDS + 1.0)   # 1 ms per item
+    n = 10 * REDUCED_CANDIDATES
+    full = costs.estimate('ENCM', n)
+    reduced = costs.estimate('ENCM', REDUCED_CANDIDATES)
+    assert costs.choose_tier('ENCM', n, None, False) == TIER_FULL
+    assert costs.choose_tier('ENCM', n, Remaining(full), False) == TIER_FULL
+    assert costs.choose_tier('ENCM', n, Remaining(reduced), False) == TIER_REDUCED
+    assert costs.choose_tier('ENCM', n, Remaining(reduced / 2), True) == TIER_CACHED
+    assert costs.choose_tier('ENCM', n, Remaining(reduced / 2), False) == TIER_POPULARITY
+    # Too few candidates to reduce
+    assert costs.choose_tier('ENCM', REDUCED_CANDIDATES, Remaining(0), False) == TIER_POPULARITY
@@ -0,0 +1,36 @@
+import numpy as np
+
+
+def context_features(item_context, request_context):
+    features = np.zeros((len(item_context), 10), dtype=np.int64)
+    features[:, :2] = item_context
+    features[:, 2:] = request_context
+    return features
+
+
+def test_encm_sweep_matches_scoring_each_context(encm_tables):
+    rng = np.random.default_rng(3)
+    rows = np.arange(0, 30, 2)
+    item_context = rng.integers(0, 12, size=(len(rows), 2))
+    contexts = rng.integers(0, 12, size=(6, 8))
+    user = encm_tables.user_vectors[4]
+    grid = encm_tables.encm_sweep(user, rows, item_context, contexts, max_elements=len(rows) * 8 * 2)
+    for k, request_context in enumerate(contexts):
+        expected = encm_tables.score(user, 0.0, rows, context_features(item_context, request_context))
+        assert np.allclose(grid[k], expected, atol=1e-5)
+
+
+def test_score_users_matches_scoring_each_user(encm_tables, bmf_tables):
+    rng = np.random.default_rng(4)
+    rows = np.arange(30)
+    users = np.arange(5)
+    item_context = rng.integers(0, 12, size=(30, 2))
+    contexts = rng.integers(0, 12, size=(5, 8))
+    block = encm_tables.score_users(encm_tables.user_vectors[users], np.zeros(5), rows, item_context, contexts)
+    for u in users:
+        expected = encm_tables.score(encm_tables.user_vectors[u], 0.0, rows, context_features(item_context, contexts[u]))
+        assert np.allclose(block[u], expected, atol=1e-5)
+    block = bmf_tables.score_users(bmf_tables.user_vectors[users], bmf_tables.user_bias[users], rows)
+    for u in users:
+        assert np.allclose(block[u], bmf_tables.score(*bmf_tables.user_row(u), rows), atol=1e-6)
+
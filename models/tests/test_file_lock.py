@@ -0,0 +1,43 @@
+import os
+import threading
+import time
+
+from file_lock import FileLock
+
+
+def test_one_holder_at_a_time(tmp_path):
+    path = str(tmp_path / 'serving' / 'writer.lock')
+    first, second = FileLock(path), FileLock(path)
+    assert first.acquire() and first.acquire()
+    assert open(path).read() == str(os.getpid())
+    assert not second.acquire()
+    first.release()
+    assert second.acquire()
+    second.release()
+    assert not os.path.exists(path)
+
+
+def test_a_dead_holder_is_taken_over_once_stale(tmp_path):
+    path = str(tmp_path / 'writer.lock')
+    with open(path, 'w') as f:
+        f.write('99999')
+    lock = FileLock(path, stale_seconds=60)
+    assert not lock.acquire()
+    os.utime(path, (time.time() - 61, time.time() - 61))
+    assert lock.acquire()
+    stale = time.time() - os.path.getmtime(path)
+    os.utime(path, (time.time() - 61, time.time() - 61))
+    lock.refresh()
+    assert time.time() - os.path.getmtime(path) <= stale + 1
+
+
+def test_hold_starts_the_writer_once_the_lock_frees(tmp_path):
+    path = str(tmp_path / 'writer.lock')
+    other = FileLock(path)
+    assert other.acquire()
+    started = threading.Event()
+    lock = FileLock(path)
+    lock.hold(started.set, interval=0.05)
+    assert not started.wait(0.2)
+    other.release()
+    assert started.wait(2) and lock.held
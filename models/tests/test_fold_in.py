@@ -0,0 +1,138 @@
+import copy
+import os
+
+import numpy as np
+import pytest
+
+from fold_in import FoldInCache, encm_user_gradient, fold_in, fold_in_bmf
+
+
+def bmf_ratings(tables, user_vec, user_bias, item_rows):
+    return tables.item_vectors[item_rows] @ user_vec + tables.item_bias[item_rows] + user_bias + tables.global_bias
+
+
+def test_bmf_fold_in_recovers_the_user_from_enough_ratings(bmf_tables):
+    rows = np.arange(30)
+    true_vec, true_bias = bmf_tables.user_vectors[3], float(bmf_tables.user_bias[3])
+    vec, bias = fold_in_bmf(bmf_tables, rows, bmf_ratings(bmf_tables, true_vec, true_bias, rows), reg=1e-6)
+    assert np.allclose(vec, true_vec, atol=1e-3) and abs(bias - true_bias) < 1e-3
+
+
+def test_fold_in_without_history_is_the_mean_user(bmf_tables, encm_tables):
+    empty = np.zeros(0, dtype=np.int64)
+    vec, bias = fold_in(bmf_tables, empty, np.zeros(0))
+    assert np.allclose(vec, bmf_tables.mean_user) and bias == bmf_tables.mean_user_bias
+    vec, _ = fold_in(encm_tables, empty, np.zeros(0), np.zeros((0, 10), dtype=np.int64))
+    assert np.allclose(vec, encm_tables.mean_user)
+
+
+def test_encm_fold_in_lowers_the_training_loss(encm_tables):
+    rng = np.random.default_rng(2)
+    rows = np.arange(12)
+    contexts = rng.integers(0, 12, size=(12, 10))
+    ratings = rng.choice([0.3, 0.7, 1.0], size=12)
+
+    def loss(vec):
+        return float(np.mean((encm_tables.score(vec, 0.0, rows, contexts) - ratings) ** 2))
+
+    vec, _ = fold_in(encm_tables, rows, ratings, contexts)
+    assert loss(vec) < loss(encm_tables.mean_user)
+
+
+def test_cache_round_trips_through_disk_and_invalidates_users(tmp_path):
+    path = str(tmp_path / 'fold.npz')
+    cache = FoldInCache(path)
+    cache.put('BMF', 7, np.arange(4, dtype=np.float32), 0.5)
+    cache.put('ENCM', 7, np.arange(6, dtype=np.float32), 0.0)
+    cache.put('BMF', 8, np.ones(4, dtype=np.float32), 1.5)
+    loaded = FoldInCache(path)
+    assert loaded.load()
+    vec, bias = loaded.get('ENCM', '7')
+    assert np.array_equal(vec, np.arange(6)) and bias == 0.0
+    loaded.invalidate_user(7)
+    assert loaded.get('BMF', 7) is None and loaded.get('ENCM', 7) is None
+    assert loaded.get('BMF', 8)[1] == 1.5
+
+
+def test_expired_entries_are_not_served(tmp_path):
+    cache = FoldInCache(str(tmp_path / 'fold.npz'), ttl=-1)
+    cache.put('BMF', 7, np.zeros(4, dtype=np.float32), 0.0)
+    assert cache.get('BMF', 7) is None
+
+
+def test_fits_are_journaled_not_snapshotted(tmp_path):
+    path = str(tmp_path / 'fold.npz')
+    cache = FoldInCache(path)
+    cache.put('BMF', 7, np.arange(4, dtype=np.float32), 0.5)
+    assert not os.path.exists(path) and os.path.exists(cache.journal_path)
+    cache.save()
+    assert os.path.exists(path) and not os.path.exists(cache.journal_path)
+    loaded = FoldInCache(path)
+    assert loaded.load() and loaded.get('BMF', 7)[1] == 0.5
+    # Another process compacting: the journal waits for the next compaction
+    loaded.put('BMF', 8, np.arange(4, dtype=np.float32), 1.5)
+    assert cache._compact_lock.acquire()
+    loaded.save()
+    assert os.path.exists(loaded.journal_path)
+
+
+def test_processes_merge_instead_of_overwriting(tmp_path):
+    path = str(tmp_path / 'fold.npz')
+    first, second = FoldInCache(path), FoldInCache(path)
+    first.put('BMF', 7, np.zeros(4, dtype=np.float32), 0.5)
+    first.save()
+    second.put('BMF', 8, np.ones(4, dtype=np.float32), 1.5)
+    second.put('BMF', 9, np.ones(4, dtype=np.float32), 2.5)
+    second.save()
+    # Torn tail of a crashed append
+    with open(first.journal_path, 'ab') as f:
+        f.write(b'{"model": "BMF", "us')
+    first.put('BMF', 9, np.full(4, 2, dtype=np.float32), 3.5)
+    first.save()
+    merged = FoldInCache(path)
+    assert merged.load()
+    assert [merged.get('BMF', u)[1] for u in (7, 8, 9)] == [0.5, 1.5, 3.5]
+
+
+def test_invalidations_reach_other_processes(tmp_path):
+    path = str(tmp_path / 'fold.npz')
+    cli = FoldInCache(path)
+    cli.put('BMF', 7, np.zeros(4, dtype=np.float32), 0.5)
+    cli.save()
+    server = FoldInCache(path)
+    server.invalidate_user(7)
+    reloaded = FoldInCache(path)
+    reloaded.load()
+    assert reloaded.get('BMF', 7) is None
+    server.save()
+    reloaded = FoldInCache(path)
+    reloaded.load()
+    assert reloaded.get('BMF', 7) is None
+
+
+@pytest.mark.parametrize('hidden, output', [('relu', 'linear'), ('relu', 'sigmoid'), ('sigmoid', 'linear')])
+def test_encm_gradient_matches_finite_differences(encm_tables, hidden, output):
+    tables = copy.copy(encm_tables)
+    (k0, b0, _), (k1, b1, _) = encm_tables.dense
+    tables.dense = [(k0.astype(np.float64), b0.astype(np.float64), hidden),
+                    (k1.astype(np.float64), b1.astype(np.float64), output)]
+    rng = np.random.default_rng(4)
+    rows = np.arange(12)
+    fixed = tables.encm_fixed_input(rows, rng.integers(0, 12, size=(12, 10))).astype(np.float64)
+    ratings = rng.choice([0.3, 0.7, 1.0], size=12)
+    user_kernel = tables.dense[0][0][:tables.dim]
+
+    def loss(u):
+        return float(np.mean((tables.encm_forward(fixed + u @ user_kernel) - ratings) ** 2))
+
+    u = rng.normal(size=tables.dim)
+    numeric = [(loss(u + 1e-6 * e) - loss(u - 1e-6 * e)) / 2e-6 for e in np.eye(tables.dim)]
+    assert np.allclose(encm_user_gradient(tables, fixed, u, ratings), numeric, atol=1e-6)
+
+
+def test_unknown_activations_are_rejected(encm_tables):
+    tables = copy.copy(encm_tables)
+    tables.dense = encm_tables.dense[:-1] + [encm_tables.dense[-1][:2] + ('tanh',)]
+    fixed = tables.encm_fixed_input(np.arange(3), np.zeros((3, 10), dtype=np.int64))
+    with pytest.raises(ValueError):
+        encm_user_gradient(tables, fixed, encm_tables.mean_user, np.ones(3))
@@ -0,0 +1,30 @@
+import numpy as np
+
+from item_neighbours import ItemNeighbours, _unit_rows, write_neighbours
+
+
+def brute_force(vectors, k):
+    sims = vectors @ vectors.T
+    np.fill_diagonal(sims, -np.inf)
+    return np.argsort(-sims, axis=1, kind='stable')[:, :k], np.sort(sims, axis=1)[:, ::-1][:, :k]
+
+
+def test_neighbours_match_a_brute_force_ranking(tmp_path):
+    vectors = _unit_rows(np.random.default_rng(5).normal(size=(40, 6)))
+    product_ids = np.arange(100, 140)
+    write_neighbours('BMF', vectors, product_ids, k=5, directory=str(tmp_path))
+    top, sims = brute_force(vectors, 5)
+    neighbours = ItemNeighbours(str(tmp_path))
+    assert neighbours.available('BMF') and not neighbours.available('ENCM')
+    for row in range(40):
+        ids, scores = neighbours.lookup('BMF', product_ids[row])
+        assert list(ids) == list(product_ids[top[row]])
+        assert np.allclose(scores, sims[row], atol=2e-3)
+    assert neighbours.lookup('BMF', 999) is None
+
+
+def test_k_larger_than_the_catalog_pads_with_nothing(tmp_path):
+    vectors = _unit_rows(np.eye(3))
+    write_neighbours('BMF', vectors, [1, 2, 3], k=10, directory=str(tmp_path))
+    ids, _ = ItemNeighbours(str(tmp_path)).lookup('BMF', 2)
+    assert sorted(ids) == [1, 3]
@@ -0,0 +1,79 @@
+import json
+import os
+
+import model_bandit
+from model_bandit import REWARD_WINDOW_SECONDS, ModelBandit, attribute_rewards, segment_of
+
+
+def serve(user, at, items):
+    return {'user': user, 'at': at, 'items': frozenset(items)}
+
+
+def test_segment_of_splits_device_and_history():
+    assert segment_of({'device_type': 'Mobile'}, 3) == 'mobile:cold'
+    assert segment_of({'device_type': 'desktop'}, 10) == 'desktop:warm'
+    assert segment_of(None, 50) == 'unknown:warm'
+
+
+def test_rewards_go_to_the_latest_list_with_the_product():
+    serves = [serve(1, 100.0, [5, 6]), serve(1, 200.0, [6, 7]), serve(2, 150.0, [5])]
+    # The second purchase of 6 falls back to the older list; a third finds both rewarded
+    events = [(1, 6, 250), (1, 6, 260), (1, 6, 270), (1, 5, 90), (2, 5, 160 + REWARD_WINDOW_SECONDS)]
+    assert attribute_rewards(serves, events) == [True, True, False]
+    assert attribute_rewards(serves, [(1, 7, 150)]) == [False, False, False]
+
+
+def fake_events(monkeypatch, events):
+    monkeypatch.setattr(ModelBandit, '_reward_events', lambda self, conn, serves: events)
+
+
+def test_settle_counts_only_closed_windows_and_merges_processes(tmp_path, monkeypatch):
+    path = str(tmp_path / 'bandit.json')
+    # Two processes serving and settling against the same files
+    cli, server = ModelBandit(path=path, seed=0), ModelBandit(path=path, seed=0)
+    cli.record_serve(1, 's', 'BMF', [5])
+    server.record_serve(2, 's', 'ENCM', [6])
+    server.record_serve(3, 's', 'ENCM', [7])
+    now = model_bandit.time.time()
+    fake_events(monkeypatch, [(1, 5, int(now) + 10), (3, 8, int(now) + 10)])
+    assert server.settle(None, now=now + 1)
+    assert server.snapshot() == {}
+    assert cli.settle(None, now=now + REWARD_WINDOW_SECONDS + 1)
+    expected = {'s': {'BMF': {'impressions': 1, 'rewards': 1}, 'ENCM': {'impressions': 2, 'rewards': 0}}}
+    assert cli.snapshot() == expected
+    server.refresh(None)
+    assert server.snapshot() == expected
+    # Counted lists leave the journal; counts on disk only grow
+    assert not os.path.exists(cli.journal_path)
+    cli.record_serve(1, 's', 'BMF', [5])
+    assert server.settle(None, now=now + 2 * REWARD_WINDOW_SECONDS)
+    assert json.load(open(path))['s']['BMF'] == {'impressions': 2, 'rewards': 2}
+
+
+def test_a_held_lock_or_failed_query_keeps_the_lists(tmp_path, monkeypatch):
+    path = str(tmp_path / 'bandit.json')
+    bandit = ModelBandit(path=path, seed=0)
+    bandit.record_serve(1, 's', 'BMF', [5])
+    later = model_bandit.time.time() + REWARD_WINDOW_SECONDS + 1
+    other = ModelBandit(path=path)
+    assert other._settle_lock.acquire()
+    assert not bandit.settle(None, now=later)
+    other._settle_lock.release()
+
+    def broken(self, conn, serves):
+        raise RuntimeError('database gone')
+    monkeypatch.setattr(ModelBandit, '_reward_events', broken)
+    assert not bandit.settle(None, now=later)
+    fake_events(monkeypatch, [])
+    assert bandit.settle(None, now=later)
+    assert bandit.snapshot() == {'s': {'BMF': {'impressions': 1, 'rewards': 0}}}
+
+
+def test_choose_prefers_the_rewarded_arm(tmp_path):
+    path = tmp_path / 'bandit.json'
+    path.write_text(json.dumps({'s': {'BMF': {'impressions': 50, 'rewards': 50},
+                                      'ENCM': {'impressions': 50, 'rewards': 0}}}))
+    bandit = ModelBandit(path=str(path), seed=0)
+    assert bandit.choose('s', ['BMF']) == 'BMF' and bandit.choose('s', []) is None
+    assert bandit.load()
+    assert sum(bandit.choose('s', ['BMF', 'ENCM']) == 'BMF' for _ in range(100)) > 95
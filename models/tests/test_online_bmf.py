@@ -0,0 +1,39 @@
+import numpy as np
+
+from online_bmf import ONLINE_MAX_STEP, OnlineBMF
+
+
+def online(tables, **kwargs):
+    # User and product ids are the table rows; ids past the tables are untrained
+    def rows(t, ids, n):
+        return np.where(ids < n, ids, -1)
+    return OnlineBMF(lambda: tables, lambda t, ids: rows(t, ids, len(t.user_vectors)),
+                     lambda t, ids: rows(t, ids, len(t.item_vectors)), **kwargs)
+
+
+def raw(tables, u, i):
+    return tables.user_vectors[u] @ tables.item_vectors[i] + tables.user_bias[u] + tables.item_bias[i] + tables.global_bias
+
+
+def test_updates_move_the_pair_toward_the_action_rating(bmf_tables):
+    learner = online(bmf_tables, lr=0.05)
+    before = abs(1.0 - raw(bmf_tables, 2, 5))
+    for _ in range(50):
+        learner.apply([2], [5], ['purchase'])
+    assert abs(1.0 - raw(bmf_tables, 2, 5)) < before
+
+
+def test_steps_are_bounded_and_unknown_rows_skipped(bmf_tables):
+    user = bmf_tables.user_vectors[1].copy()
+    learner = online(bmf_tables, lr=100.0)
+    assert learner.apply([1, 99, 1], [3, 3, 99], ['purchase', 'cart', 'view']) == 1
+    assert np.linalg.norm(bmf_tables.user_vectors[1] - user) <= ONLINE_MAX_STEP + 1e-6
+    assert learner.stats == {'events': 3, 'updates': 1, 'checkpoints': 0}
+
+
+def test_feed_events_are_applied_once(bmf_tables):
+    learner = online(bmf_tables)
+    learner.last_inter_id = 10
+    assert learner.observe(11, 1, 2, 'view') == 1
+    assert learner.observe(11, 1, 2, 'view') == 0
+    assert learner.observe(9, 1, 2, 'view') == 0
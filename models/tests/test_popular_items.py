@@ -0,0 +1,60 @@
+import threading
+
+from popular_items import PopularItems
+
+
+class Rows:
+    """Connection whose cursor answers every query with `rows`"""
+
+    def __init__(self, rows, started=None, release=None):
+        self.rows = rows
+        self.started = started
+        self.release = release
+        self.queries = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=()):
+        self.queries += 1
+        if self.started is not None:
+            self.started.set()
+            self.release.wait(5)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+def test_refresh_ranks_and_live_events_reorder():
+    popular = PopularItems()
+    popular.refresh(Rows([(5, 6), (7, 3)]))
+    assert popular.top() == [(5, 1.0), (7, 0.5)]
+    for _ in range(2):
+        popular.record(7, 'purchase')
+    assert popular.top(1) == [(7, 1.0)]
+
+
+def test_first_refresh_runs_once_and_never_waits_on_another():
+    popular = PopularItems()
+    started, release = threading.Event(), threading.Event()
+    slow = Rows([(5, 1)], started, release)
+    thread = threading.Thread(target=popular.refresh_if_empty, args=(slow,))
+    thread.start()
+    started.wait(5)
+    # Another thread is already refreshing: return at once with the list still empty
+    popular.refresh_if_empty(Rows([(6, 1)]))
+    assert popular.top() == []
+    release.set()
+    thread.join(5)
+    again = Rows([(6, 1)])
+    popular.refresh_if_empty(again)
+    assert popular.top() == [(5, 1.0)] and again.queries == 0
+
+
+def test_refresher_fills_the_list_before_returning():
+    popular = PopularItems()
+    popular.start_refresher(lambda: Rows([(5, 2), (6, 1)]), interval=3600)
+    assert popular.top() == [(5, 1.0), (6, 0.5)] and popular.refreshed_at > 0
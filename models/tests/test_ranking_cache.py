@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from ranking_cache import RankingCache, decode_cursor, encode_cursor
+
+
+def test_cursor_round_trips():
+    cursor = encode_cursor('tok_-AZ9', 30)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == ('tok_-AZ9', 30)
+
+
+@pytest.mark.parametrize('cursor', ['zz', '', encode_cursor('t', 0)[:-2] + '!!'])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_pages_slice_the_stored_ranking():
+    rankings = RankingCache()
+    token = rankings.put(7, np.arange(100, 125), np.linspace(1, 0, 25), {'model': 'ENCM'})
+    ids, scores, meta, has_more = rankings.page('7', token, 10, 10)
+    assert list(ids) == list(range(110, 120)) and meta == {'model': 'ENCM'} and has_more
+    ids, _, _, has_more = rankings.page(7, token, 20, 10)
+    assert list(ids) == list(range(120, 125)) and not has_more
+
+
+def test_rankings_belong_to_their_user_and_expire():
+    rankings = RankingCache()
+    token = rankings.put(7, [1, 2], [0.5, 0.4], {})
+    assert rankings.page(8, token, 0, 1) is None
+    expired = RankingCache(ttl=-1)
+    assert expired.page(7, expired.put(7, [1], [1.0], {}), 0, 1) is None
+    assert rankings.stats['expired'] == 1
+
+
+def test_oldest_rankings_are_evicted():
+    rankings = RankingCache(max_entries=2)
+    first = rankings.put(1, [1], [1.0], {})
+    rankings.put(2, [2], [1.0], {})
+    rankings.put(3, [3], [1.0], {})
+    assert rankings.page(1, first, 0, 1) is None
+
+
+def test_invalidate_user_drops_only_their_rankings():
+    rankings = RankingCache()
+    mine = [rankings.put(7, [1], [1.0], {}) for _ in range(3)]
+    other = rankings.put(8, [2], [1.0], {})
+    rankings.invalidate_user('7')
+    assert all(rankings.page(7, token, 0, 1) is None for token in mine)
+    assert rankings.page(8, other, 0, 1) is not None
@@ -0,0 +1,258 @@
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import LabelEncoder
+
+pytest.importorskip('tensorflow')
+
+import recommend_api  # noqa: E402
+from bitset_index import CatalogBitsets  # noqa: E402
+from bulk_topn import encm_calibrated  # noqa: E402
+from catalog_cache import CatalogCache, CatalogSnapshot  # noqa: E402
+from context_buckets import bucket_of, bucket_start, bucket_time_context  # noqa: E402
+from recommend_api import TrainedRecommendationSystem  # noqa: E402
+from shard_ring import HashRing  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+
+
+def bare_system():
+    """TrainedRecommendationSystem without models or a database, for the helpers that need neither"""
+    system = TrainedRecommendationSystem.__new__(TrainedRecommendationSystem)
+    system._db_local = threading.local()
+    return system
+
+
+@pytest.fixture
+def shop(monkeypatch):
+    """In-memory SQLite shop with purchases of products 5 (by M), 6 (by FE) and 7 (by both)"""
+    storage = SQLiteStorage()
+    conn = storage.connect()
+    recent = datetime.now() - timedelta(days=1)
+    conn.executemany("INSERT INTO users (id, genderId, roleId) VALUES (?, ?, 'R2')", [(1, 'M'), (2, 'FE')])
+    conn.executemany("INSERT INTO products (id, name, statusId, categoryId, brandId, updatedAt) VALUES (?, ?, 'S1', 'giay', 'nike', ?)",
+                     [(p, f'P{p}', recent) for p in (5, 6, 7, 8)])
+    conn.executemany("INSERT INTO interactions (userId, productId, actionCode, timestamp) VALUES (?, ?, ?, ?)",
+                     [(1, 5, 'purchase', recent), (1, 5, 'purchase', recent), (2, 6, 'purchase', recent),
+                      (1, 7, 'view', recent), (2, 7, 'cart', recent)])
+    monkeypatch.setattr(recommend_api, 'STORAGE', storage)
+    yield storage
+    conn.close()
+
+
+def test_priors_for_a_single_product(shop):
+    priors = bare_system()._context_priors({'gender': 'M', 'time_of_day': 'evening'}, np.array([5]))
+    assert priors.tolist() == [1.0]
+
+
+def test_priors_are_normalized_and_filtered_by_gender(shop):
+    system = bare_system()
+    everyone = system._context_priors({'gender': 'unknown', 'time_of_day': 'evening'}, np.array([5, 6, 7, 8]))
+    assert np.allclose(everyone, [1.0, 0.5, 0.5, 0.0])
+    women = system._context_priors({'gender': 'FE', 'time_of_day': 'evening'}, np.array([5, 6, 7]))
+    assert np.allclose(women, [0.0, 1.0, 2 / 3])
+    assert len(system._context_priors({}, np.zeros(0, dtype=np.int64))) == 0
+
+
+class FakeLookups:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def load(self, name, user_id):
+        return self.rows.get(name, [])
+
+
+class FirstArm:
+    settler = 'background'
+
+    def choose(self, segment, arms):
+        return arms[0]
+
+
+def test_auto_segment_uses_the_resolved_device():
+    system = bare_system()
+    system.models = {'BMF': object(), 'Popularity': 'fallback'}
+    system.bandit = FirstArm()
+    system.lookups = FakeLookups({'history_count': [{'cnt': 12}], 'gender': [{'genderId': 'M'}],
+                                  'last_device': [{'device_type': 'tablet'}]})
+    assert system.choose_model(1) == ('BMF', 'tablet:warm')
+    assert system.choose_model(1, {'device_type': 'mobile'}) == ('BMF', 'mobile:warm')
+    system.lookups = FakeLookups({})
+    assert system.choose_model(1) == ('BMF', 'unknown:cold')
+
+
+def test_materialized_buckets_match_the_requests_they_serve():
+    system = bare_system()
+    system.context_encoders = {'device': LabelEncoder().fit(['desktop', 'mobile', 'unknown'])}
+    seasons = ['winter'] * 2 + ['spring'] * 3 + ['summer'] * 3 + ['autumn'] * 3 + ['winter']
+    for day in (datetime(2026, 1, 3), datetime(2026, 4, 15), datetime(2026, 8, 2), datetime(2026, 11, 30)):
+        for hour in range(24):
+            when = day + timedelta(hours=hour, minutes=37)
+            user = {'device_type': 'mobile', 'gender': 'FE', 'preferred_categories': [], 'preferred_brands': []}
+            # As the Node API's deriveContext sends it
+            request = dict(user, hour=when.hour, month=when.month, day_of_week=when.isoweekday(),
+                           is_weekend=1 if when.weekday() >= 5 else 0, season=seasons[when.month - 1],
+                           time_of_day=('night', 'morning', 'afternoon', 'evening')[when.hour // 6])
+            served = bucket_of(system._encm_context_row(system.get_user_context(1, request)))
+            materialized = bucket_of(system._encm_context_row(system.get_user_context(
+                1, dict(user, **bucket_time_context(bucket_start(when))))))
+            assert served == materialized
+
+
+def test_reshard_publishes_whole_tables_for_the_owned_users(bmf_tables, monkeypatch):
+    nodes = ['http://a:8010', 'http://b:8010', 'http://c:8010']
+    monkeypatch.setattr(recommend_api, 'RECO_SHARD_SELF', nodes[1])
+    system = bare_system()
+    system._derived_lock = threading.Lock()
+    system.tables = {'BMF': bmf_tables}
+    # Encoder classes past the 20 trained rows are padding
+    system._shard_classes = np.arange(100, 124)
+    system._shard_users = {'BMF': (bmf_tables.user_vectors, bmf_tables.user_bias)}
+    ring = HashRing(nodes)
+    owned = [u for u in range(100, 120) if ring.node_for(u) == nodes[1]]
+    assert system.reshard(ring) == len(owned) == system.shard_users
+    tables = system.tables['BMF']
+    assert tables is not bmf_tables and len(bmf_tables.user_vectors) == 20
+    assert tables.user_encoder.classes_.tolist() == owned
+    assert np.array_equal(tables.user_vectors, bmf_tables.user_vectors[np.array(owned) - 100])
+    assert np.array_equal(tables.user_bias, bmf_tables.user_bias[np.array(owned) - 100])
+    assert tables.item_vectors is bmf_tables.item_vectors
+
+
+def legacy_context_features(system, products_df, product_ids, context):
+    """The row-by-row ENCM matrix the vectorized build replaced; labels unseen in training map to
+    'unknown', where the old transform() calls raised"""
+    def encode(name, value):
+        encoder = system.context_encoders[name]
+        return encoder.transform([value if value in encoder.classes_ else 'unknown'])[0]
+
+    time_of_day_map = {'night': 0, 'morning': 1, 'afternoon': 2, 'evening': 3}
+    season_map = {'winter': 0, 'spring': 1, 'summer': 2, 'autumn': 3}
+    gender_map = {'M': 0, 'FE': 1, 'O': 2}
+    rows = []
+    for pid in product_ids:
+        product_row = products_df[products_df['id'] == pid]
+        if product_row.empty:
+            rows.append([0] * 10)
+            continue
+        prod = product_row.iloc[0]
+        rows.append([
+            encode('category', prod['categoryId'] or 'unknown'), encode('brand', prod['brandId'] or 'unknown'),
+            encode('device', context.get('device_type', 'unknown')),
+            time_of_day_map.get(context.get('time_of_day', 'morning'), 1),
+            season_map.get(context.get('season', 'summer'), 2),
+            gender_map.get(context.get('gender', 'M'), 3),
+            context.get('hour', 12), context.get('month', 5), context.get('day_of_week', 0),
+            context.get('is_weekend', 0),
+        ])
+    return np.array(rows, dtype=np.int32)
+
+
+def test_encm_context_matrix_matches_the_row_by_row_build():
+    system = bare_system()
+    system._derived_lock = threading.Lock()
+    system._encm_codes = None
+    system.context_encoders = {
+        'category': LabelEncoder().fit(['ao', 'giay', 'unknown']),
+        'brand': LabelEncoder().fit(['adidas', 'nike', 'unknown']),
+        'device': LabelEncoder().fit(['desktop', 'mobile', 'unknown']),
+    }
+    catalog = CatalogSnapshot.from_rows([
+        (5, 'P5', 'giay', 'nike', 'S1', None), (6, 'P6', None, 'adidas', 'S1', None),
+        (7, 'P7', 'mu', None, 'S1', None), (8, 'P8', 'ao', 'puma', 'S1', None),
+    ], version=1)
+    product_ids = np.array([8, 5, 99, 7, 6])
+    contexts = [
+        {'device_type': 'mobile', 'time_of_day': 'evening', 'season': 'winter', 'gender': 'FE',
+         'hour': 20, 'month': 11, 'day_of_week': 5, 'is_weekend': 1},
+        {'device_type': 'tablet', 'gender': 'unknown'},
+        {'device_type': 'unknown', 'gender': 'O', 'time_of_day': 2},
+    ]
+    for context in contexts:
+        vectorized = system._encm_context_features(catalog, catalog.positions_of(product_ids), context)
+        assert vectorized.tolist() == legacy_context_features(system, catalog.to_frame(), product_ids, context).tolist()
+
+
+def test_catalog_position_helpers_match_the_dataframe_lookups():
+    catalog = CatalogSnapshot.from_rows([
+        (5, 'P5', 'giay', 'nike', 'S1', None), (6, 'P6', None, 'adidas', 'S1', None),
+        (7, 'P7', 'ao', None, 'S1', None),
+    ], version=1)
+    product_ids = np.array([7, 99, 5, 6])
+    positions = catalog.positions_of(product_ids)
+    frame = catalog.to_frame().set_index('id')
+
+    brand_hit, category_hit = TrainedRecommendationSystem._preference_masks(catalog, positions, ['nike'], ['ao'])
+    expected_brand = [pid in frame.index and frame.loc[pid, 'brandId'] == 'nike' for pid in product_ids]
+    expected_category = [pid in frame.index and frame.loc[pid, 'categoryId'] == 'ao' for pid in product_ids]
+    assert brand_hit.tolist() == expected_brand and category_hit.tolist() == expected_category
+
+    assert TrainedRecommendationSystem._display_fields(catalog, positions) == [
+        ('P7', 'Unknown Brand'), (None, 'Unknown Brand'), ('P5', 'nike'), ('P6', 'adidas')]
+
+    priors = pd.DataFrame({'productId': [5, 7], 'pop_score': [4, 2]})
+    assert TrainedRecommendationSystem._prior_vector(priors, product_ids).tolist() == [0.5, 0.0, 1.0, 0.0]
+    assert TrainedRecommendationSystem._prior_vector(priors.iloc[:0], product_ids).tolist() == [0.0] * 4
+
+
+class StubPopular:
+    """PopularItems whose first refresh fills `rows`"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.refreshed_at = 0.0
+        self.ranked = []
+
+    def refresh_if_empty(self, conn):
+        self.ranked, self.refreshed_at = self.rows, 1.0
+
+    def top(self):
+        return self.ranked
+
+
+def popularity_system(rows):
+    system = bare_system()
+    system._db_local.conn = object()
+    system.popular = StubPopular(rows)
+    system.bitsets = CatalogBitsets()
+    system.catalog_cache = CatalogCache.__new__(CatalogCache)
+    system.catalog_cache.current = CatalogSnapshot.from_rows(
+        [(p, f'P{p}', 'giay', 'nike', 'S2' if p == 6 else 'S1', None) for p in (5, 6, 7, 8)], version=1)
+    return system
+
+
+def test_popularity_tier_fills_an_empty_list_before_answering():
+    system = popularity_system([(7, 1.0), (6, 0.9), (5, 0.5)])
+    result = system.popular_response(limit=2)
+    assert result['ok'] and [item['productId'] for item in result['items']] == [7, 5]
+    # Short lists are padded from the active catalog
+    assert [item['productId'] for item in system.popular_response(limit=4)['items']] == [7, 5, 8]
+
+
+def test_popularity_tier_without_any_list_is_an_error():
+    system = popularity_system([])
+    assert [item['productId'] for item in system.popular_response(limit=2)['items']] == [5, 7]
+    system.catalog_cache.current = CatalogSnapshot()
+    assert not system.popular_response(limit=2)['ok']
+
+
+def test_encm_ranking_calibrates_warm_users_and_pads_by_prior():
+    scores = np.array([0.50, 0.48, 0.20, 0.10], dtype=np.float32)
+    priors = np.array([0.0, 1.0, 0.9, 0.5], dtype=np.float32)
+    brand_hit = np.array([False, False, True, False])
+    category_hit = np.zeros(4, dtype=bool)
+    top, final = TrainedRecommendationSystem._encm_ranking(scores, priors, brand_hit, category_hit, True, 50, 2)
+    assert list(top) == [1, 0] and np.allclose(final, encm_calibrated(scores, priors, brand_hit))
+    top, item_scores = TrainedRecommendationSystem._pad_by_prior(top[:1], final, priors, 3)
+    assert top == [1, 2, 3] and item_scores[1:] == [pytest.approx(0.9), 0.5]
+
+
+def test_encm_ranking_puts_preferred_items_first_for_cold_users():
+    scores = np.array([0.9, 0.8, 0.1, 0.0], dtype=np.float32)
+    priors = np.array([0.1, 0.2, 0.3, 0.6], dtype=np.float32)
+    brand_hit = np.array([False, False, True, True])
+    category_hit = np.zeros(4, dtype=bool)
+    top, _ = TrainedRecommendationSystem._encm_ranking(scores, priors, brand_hit, category_hit, True, 2, 4)
+    assert list(top[:2]) == [3, 2]
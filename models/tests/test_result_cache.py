@@ -0,0 +1,35 @@
+from result_cache import ResultCache
+
+
+def test_get_returns_the_stored_result_per_user_and_model():
+    cache = ResultCache()
+    cache.put(7, 'ENCM', {'items': [1]})
+    assert cache.get('7', 'ENCM') == {'items': [1]}
+    assert cache.get(7, 'BMF') is None
+
+
+def test_entries_expire_after_the_ttl():
+    cache = ResultCache(ttl=-1)
+    cache.put(7, 'ENCM', {'items': [1]})
+    assert cache.get(7, 'ENCM') is None
+    assert not cache._entries
+
+
+def test_least_recently_used_is_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put(1, 'ENCM', 'a')
+    cache.put(2, 'ENCM', 'b')
+    cache.get(1, 'ENCM')
+    cache.put(3, 'ENCM', 'c')
+    assert cache.get(2, 'ENCM') is None
+    assert cache.get(1, 'ENCM') == 'a' and cache.get(3, 'ENCM') == 'c'
+
+
+def test_invalidate_user_drops_every_model():
+    cache = ResultCache()
+    for model in ('ENCM', 'BMF'):
+        cache.put(7, model, model)
+    cache.put(8, 'ENCM', 'other')
+    cache.invalidate_user(7)
+    assert cache.get(7, 'ENCM') is None and cache.get(7, 'BMF') is None
+    assert cache.get(8, 'ENCM') == 'other'
@@ -0,0 +1,51 @@
+import numpy as np
+
+import session_store
+from session_store import SessionStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_keeps_the_last_views_oldest_first():
+    sessions = SessionStore(max_views=3)
+    for product_id in [5, 6, 7, 8]:
+        sessions.record_view(1, product_id)
+    assert list(sessions.recent('1')) == [6, 7, 8]
+    assert len(sessions.recent(2)) == 0
+
+
+def test_idle_sessions_end(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_store.time, 'monotonic', clock)
+    sessions = SessionStore(idle=60)
+    sessions.record_view(1, 5)
+    clock.now += 61
+    assert len(sessions.recent(1)) == 0
+    sessions.record_view(1, 6)
+    assert list(sessions.recent(1)) == [6]
+
+
+def test_least_recent_users_are_evicted():
+    sessions = SessionStore(max_users=2)
+    sessions.record_view(1, 5)
+    sessions.record_view(2, 5)
+    sessions.record_view(1, 6)
+    sessions.record_view(3, 5)
+    assert len(sessions) == 2
+    assert len(sessions.recent(2)) == 0 and list(sessions.recent(1)) == [5, 6]
+
+
+def test_session_similarity_is_cosine_to_the_mean_unit_item(bmf_tables):
+    rows = np.arange(30)
+    assert np.isclose(bmf_tables.session_similarity(rows, [3])[3], 1.0)
+    items = bmf_tables.item_vectors
+    units = items / np.linalg.norm(items, axis=1, keepdims=True)
+    anchor = units[[3, 8, 8]].mean(axis=0)
+    expected = units @ (anchor / np.linalg.norm(anchor))
+    assert np.allclose(bmf_tables.session_similarity(rows, [3, 8, 8]), expected, atol=1e-5)
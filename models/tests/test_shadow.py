@@ -0,0 +1,47 @@
+import numpy as np
+
+from shadow import ShadowScorer, encode_record, read_shadow_log
+
+
+def scorer_for(results, path, **kwargs):
+    def score(user_id, model_name, limit, context, filters):
+        return results[model_name]
+    return ShadowScorer(score, challengers=['BMF', 'ENCM', 'NCF'], path=str(path), **kwargs)
+
+
+def served(model_name, ids):
+    return {'ok': True, 'model': model_name, 'items': [{'productId': p, 'score': 0.5} for p in ids]}
+
+
+def test_log_records_round_trip_and_skip_a_torn_tail(tmp_path):
+    path = tmp_path / 'shadow.log'
+    first = encode_record(1.5, 7, 'BMF', 'ENCM', [1, 2, 3], [3, 1], [0.75, 0.25])
+    second = encode_record(2.5, 8, 'BMF', 'ENCM', [4], [4], [1.0])
+    path.write_bytes(first + second[:-3])
+    records = list(read_shadow_log(str(path)))
+    assert len(records) == 1
+    record = records[0]
+    assert (record['ts'], record['user_id'], record['primary_model'], record['challenger_model']) == (1.5, 7, 'BMF', 'ENCM')
+    assert record['primary_ids'].tolist() == [1, 2, 3] and record['challenger_ids'].tolist() == [3, 1]
+    assert np.allclose(record['challenger_scores'], [0.75, 0.25])
+
+
+def test_challengers_that_fell_back_are_skipped(tmp_path):
+    path = tmp_path / 'shadow.log'
+    shadow = scorer_for({'ENCM': served('ENCM', [9, 8]), 'NCF': served('Popularity', [1])}, path)
+    shadow._run((1.0, 7, 'BMF', [8, 9], 2, {}, None))
+    assert shadow.stats['scored'] == 1 and shadow.stats['skipped'] == 1
+    records = list(read_shadow_log(str(path)))
+    assert [r['challenger_model'] for r in records] == ['ENCM']
+    assert records[0]['challenger_ids'].tolist() == [9, 8]
+
+
+def test_submit_only_queues_once_started_and_drops_when_full(tmp_path):
+    shadow = scorer_for({}, tmp_path / 'shadow.log', max_queue=1)
+    response = served('BMF', [1])
+    assert not shadow.submit(7, response, 1, {}, None)
+    shadow._started = True
+    assert not shadow.submit(7, {'ok': False}, 1, {}, None)
+    assert shadow.submit(7, response, 1, {}, None)
+    assert not shadow.submit(7, response, 1, {}, None)
+    assert shadow.stats['queued'] == 1 and shadow.stats['sampled_out'] + shadow.stats['dropped'] == 1
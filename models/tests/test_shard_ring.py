@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+
+from shard_ring import HashRing, Membership
+
+NODES = [f"http://10.0.0.{i}:8010" for i in range(1, 5)]
+USERS = range(4000)
+
+
+def owners(ring):
+    return {u: ring.node_for(u) for u in USERS}
+
+
+def test_users_spread_over_the_nodes():
+    counts = np.unique(list(owners(HashRing(NODES)).values()), return_counts=True)[1]
+    assert len(counts) == 4 and counts.min() > 0.6 * len(USERS) / 4
+
+
+def test_join_and_leave_only_move_the_changed_arcs():
+    before = owners(HashRing(NODES))
+    joined = owners(HashRing(NODES + ['http://10.0.0.5:8010']))
+    moved = [u for u in USERS if joined[u] != before[u]]
+    assert all(joined[u] == 'http://10.0.0.5:8010' for u in moved)
+    assert 0.1 * len(USERS) < len(moved) < 0.3 * len(USERS)
+
+    left = owners(HashRing(NODES[1:]))
+    moved = [u for u in USERS if left[u] != before[u]]
+    assert sorted(moved) == [u for u in USERS if before[u] == NODES[0]]
+
+
+def test_exclude_falls_through_to_the_next_node():
+    ring = HashRing(NODES)
+    for user_id in range(50):
+        owner = ring.node_for(user_id)
+        fallback = ring.node_for(user_id, exclude={owner})
+        assert fallback != owner and fallback == HashRing(set(NODES) - {owner}).node_for(user_id)
+    assert ring.node_for(1, exclude=set(NODES)) is None and HashRing().node_for(1) is None
+    mask = ring.owned_mask(NODES[2], list(range(100)))
+    assert mask.tolist() == [ring.node_for(u) == NODES[2] for u in range(100)]
+
+
+def test_membership_follows_the_file(tmp_path):
+    path = str(tmp_path / 'nodes.json')
+    membership = Membership(path, fixed_nodes=[])
+    assert membership.ring().nodes == [] and membership.version == 0
+    membership.write([NODES[0] + '/', NODES[1]])
+    assert membership.ring().nodes == NODES[:2] and membership.version == 1
+    membership.write(NODES[:3])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    membership._checked_at = 0.0
+    assert membership.ring().nodes == NODES[:3] and membership.version == 2
+
+    fixed = Membership(path, fixed_nodes=NODES)
+    assert fixed.ring().nodes == sorted(NODES)
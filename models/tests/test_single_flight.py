@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight, request_key
+
+
+def test_concurrent_calls_for_one_key_run_once():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'ok': True}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('k', compute)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('k', compute))) for _ in range(5)]
+    for t in followers:
+        t.start()
+    while flight.stats['coalesced'] < 5:
+        time.sleep(0.001)
+    release.set()
+    for t in [leader] + followers:
+        t.join()
+    assert len(calls) == 1 and len(results) == 6 and all(r is results[0] for r in results)
+    assert flight.stats == {'leaders': 1, 'coalesced': 5}
+
+
+def test_leader_error_reaches_followers_and_the_key_is_released():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('scoring failed')
+
+    errors = []
+
+    def call():
+        try:
+            flight.do('k', fail)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    while flight.stats['coalesced'] < 1:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    assert len(errors) == 2
+    assert flight.do('k', lambda: 'fresh') == 'fresh'
+
+
+def test_request_key_compares_context_and_filters_by_value():
+    a = request_key(7, 'ENCM', 10, {'device_type': 'mobile', 'gender': 'M'}, {'brands': ['nike']})
+    b = request_key('7', 'ENCM', '10', {'gender': 'M', 'device_type': 'mobile'}, {'brands': ['nike']})
+    assert a == b
+    assert a != request_key(7, 'ENCM', 10, {'device_type': 'mobile', 'gender': 'M'})
+    assert request_key(7, 'ENCM', 10, {}, product_ids=[1, 2]) != request_key(7, 'ENCM', 10, {}, product_ids=[2, 1])
+
+
+def test_do_propagates_errors_without_followers():
+    with pytest.raises(ValueError):
+        SingleFlight().do('k', lambda: int('x'))
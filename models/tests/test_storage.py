@@ -0,0 +1,72 @@
+import pickle
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+import pytest
+from sklearn.preprocessing import LabelEncoder
+
+from storage import SQLiteStorage, _utc_offset, load_csv, make_storage
+
+
+@pytest.fixture
+def storage():
+    return SQLiteStorage()
+
+
+def one(conn, sql, params=()):
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    row = cur.fetchone()
+    cur.close()
+    return row[0]
+
+
+def test_dialect_expressions_match_python(storage):
+    conn = storage.connect()
+    # Sunday evening, shop-local
+    when = datetime(2026, 3, 8, 21, 15, 30)
+    conn.execute("INSERT INTO interactions (userId, productId, timestamp) VALUES (1, 2, ?)", (when,))
+    assert one(conn, f"SELECT {storage.hour('timestamp')} FROM interactions") == 21
+    assert one(conn, f"SELECT {storage.weekday('timestamp')} FROM interactions") == when.weekday() == 6
+    utc = when.replace(tzinfo=timezone(_utc_offset()))
+    assert one(conn, f"SELECT {storage.unix_time('timestamp')} FROM interactions") == int(utc.timestamp())
+    local_now = datetime.now(timezone.utc).replace(tzinfo=None) + _utc_offset()
+    days_ago = datetime.fromisoformat(one(conn, f"SELECT {storage.days_ago(3)}"))
+    assert abs(days_ago - (local_now - timedelta(days=3))) < timedelta(seconds=5)
+
+
+def test_percent_s_placeholders_and_timestamps_round_trip(storage):
+    conn = storage.connect()
+    when = datetime(2026, 1, 2, 3, 4, 5)
+    conn.cursor().execute("INSERT INTO products (id, name, updatedAt) VALUES (%s, %s, %s)", (5, 'P5', when))
+    # A second connection sees the same in-memory database
+    other = storage.connect()
+    assert one(other, "SELECT updatedAt FROM products WHERE id = %s", (5,)) == when
+    assert pd.read_sql("SELECT name FROM products", other)['name'].tolist() == ['P5']
+
+
+def test_load_csv_restores_codes_and_shifts_to_now(storage, tmp_path):
+    categories = LabelEncoder().fit(['ao', 'giay'])
+    brands = LabelEncoder().fit(['adidas', 'nike'])
+    with open(tmp_path / 'context_encoders.pkl', 'wb') as f:
+        pickle.dump({'category': categories, 'brand': brands}, f)
+    pd.DataFrame({
+        'userId': [1, 1, 2], 'productId': [5, 6, 5], 'actionCode': ['view', 'purchase', 'cart'],
+        'device_type': ['mobile', None, 'desktop'], 'gender_encoded': [0, 0, 1],
+        'category_encoded': [1, 0, 1], 'brand_encoded': [1, 0, 1],
+        'timestamp': ['2024-01-01 10:00:00', '2024-01-02 10:00:00', '2024-01-03 10:00:00'],
+    }).to_csv(tmp_path / 'part.csv', index=False)
+    assert load_csv(storage, str(tmp_path), now=True) == {'users': 2, 'products': 2, 'interactions': 3}
+    conn = storage.connect()
+    products = pd.read_sql("SELECT id, categoryId, brandId FROM products ORDER BY id", conn)
+    assert products.values.tolist() == [[5, 'giay', 'nike'], [6, 'ao', 'adidas']]
+    assert pd.read_sql("SELECT genderId FROM users ORDER BY id", conn)['genderId'].tolist() == ['M', 'FE']
+    newest = one(conn, "SELECT MAX(timestamp) FROM interactions")
+    local_now = datetime.now(timezone.utc).replace(tzinfo=None) + _utc_offset()
+    assert abs(datetime.fromisoformat(newest) - local_now) < timedelta(seconds=5)
+    assert one(conn, "SELECT COUNT(*) FROM interactions WHERE device_type IS NULL") == 1
+
+
+def test_unknown_backends_are_rejected():
+    with pytest.raises(ValueError):
+        make_storage('postgres')